@@ -1,8 +1,74 @@
-from .kaleidoscope_sdk import Client
-from .kaleidoscope_sdk import Model
-from .kaleidoscope_sdk import GatewaySession
+"""Public API of the Kaleidoscope SDK
+
+Attributes are imported on first access so that `import kscope` stays cheap, and heavy
+dependencies such as torch or cloudpickle are only loaded by the features that use them.
+"""
+
+import importlib
 
 # SDK metadata
 __version__ = "0.11.0"
 __author__ = "Vector AI Engineering"
 __credits__ = "Vector Institute"
+
+_LAZY_ATTRIBUTES = {
+    "Client": ".kaleidoscope_sdk",
+    "Model": ".kaleidoscope_sdk",
+    "GatewaySession": ".kaleidoscope_sdk",
+    "NotSupportedError": ".kaleidoscope_sdk",
+    "AsyncClient": ".async_sdk",
+    "AsyncModel": ".async_sdk",
+    "AsyncGatewaySession": ".async_sdk",
+    "ActivationStore": ".activations",
+    "TokenManager": ".auth",
+    "GenerationCache": ".cache",
+    "AdaptiveConcurrencyLimiter": ".flow_control",
+    "TokenBucket": ".flow_control",
+    "HedgingPolicy": ".hedging",
+    "Metrics": ".metrics",
+    "Generation": ".generation",
+    "GenerationBatch": ".generation",
+    "ModelLoadError": ".readiness",
+    "ModelRegistry": ".registry",
+    "ModelPool": ".pool",
+    "GatewayError": ".utils",
+}
+_SUBMODULES = {
+    "activations",
+    "arrow",
+    "async_sdk",
+    "auth",
+    "batching",
+    "cache",
+    "cli",
+    "flow_control",
+    "generation",
+    "hedging",
+    "hooks",
+    "kaleidoscope_sdk",
+    "metrics",
+    "pool",
+    "readiness",
+    "registry",
+    "serialization",
+    "utils",
+    "wire",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module(f".{name}", __name__)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES) | _SUBMODULES)
@@ -0,0 +1,255 @@
+"""An on-disk store of per-module activations, filled batch by batch and read lazily
+
+Each batch of prompts answered by the gateway is a tensor frame, see
+:mod:`kscope.serialization`, streamed straight into its own chunk file. A frame holds one
+array per module, with the rows of every prompt of the batch concatenated, and the number
+of rows of each prompt in its metadata. An ``index.json`` file maps prompts to chunks::
+
+    activations/
+        index.json
+        chunk-000000.kst
+        chunk-000001.kst
+        ...
+
+Reopening a store only reads the index, chunks are memory mapped when first accessed.
+"""
+
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from .serialization import load_tensors
+
+INDEX_FILE = "index.json"
+CHUNK_SUFFIX = ".kst"
+FORMAT_VERSION = 1
+
+
+class ActivationStore:
+    """Activations of a set of modules for a sequence of prompts
+
+    `store[module][i]` is the activation of `module` for prompt `i`, a read-only array of
+    one row per token of the prompt, or whatever rows the gateway returned for it.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """Opens an existing store
+
+        :param path: (str or Path) Directory of the store
+        :raises FileNotFoundError: If the directory holds no store
+        """
+        self.path = Path(path)
+        index = json.loads((self.path / INDEX_FILE).read_text(encoding="utf-8"))
+        if index["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported activation store version {index['version']}")
+        self._modules = index["modules"]
+        self._chunks = [chunk["file"] for chunk in index["chunks"]]
+        self._length = index["num_prompts"]
+
+        # Chunk and position within the chunk of every prompt
+        self._chunk_of = np.full(self._length, -1, dtype=np.int64)
+        self._position = np.zeros(self._length, dtype=np.int64)
+        for chunk_id, chunk in enumerate(index["chunks"]):
+            indices = np.asarray(chunk["indices"], dtype=np.int64)
+            self._chunk_of[indices] = chunk_id
+            self._position[indices] = np.arange(len(indices))
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(
+        cls, path: Union[str, Path], module_names: Sequence[str]
+    ) -> "ActivationStoreWriter":
+        """Creates an empty store, see :class:`ActivationStoreWriter`
+
+        :raises FileExistsError: If the directory already holds a store
+        """
+        return ActivationStoreWriter(path, module_names)
+
+    @property
+    def module_names(self) -> List[str]:
+        return list(self._modules)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __contains__(self, module_name: str) -> bool:
+        return module_name in self._modules
+
+    def __getitem__(self, module_name: str) -> "ModuleActivations":
+        if module_name not in self._modules:
+            raise KeyError(f"No activations stored for module {module_name}")
+        return ModuleActivations(self, module_name)
+
+    def get(self, module_name: str, index: int) -> np.ndarray:
+        """Returns the activation of a module for the prompt at position `index`"""
+        if module_name not in self._modules:
+            raise KeyError(f"No activations stored for module {module_name}")
+        if not -self._length <= index < self._length:
+            raise IndexError(f"Prompt {index} out of range for {self._length} prompts")
+        chunk_id = self._chunk_of[index]
+        if chunk_id < 0:
+            raise KeyError(f"No activations stored for prompt {index}")
+        arrays, offsets = self._load(int(chunk_id))
+        position = self._position[index]
+        start, stop = offsets[module_name][position : position + 2]
+        return arrays[module_name][start:stop]
+
+    def __repr__(self):
+        return f"ActivationStore({str(self.path)!r}, prompts={self._length}, modules={self.module_names})"
+
+    def _load(
+        self, chunk_id: int
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        loaded = self._loaded.get(chunk_id)
+        if loaded is None:
+            with self._lock:
+                loaded = self._loaded.get(chunk_id)
+                if loaded is None:
+                    arrays, metadata = load_tensors(self.path / self._chunks[chunk_id])
+                    offsets = {
+                        name: _offsets(lengths)
+                        for name, lengths in metadata["lengths"].items()
+                    }
+                    loaded = self._loaded[chunk_id] = (arrays, offsets)
+        return loaded
+
+
+class ModuleActivations:
+    """The activations of one module, indexed by prompt"""
+
+    def __init__(self, store: ActivationStore, module_name: str):
+        self.store = store
+        self.module_name = module_name
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(self.store._modules[self.module_name]["dtype"])
+
+    @property
+    def feature_shape(self) -> Tuple[int, ...]:
+        """Shape of each row, e.g. `(hidden_size,)`"""
+        return tuple(self.store._modules[self.module_name]["feature_shape"])
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.store.get(self.module_name, index)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+class ActivationStoreWriter:
+    """Adds chunks to a new store, which is readable once the writer is closed
+
+    Chunks may be added from several threads and in any order of prompts. The index is
+    rewritten every `flush_every` chunks, so that an interrupted run leaves a readable
+    store of the chunks completed so far.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        module_names: Sequence[str],
+        flush_every: int = 64,
+    ):
+        self.path = Path(path)
+        if (self.path / INDEX_FILE).exists():
+            raise FileExistsError(f"{self.path} already holds an activation store")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.module_names = list(module_names)
+        self.flush_every = flush_every
+
+        self._modules = {}
+        self._chunks = []
+        self._num_prompts = 0
+        self._next_chunk = 0
+        self._unflushed = 0
+        self._lock = threading.Lock()
+
+    def new_chunk_path(self) -> Path:
+        """Reserves the path of a chunk file, to write a frame into"""
+        with self._lock:
+            name = f"chunk-{self._next_chunk:06d}{CHUNK_SUFFIX}"
+            self._next_chunk += 1
+        return self.path / name
+
+    def add_chunk(
+        self,
+        chunk_path: Path,
+        indices: List[int],
+        arrays: Dict[str, np.ndarray],
+        metadata: Dict,
+    ):
+        """Records a chunk file holding the activations of the prompts at `indices`
+
+        :param arrays: (dict) The arrays of the chunk by module, as decoded from it
+        :param metadata: (dict) The metadata of the chunk, with the number of rows of each
+        prompt under "lengths"
+        :raises ValueError: If the chunk does not match the prompts and modules of the store
+        """
+        modules = {}
+        for name in self.module_names:
+            if name not in arrays:
+                raise ValueError(f"The gateway returned no activations for {name}")
+            lengths = metadata.get("lengths", {}).get(name)
+            if lengths is None or len(lengths) != len(indices):
+                raise ValueError(
+                    f"Expected the rows of {len(indices)} prompts for {name}"
+                )
+            array = arrays[name]
+            if sum(lengths) != len(array):
+                raise ValueError(
+                    f"{name} has {len(array)} rows, expected {sum(lengths)}"
+                )
+            modules[name] = {
+                "dtype": array.dtype.str,
+                "feature_shape": list(array.shape[1:]),
+            }
+
+        with self._lock:
+            for name, spec in modules.items():
+                expected = self._modules.setdefault(name, spec)
+                if expected != spec:
+                    raise ValueError(
+                        f"Activations of {name} changed from {expected} to {spec}"
+                    )
+            self._chunks.append({"file": chunk_path.name, "indices": list(indices)})
+            self._num_prompts = max(self._num_prompts, max(indices, default=-1) + 1)
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                self._flush()
+
+    def close(self) -> ActivationStore:
+        """Writes the index and reopens the store for reading"""
+        with self._lock:
+            self._flush()
+        return ActivationStore(self.path)
+
+    def _flush(self):
+        index = {
+            "version": FORMAT_VERSION,
+            "num_prompts": self._num_prompts,
+            "modules": {
+                name: self._modules.get(name, {"dtype": None, "feature_shape": None})
+                for name in self.module_names
+            },
+            "chunks": sorted(self._chunks, key=lambda chunk: chunk["file"]),
+        }
+        tmp_path = self.path / (INDEX_FILE + ".tmp")
+        tmp_path.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(tmp_path, self.path / INDEX_FILE)
+        self._unflushed = 0
+
+
+def _offsets(lengths: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
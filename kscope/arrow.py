@@ -0,0 +1,370 @@
+"""Generation over Arrow tables, pandas data frames and Parquet files
+
+Generated sequences, tokens and logprobs are added as columns next to the prompts, the
+tokens as a ``list<string>`` column and the logprobs as a ``list<float>`` column built
+directly from the buffers of :class:`GenerationBatch`. Rows with a null prompt get null
+generations.
+
+:func:`generate_parquet` streams a Parquet file, or any iterable of record batches, through
+the model and into another Parquet file one row group at a time, so tables larger than
+memory can be processed.
+
+Requires the optional ``pyarrow`` dependency, install it with ``pip install kscope[arrow]``.
+"""
+
+from bisect import bisect_right
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+from .batching import MAX_BATCH_SIZE
+from .generation import GenerationBatch
+
+SEQUENCE_COLUMN = "sequence"
+TOKENS_COLUMN = "tokens"
+LOGPROBS_COLUMN = "logprobs"
+
+DEFAULT_ROW_GROUP_SIZE = 4096
+# Row groups read but not yet written by generate_parquet
+DEFAULT_MAX_PENDING_ROW_GROUPS = 4
+
+
+def generation_arrays(batch: GenerationBatch) -> Dict[str, object]:
+    """Converts a batch into Arrow arrays, one row per prompt
+
+    :return: The "sequence", "tokens" and "logprobs" arrays by name
+    """
+    pa = _import_pyarrow()
+    token_offsets = np.zeros(len(batch) + 1, dtype=np.int32)
+    np.cumsum([len(tokens) for tokens in batch.tokens], out=token_offsets[1:])
+    flat_tokens = pa.array(
+        [token for tokens in batch.tokens for token in tokens], type=pa.string()
+    )
+    return {
+        SEQUENCE_COLUMN: pa.array(batch.sequences, type=pa.string()),
+        TOKENS_COLUMN: pa.ListArray.from_arrays(pa.array(token_offsets), flat_tokens),
+        LOGPROBS_COLUMN: pa.ListArray.from_arrays(
+            pa.array(batch.offsets.astype(np.int32)),
+            pa.array(batch.logprobs, type=pa.float32()),
+        ),
+    }
+
+
+def generate_column(
+    model,
+    prompts,
+    generation_config: Dict = {},
+    max_batch: int = MAX_BATCH_SIZE,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    prefix: str = "",
+):
+    """Generates text for a column of prompts
+
+    :param model: (Model) The model to generate with
+    :param prompts: The prompts, as an Arrow array or chunked array, a pandas series or
+    a list of strings, possibly with nulls
+    :param generation_config: (dict) Additional arguments to pass to the model
+    :param max_batch: (int) Maximum number of prompts per request
+    :param concurrency: (int) Maximum number of requests in flight
+    :param max_retries: (int) Number of times a failed batch is retried
+    :param prefix: (str) Prefix of the names of the generated columns
+    :return: (pyarrow.Table) The generated columns, with one row per prompt
+    """
+    pa = _import_pyarrow()
+    values = _to_pylist(prompts)
+    rows = [i for i, prompt in enumerate(values) if prompt is not None]
+    batch = None
+    if rows:
+        batch = model.generate_many(
+            [values[i] for i in rows],
+            generation_config,
+            max_batch=max_batch,
+            concurrency=concurrency,
+            max_retries=max_retries,
+        )
+    arrays = _scatter(batch, rows, len(values))
+    return pa.table({prefix + name: array for name, array in arrays.items()})
+
+
+def generate_table(
+    model,
+    data,
+    prompt_column: str = "prompt",
+    generation_config: Dict = {},
+    max_batch: int = MAX_BATCH_SIZE,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    prefix: str = "",
+):
+    """Generates text for a column of prompts, returning the data with generated columns
+
+    :param model: (Model) The model to generate with
+    :param data: A pyarrow Table or RecordBatch, or a pandas DataFrame
+    :param prompt_column: (str) Name of the column of prompts
+    :param prefix: (str) Prefix of the names of the generated columns
+    :return: The data, of the same type, with "sequence", "tokens" and "logprobs" columns
+    :raises ValueError: If a generated column would replace an existing one
+    """
+    pa = _import_pyarrow()
+    names = list(data.columns) if _is_pandas(data) else data.schema.names
+    _check_columns(names, prompt_column, prefix)
+    generated = generate_column(
+        model,
+        data[prompt_column],
+        generation_config,
+        max_batch=max_batch,
+        concurrency=concurrency,
+        max_retries=max_retries,
+        prefix=prefix,
+    )
+    if _is_pandas(data):
+        return data.assign(
+            **{
+                name: column.to_pandas().set_axis(data.index)
+                for name, column in zip(generated.column_names, generated.columns)
+            }
+        )
+    if isinstance(data, pa.RecordBatch):
+        generated = generated.combine_chunks().to_batches()[0]
+        return pa.RecordBatch.from_arrays(
+            data.columns + generated.columns,
+            schema=_append_fields(data.schema, generated.schema),
+        )
+    return pa.Table.from_arrays(
+        data.columns + generated.columns,
+        schema=_append_fields(data.schema, generated.schema),
+    )
+
+
+def generate_parquet(
+    model,
+    source,
+    destination: Union[str, Path],
+    prompt_column: str = "prompt",
+    generation_config: Dict = {},
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    max_batch: int = MAX_BATCH_SIZE,
+    concurrency: int = 4,
+    max_retries: int = 3,
+    prefix: str = "",
+    max_pending_row_groups: int = DEFAULT_MAX_PENDING_ROW_GROUPS,
+    **writer_kwargs,
+) -> int:
+    """Streams prompts from a Parquet file through the model into another Parquet file
+
+    Rows are read `row_group_size` at a time and prompts are sent in batches of
+    `max_batch` with up to `concurrency` requests in flight across row groups. Each row
+    group is written, with the generated columns, as soon as all its rows are generated.
+    Reading stops while `max_pending_row_groups` are waiting to be written, until the
+    requests in flight complete, so memory use is bounded by that many row groups
+    regardless of the size of the input, even when a slow request holds back an early
+    row group.
+
+    :param model: (Model) The model to generate with
+    :param source: Path of a Parquet file, or a pyarrow Table, a pandas DataFrame or an
+    iterable of pyarrow RecordBatches
+    :param destination: (str or Path) Path of the Parquet file written
+    :param prompt_column: (str) Name of the column of prompts
+    :param row_group_size: (int) Number of rows read and written at a time
+    :param prefix: (str) Prefix of the names of the generated columns
+    :param max_pending_row_groups: (int) Maximum number of row groups read but not yet
+    written
+    :param writer_kwargs: Additional arguments of :class:`pyarrow.parquet.ParquetWriter`,
+    such as `compression`
+    :return: (int) The number of rows written
+    """
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    if max_pending_row_groups < 1:
+        raise ValueError("max_pending_row_groups must be at least 1")
+
+    batches = iter(_record_batches(source, row_group_size))
+    pending = []
+    starts = []
+    read = 0
+    exhausted = False
+    written = 0
+    writer = None
+
+    def prompts() -> Iterator[str]:
+        nonlocal read, exhausted
+        while len(pending) - first < max_pending_row_groups:
+            batch = next(batches, None)
+            if batch is None:
+                exhausted = True
+                return
+            _check_columns(batch.schema.names, prompt_column, prefix)
+            values = batch.column(prompt_column).to_pylist()
+            rows = [i for i, prompt in enumerate(values) if prompt is not None]
+            pending.append(_PendingRowGroup(batch, rows))
+            starts.append(read)
+            read += len(rows)
+            for i in rows:
+                yield values[i]
+
+    def flush(first: int) -> int:
+        nonlocal writer, written
+        while first < len(pending) and pending[first].done:
+            group = pending[first]
+            arrays = _scatter(
+                GenerationBatch.concat(group.results) if group.results else None,
+                group.rows,
+                group.batch.num_rows,
+            )
+            batch = pa.RecordBatch.from_arrays(
+                group.batch.columns + list(arrays.values()),
+                names=group.batch.schema.names + [prefix + name for name in arrays],
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    str(destination), batch.schema, **writer_kwargs
+                )
+            writer.write_batch(batch, row_group_size=max(batch.num_rows, 1))
+            written += batch.num_rows
+            # Release the rows written, only their position is kept
+            pending[first] = _WRITTEN
+            first += 1
+        return first
+
+    first = 0
+    try:
+        while not exhausted:
+            # Each pass ends once reading stopped and the requests in flight completed
+            offset = read
+            for index, generation in model.generate_iter(
+                prompts(),
+                generation_config,
+                max_batch=max_batch,
+                max_in_flight=concurrency,
+                max_retries=max_retries,
+            ):
+                # Row groups without prompts share the start of the next one, which is
+                # the last of the row groups starting at or before the prompt
+                index += offset
+                group_id = bisect_right(starts, index) - 1
+                pending[group_id].add(index - starts[group_id], generation)
+                first = flush(first)
+            first = flush(first)
+        if writer is None:
+            # No input rows, still write a file with the schema of the output
+            writer = pq.ParquetWriter(
+                str(destination), _output_schema(source, prefix), **writer_kwargs
+            )
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+class _PendingRowGroup:
+    __slots__ = ("batch", "rows", "results", "remaining")
+
+    def __init__(self, batch, rows: List[int]):
+        self.batch = batch
+        self.rows = rows
+        self.results = [None] * len(rows)
+        self.remaining = len(rows)
+
+    @property
+    def done(self) -> bool:
+        return self.remaining == 0
+
+    def add(self, position: int, generation: GenerationBatch):
+        self.results[position] = generation
+        self.remaining -= 1
+
+
+_WRITTEN = _PendingRowGroup(None, [])
+
+
+def _scatter(
+    batch: Optional[GenerationBatch], rows: List[int], num_rows: int
+) -> Dict[str, object]:
+    """Places the generations of `rows` in columns of `num_rows`, with nulls elsewhere"""
+    pa = _import_pyarrow()
+    if batch is None:
+        batch = GenerationBatch(
+            [], [], np.empty(0, dtype=np.float32), np.zeros(1, dtype=np.int64)
+        )
+    arrays = generation_arrays(batch)
+    if len(rows) == num_rows:
+        return arrays
+    positions = np.full(num_rows, -1, dtype=np.int64)
+    positions[rows] = np.arange(len(rows))
+    indices = pa.array(positions, mask=positions < 0)
+    return {name: array.take(indices) for name, array in arrays.items()}
+
+
+def _record_batches(source, row_group_size: int) -> Iterable:
+    pa = _import_pyarrow()
+    if isinstance(source, (str, Path)):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(str(source)).iter_batches(batch_size=row_group_size)
+    if _is_pandas(source):
+        source = pa.Table.from_pandas(source, preserve_index=False)
+    if isinstance(source, pa.Table):
+        return source.to_batches(max_chunksize=row_group_size)
+    return source
+
+
+def _output_schema(source, prefix: str):
+    pa = _import_pyarrow()
+    if isinstance(source, (str, Path)):
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(str(source))
+    elif _is_pandas(source):
+        schema = pa.Schema.from_pandas(source, preserve_index=False)
+    elif isinstance(source, pa.Table):
+        schema = source.schema
+    else:
+        schema = pa.schema([])
+    generated = _scatter(None, [], 0)
+    return _append_fields(
+        schema,
+        pa.schema([(prefix + name, array.type) for name, array in generated.items()]),
+    )
+
+
+def _append_fields(schema, extra):
+    for field in extra:
+        schema = schema.append(field)
+    return schema
+
+
+def _check_columns(names: List[str], prompt_column: str, prefix: str):
+    if prompt_column not in names:
+        raise ValueError(f"No column named {prompt_column}")
+    for name in (SEQUENCE_COLUMN, TOKENS_COLUMN, LOGPROBS_COLUMN):
+        if prefix + name in names:
+            raise ValueError(
+                f"Column {prefix + name} already exists, choose another prefix"
+            )
+
+
+def _to_pylist(prompts) -> List[Optional[str]]:
+    if hasattr(prompts, "to_pylist"):
+        return prompts.to_pylist()
+    if _is_pandas(prompts):
+        return [
+            None if prompt is None or prompt != prompt else prompt for prompt in prompts
+        ]
+    return list(prompts)
+
+
+def _is_pandas(data) -> bool:
+    return type(data).__module__.startswith("pandas")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as err:
+        raise ImportError(
+            "Arrow support requires pyarrow, install it with `pip install kscope[arrow]`"
+        ) from err
+    return pyarrow
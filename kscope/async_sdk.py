@@ -0,0 +1,388 @@
+"""Asyncio counterparts of :class:`Client`, :class:`Model` and :class:`GatewaySession`
+
+Requires the optional ``aiohttp`` dependency, install with ``pip install kscope[async]``.
+"""
+
+import asyncio
+from functools import partial
+import logging
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+from .auth import default_token_manager, TokenManager
+from .generation import GenerationBatch
+from .kaleidoscope_sdk import JWT_TOKEN_FILE
+from .readiness import (
+    ModelLoadError,
+    ACTIVE,
+    FAILED,
+    MAX_POLL_INTERVAL,
+    MIN_POLL_INTERVAL,
+    POLL_BACKOFF,
+)
+from .utils import (
+    error_message,
+    GatewayError,
+    parse_retry_after,
+    raise_for_status,
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_TIMEOUT,
+    RETRY_STATUS_CODES,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASYNC_POOL_SIZE = 100
+
+
+class AsyncClient:
+    def __init__(
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        auth_key: Optional[str] = None,
+        **session_kwargs,
+    ):
+        """Initializes the asyncio Kaleidoscope client
+
+        If no auth key is given, the token is managed like that of :class:`Client`: read
+        from the token file, refreshed before it expires, and replaced once after the
+        gateway rejects it, by logging in with the credentials of the environment or
+        interactively. Nothing is read or prompted for until the first request, and then
+        only in the default executor, never blocking the event loop.
+
+        :param gateway_host: The host of the gateway service
+        :param gateway_port: The port of the gateway service
+        :param auth_key: The authentication key for the gateway service
+        :param session_kwargs: Additional transport options forwarded to :class:`AsyncGatewaySession`
+        """
+        tokens = None
+        if not auth_key:
+            tokens = default_token_manager(gateway_host, gateway_port, JWT_TOKEN_FILE)
+
+        self._session = AsyncGatewaySession(
+            gateway_host, gateway_port, auth_key, tokens=tokens, **session_kwargs
+        )
+        self._readiness = AsyncReadinessWaiter(self._session)
+        self._models = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Closes the underlying connection pool"""
+        await self._session.close()
+
+    @property
+    def models(self):
+        """Awaitable returning a list of all supported models"""
+        return self._get_models()
+
+    async def _get_models(self):
+        if self._models is None:
+            self._models = await self._session.get_models()
+        return self._models
+
+    @property
+    def model_instances(self):
+        """Awaitable returning a list of available model instances"""
+        return self._session.get_model_instances()
+
+    async def load_model(
+        self,
+        model_name: str,
+        wait_for_active: bool = False,
+        timeout: Optional[float] = None,
+    ):
+        """Loads a model from the gateway service
+
+        :param model_name: (str) The name of the model to load
+        :param wait_for_active: (bool) Whether to wait for the model to become active before returning
+        :param timeout: (float) Maximum time in seconds to wait for the model to become active
+        :raises ModelLoadError: If the model failed to load
+        :raises TimeoutError: If the model is not active before the timeout
+        """
+        model_instance_response = await self._session.create_model_instance(model_name)
+
+        model = AsyncModel(
+            model_instance_response["id"],
+            model_instance_response["name"],
+            self._session,
+        )
+
+        if wait_for_active:
+            await self._readiness.wait(model.id, timeout)
+
+        return model
+
+
+class AsyncReadinessWaiter:
+    """Polls the state of a model instance until it is active, backing off between polls
+
+    The asyncio counterpart of :class:`ReadinessWaiter`, with the same poll intervals. The
+    poll interval starts at `min_interval` and grows by `backoff` up to `max_interval`.
+    """
+
+    def __init__(
+        self,
+        session: "AsyncGatewaySession",
+        min_interval: float = MIN_POLL_INTERVAL,
+        max_interval: float = MAX_POLL_INTERVAL,
+        backoff: float = POLL_BACKOFF,
+    ):
+        """
+        :param session: (AsyncGatewaySession) The session used to query instance states
+        :param min_interval: (float) Initial delay between polls, in seconds
+        :param max_interval: (float) Maximum delay between polls, in seconds
+        :param backoff: (float) Factor applied to the delay after each poll
+        """
+        self._session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+    async def wait(
+        self, model_instance_id: str, timeout: Optional[float] = None
+    ) -> str:
+        """Waits until the instance is ACTIVE
+
+        :param model_instance_id: (str) The id of the model instance
+        :param timeout: (float) Maximum time to wait in seconds, waits forever if None
+        :raises ModelLoadError: If the instance failed to load
+        :raises TimeoutError: If the instance is not active before the deadline
+        """
+        try:
+            return await asyncio.wait_for(self._poll(model_instance_id), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"Model instance {model_instance_id} not active after {timeout} seconds"
+            ) from None
+
+    async def _poll(self, model_instance_id: str) -> str:
+        interval = self.min_interval
+        while True:
+            instance = await self._session.get_model_instance(model_instance_id)
+            if instance["state"] == ACTIVE:
+                return ACTIVE
+            if instance["state"] == FAILED:
+                raise ModelLoadError(
+                    f"Model instance {model_instance_id} failed to load"
+                )
+            await asyncio.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+
+class AsyncGatewaySession:
+    """An asyncio session for a model instance"""
+
+    def __init__(
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        auth_key: Optional[str] = None,
+        pool_size: int = DEFAULT_ASYNC_POOL_SIZE,
+        max_concurrency: Optional[int] = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        tokens: Optional[TokenManager] = None,
+    ):
+        """Initializes a session on a pooled aiohttp transport
+
+        A request rejected with a 401 is retried once with a new token, if `tokens` can
+        provide one. Refreshing the token runs in the default executor, so a login never
+        blocks the event loop.
+
+        :param gateway_host: The host of the gateway service
+        :param gateway_port: The port of the gateway service
+        :param auth_key: The authentication key for the gateway service
+        :param pool_size: (int) Maximum number of simultaneous connections to the gateway
+        :param max_concurrency: (int) Maximum number of requests in flight, defaults to `pool_size`
+        :param max_retries: (int) Number of retries with backoff for idempotent requests
+        :param timeout: (float or tuple) Per-call timeout in seconds, or a (connect, read) tuple
+        :param tokens: (TokenManager) Provides and refreshes the authentication key, shared
+        with other sessions. Takes precedence over `auth_key`
+        """
+        try:
+            import aiohttp
+        except ImportError as err:
+            raise ImportError(
+                "AsyncGatewaySession requires aiohttp, install it with `pip install kscope[async]`"
+            ) from err
+        self._aiohttp = aiohttp
+
+        self.gateway_host = gateway_host
+        self.gateway_port = gateway_port
+        self.tokens = tokens if tokens is not None else TokenManager(auth_key)
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency or pool_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self.base_addr = f"http://{self.gateway_host}:{self.gateway_port}/"
+        self.create_addr = partial(urljoin, self.base_addr)
+
+        # Both are bound to the running event loop, so they are created on first use
+        self._http = None
+        self._semaphore = None
+
+    @property
+    def auth_key(self) -> Optional[str]:
+        """The current authentication key, refreshed shortly before it expires"""
+        return self.tokens.get()
+
+    @auth_key.setter
+    def auth_key(self, auth_key: Optional[str]):
+        self.tokens = TokenManager(auth_key)
+
+    def _client_timeout(self):
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+            return self._aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        return self._aiohttp.ClientTimeout(total=self.timeout)
+
+    def _get_http(self):
+        if self._http is None or self._http.closed:
+            connector = self._aiohttp.TCPConnector(limit=self.pool_size)
+            self._http = self._aiohttp.ClientSession(
+                connector=connector, timeout=self._client_timeout()
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._http
+
+    async def close(self):
+        """Closes all pooled connections held by this session"""
+        if self._http is not None:
+            await self._http.close()
+
+    async def _request(self, method: str, url: str, body=None, auth: bool = True):
+        if not auth:
+            return await self._request_once(method, url, body)
+        loop = asyncio.get_running_loop()
+        auth_key = self.tokens.peek()
+        if auth_key is None:
+            auth_key = await loop.run_in_executor(None, self.tokens.get)
+        try:
+            return await self._request_once(method, url, body, auth_key)
+        except GatewayError as err:
+            if err.status_code != 401 or auth_key is None:
+                raise
+            # The token expired or was revoked, retry once with a new one
+            new_key = await loop.run_in_executor(
+                None, partial(self.tokens.refresh, rejected=auth_key)
+            )
+            if new_key is None:
+                raise
+            return await self._request_once(method, url, body, new_key)
+
+    async def _request_once(
+        self, method: str, url: str, body=None, auth_key: Optional[str] = None
+    ):
+        headers = {}
+        if auth_key:
+            headers["Authorization"] = f"Bearer {auth_key}"
+        retries = self.max_retries if method == "GET" else 0
+
+        http = self._get_http()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                try:
+                    async with http.request(
+                        method, url, json=body, headers=headers
+                    ) as resp:
+                        if resp.status in RETRY_STATUS_CODES and attempt < retries:
+                            raise self._aiohttp.ClientResponseError(
+                                resp.request_info, resp.history, status=resp.status
+                            )
+                        if resp.status >= 400:
+                            msg = None
+                            if resp.status not in (401, 422):
+                                msg = error_message(await resp.text(), resp.reason)
+                            raise_for_status(
+                                str(resp.url),
+                                resp.status,
+                                msg,
+                                parse_retry_after(resp.headers.get("Retry-After")),
+                            )
+                        logger.debug("addr %s response code %s", resp.url, resp.status)
+                        return await resp.json(content_type=None)
+                except (
+                    self._aiohttp.ClientConnectionError,
+                    self._aiohttp.ClientResponseError,
+                ):
+                    if attempt >= retries:
+                        raise
+                    await asyncio.sleep(DEFAULT_BACKOFF_FACTOR * (2**attempt))
+                    attempt += 1
+
+    async def get_models(self):
+        url = self.create_addr("models")
+        return await self._request("GET", url, auth=False)
+
+    async def get_model_instances(self):
+        url = self.create_addr("models/instances")
+        return await self._request("GET", url, auth=False)
+
+    async def create_model_instance(self, model_name: str):
+        url = self.create_addr("models/instances")
+        return await self._request("POST", url, {"name": model_name})
+
+    async def get_model_instance(self, model_instance_id: str):
+        url = self.create_addr(f"models/instances/{model_instance_id}")
+        return await self._request("GET", url)
+
+    async def generate(
+        self, model_instance_id: str, prompts: List[str], generation_config: Dict
+    ):
+        """Generates text from the model instance"""
+        url = self.create_addr(f"models/instances/{model_instance_id}/generate")
+        body = {"prompts": prompts, "generation_config": generation_config}
+        return await self._request("POST", url, body)
+
+
+class AsyncModel:
+    def __init__(
+        self, model_instance_id: str, model_name: str, session: AsyncGatewaySession
+    ):
+        """Initializes an asyncio model instance
+
+        :param model_instance_id: (str) The id of the model instance
+        :param model_name: (str): The name of the model
+        :param session: (AsyncGatewaySession) The session used to reach the gateway
+        """
+        self.name = model_name
+        self.id = model_instance_id
+        self._session = session
+
+    @property
+    def state(self):
+        """Awaitable returning a string describing the state of the model"""
+        return self._get_state()
+
+    async def _get_state(self):
+        return (await self._session.get_model_instance(self.id))["state"]
+
+    async def is_active(self):
+        """Checks if the model instance is active"""
+        return (await self.state) == "ACTIVE"
+
+    async def generate(
+        self, prompts: Union[str, List[str]], generation_config: Dict = {}
+    ):
+        """Generates text from the model instance
+
+        :param prompts: (str or List[str]) Single prompt or list of prompts to generate from.
+        Supports upto 8 prompts in a single request.
+        :param generation_config: (dict) Additional arguments to pass to the model
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        generation_response = await self._session.generate(
+            self.id, prompts, generation_config
+        )
+
+        return GenerationBatch.from_response(generation_response)
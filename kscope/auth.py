@@ -0,0 +1,414 @@
+"""Lifecycle of the JWT authenticating requests to the gateway
+
+A :class:`TokenManager` hands out the current token and replaces it shortly before it
+expires, or once the gateway rejects it. The token file is shared by every process of the
+user: reads and writes go through a file lock, and a process that needs a new token first
+looks for one already written by another process, so a fleet of workers logs in once
+rather than each stampeding the `/authenticate` endpoint.
+"""
+
+import base64
+from contextlib import nullcontext
+from getpass import getpass
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+from urllib.parse import urljoin
+
+from filelock import FileLock, Timeout
+import requests
+
+from .utils import error_message, reset_after_fork, GatewayError, DEFAULT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Environment variables holding the credentials used to log in without a prompt
+USERNAME_VARIABLE = "KSCOPE_USERNAME"
+PASSWORD_VARIABLE = "KSCOPE_PASSWORD"
+# Tokens are refreshed this many seconds before they expire
+DEFAULT_REFRESH_MARGIN = 300.0
+# Seconds between checks of the token file while a token due for refresh cannot be replaced
+RECHECK_INTERVAL = 10.0
+# Seconds between checks of the token file while waiting for another process to log in
+LOGIN_POLL_INTERVAL = 0.1
+
+
+def token_claims(token: Optional[str]) -> Dict:
+    """Decodes the claims of a JWT without verifying its signature
+
+    :return: (dict) The claims, empty if the token is not a JWT
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (AttributeError, IndexError, ValueError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
+
+def token_expiry(token: Optional[str]) -> Optional[float]:
+    """Returns the expiry time of a JWT in seconds since the epoch, or None if it has none"""
+    expires = token_claims(token).get("exp")
+    return float(expires) if isinstance(expires, (int, float)) else None
+
+
+class EnvironmentLogin:
+    """Logs in with the credentials of the KSCOPE_USERNAME and KSCOPE_PASSWORD variables
+
+    The credentials are read on every login, so they are never pickled with the client.
+    """
+
+    def __init__(
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        timeout: Union[float, tuple] = DEFAULT_TIMEOUT,
+    ):
+        """
+        :param gateway_host: The host of the gateway service
+        :param gateway_port: The port of the gateway service
+        :param timeout: (float or tuple) Timeout of the login request in seconds
+        """
+        self.gateway_host = gateway_host
+        self.gateway_port = gateway_port
+        self.timeout = timeout
+
+    @staticmethod
+    def configured() -> bool:
+        """Whether both credential variables are set"""
+        return bool(os.environ.get(USERNAME_VARIABLE)) and bool(
+            os.environ.get(PASSWORD_VARIABLE)
+        )
+
+    def __call__(self) -> str:
+        """Returns a new token
+
+        :raises GatewayError: If the gateway rejects the credentials
+        """
+        url = urljoin(
+            f"http://{self.gateway_host}:{self.gateway_port}/", "authenticate"
+        )
+        auth = (os.environ.get(USERNAME_VARIABLE), os.environ.get(PASSWORD_VARIABLE))
+        response = requests.post(url, auth=auth, timeout=self.timeout)
+        if not response.ok:
+            raise GatewayError(
+                f"Authentication failed with the credentials of {USERNAME_VARIABLE} and "
+                f"{PASSWORD_VARIABLE}, Error Code: {response.status_code}",
+                url,
+                response.status_code,
+            )
+        return response.json()["token"]
+
+
+class InteractiveLogin:
+    """Logs in with LDAP credentials typed at the terminal, allowing a few attempts"""
+
+    def __init__(
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        timeout: Union[float, tuple] = DEFAULT_TIMEOUT,
+        max_attempts: int = 3,
+    ):
+        """
+        :param gateway_host: The host of the gateway service
+        :param gateway_port: The port of the gateway service
+        :param timeout: (float or tuple) Timeout of each login request in seconds
+        :param max_attempts: (int) Number of times the credentials are asked for
+        """
+        self.gateway_host = gateway_host
+        self.gateway_port = gateway_port
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+
+    def __call__(self) -> str:
+        """Returns a new token
+
+        :raises Exception: If every attempt is rejected
+        """
+        print(
+            "You must authenticate with your LDAP credentials to use the Kaleidoscope service"
+        )
+        url = urljoin(
+            f"http://{self.gateway_host}:{self.gateway_port}/", "authenticate"
+        )
+        for _ in range(self.max_attempts):
+            username = input("Username: ")
+            password = getpass()
+            response = requests.post(
+                url, auth=(username, password), timeout=self.timeout
+            )
+            if response.status_code == 200:
+                print("Login successful.")
+                return response.json()["token"]
+            print(
+                f"Authentication failed: {error_message(response.text, response.reason)}"
+            )
+
+        raise Exception("Too many failed login attempts.")
+
+
+def default_token_manager(
+    gateway_host: str, gateway_port: int, path: Union[str, Path]
+) -> "TokenManager":
+    """Creates the token manager of a client given no auth key, without any IO
+
+    The token is shared with other processes through the token file at `path`. New tokens
+    are obtained with the credentials of the environment if they are set, or else by
+    prompting the user when running in a terminal.
+    """
+    if EnvironmentLogin.configured():
+        return TokenManager(
+            path=path, login=EnvironmentLogin(gateway_host, gateway_port)
+        )
+    if sys.stdin is not None and sys.stdin.isatty():
+        return TokenManager(
+            path=path,
+            login=InteractiveLogin(gateway_host, gateway_port),
+            interactive=True,
+        )
+    return TokenManager(path=path)
+
+
+class TokenManager:
+    """Provides a valid token to every request of a session, refreshing it when needed
+
+    A token is refreshed `refresh_margin` seconds before the expiry found in its claims, or
+    half way through its lifetime if that is shorter. Tokens without an expiry are only
+    replaced once the gateway rejects them. A new token is taken from the token file if
+    another process already wrote one, otherwise obtained from `login` and written to the
+    file. Without `login`, a token due for refresh is used until it is rejected.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = None,
+        path: Optional[Union[str, Path]] = None,
+        login: Optional[Callable[[], str]] = None,
+        interactive: bool = False,
+        refresh_margin: float = DEFAULT_REFRESH_MARGIN,
+        lock_timeout: float = 60.0,
+    ):
+        """
+        :param token: (str) The initial token, read from `path` on first use if None
+        :param path: (str or Path) File sharing the token with other processes
+        :param login: Callable returning a new token
+        :param interactive: (bool) Whether `login` prompts the user, copies of the manager
+        pickled for other processes then do not log in
+        :param refresh_margin: (float) Seconds before the expiry of a token it is refreshed
+        :param lock_timeout: (float) Maximum time in seconds to wait for the token file
+        """
+        self.path = Path(path) if path is not None else None
+        self.login = login
+        self.interactive = interactive
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+
+        self._token = None
+        self._refresh_at = -math.inf
+        if token is not None:
+            self._set(token)
+        self._lock = threading.Lock()
+        self._logging_in = False
+        self._file_lock, self._login_lock = self._create_file_locks()
+        reset_after_fork(self)
+
+    def __getstate__(self):
+        # Interactive logins cannot prompt from a worker process
+        return {
+            "token": self._token,
+            "path": self.path,
+            "login": None if self.interactive else self.login,
+            "refresh_margin": self.refresh_margin,
+            "lock_timeout": self.lock_timeout,
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def _after_fork(self):
+        # The parent may have held the locks, or been logging in, while forking
+        self._lock = threading.Lock()
+        self._logging_in = False
+        self._file_lock, self._login_lock = self._create_file_locks()
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """Expiry of the current token in seconds since the epoch, None if unknown"""
+        return token_expiry(self._token)
+
+    def peek(self) -> Optional[str]:
+        """Returns the current token if it is not due for refresh, without ever blocking
+
+        :return: (str) The token, None if there is none or it is due for refresh
+        """
+        token = self._token
+        if token is not None and time.time() < self._refresh_at:
+            return token
+        return None
+
+    def get(self) -> Optional[str]:
+        """Returns the current token, refreshing it first if it is due
+
+        :return: (str) The token, None if there is none and no way to log in
+        """
+        token = self._token
+        return self.peek() or self.refresh() or token
+
+    def set(self, token: str):
+        """Replaces the token, and saves it to the token file"""
+        with self._lock, self._locked_file():
+            self._write(token)
+            self._set(token)
+
+    def refresh(self, rejected: Optional[str] = None) -> Optional[str]:
+        """Replaces the current token, by a newer one from the token file or a new login
+
+        The token file is only locked while it is read or written. A single thread of the
+        processes sharing it logs in at a time, without holding that lock. Meanwhile, the
+        others keep using a token the gateway still accepts, or wait up to `lock_timeout`
+        seconds for the new token to be written.
+
+        :param rejected: (str) A token the gateway rejected, which is never returned
+        :return: (str) The new token, or the current one if it cannot be replaced yet.
+        None if there is no usable token.
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            with self._lock:
+                current = self._token
+                if current is not None and current != rejected:
+                    if time.time() < self._refresh_at:
+                        # Another thread refreshed it meanwhile
+                        return current
+                with self._locked_file():
+                    stored = self._read()
+                if stored is not None and stored != rejected and self._fresh(stored):
+                    self._set(stored)
+                    return stored
+
+                usable = None
+                for token in (current, stored):
+                    if token is not None and token != rejected:
+                        if not self._expired(token):
+                            usable = token
+                            break
+                logging_in = self.login is not None and self._claim_login()
+                if not logging_in and (self.login is None or usable is not None):
+                    return self._keep(usable)
+
+            if logging_in:
+                return self._login(rejected, usable)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(LOGIN_POLL_INTERVAL)
+
+    def _claim_login(self) -> bool:
+        """Makes this thread the only one logging in, unless another one already is"""
+        if self._logging_in:
+            return False
+        if self._login_lock is not None:
+            try:
+                self._login_lock.acquire(timeout=0)
+            except Timeout:
+                return False
+        self._logging_in = True
+        return True
+
+    def _login(self, rejected: Optional[str], usable: Optional[str]) -> Optional[str]:
+        try:
+            # Another process may have finished logging in since the token file was read
+            with self._locked_file():
+                stored = self._read()
+            if stored is not None and stored != rejected and self._fresh(stored):
+                with self._lock:
+                    self._set(stored)
+                return stored
+            try:
+                token = self.login()
+            except Exception:
+                if rejected is not None or usable is None:
+                    raise
+                logger.warning("Could not refresh the token", exc_info=True)
+                with self._lock:
+                    return self._keep(usable)
+            # Written before other processes may log in, so they find it
+            with self._lock, self._locked_file():
+                self._write(token)
+                self._set(token)
+            return token
+        finally:
+            with self._lock:
+                self._logging_in = False
+                if self._login_lock is not None:
+                    self._login_lock.release()
+
+    def _keep(self, token: Optional[str]) -> Optional[str]:
+        # Used until it is rejected, while the token file is checked again for a newer one
+        if token is not None:
+            self._token = token
+            self._refresh_at = time.time() + RECHECK_INTERVAL
+        return token
+
+    def _set(self, token: str):
+        self._token = token
+        self._refresh_at = self._refresh_time(token)
+
+    def _refresh_time(self, token: str) -> float:
+        expires = token_expiry(token)
+        if expires is None:
+            return math.inf
+        margin = self.refresh_margin
+        issued = token_claims(token).get("iat")
+        if isinstance(issued, (int, float)):
+            margin = min(margin, (expires - issued) / 2)
+        return expires - margin
+
+    def _fresh(self, token: str) -> bool:
+        return time.time() < self._refresh_time(token)
+
+    @staticmethod
+    def _expired(token: str) -> bool:
+        expires = token_expiry(token)
+        return expires is not None and expires <= time.time()
+
+    def _create_file_locks(self) -> Tuple[Optional[FileLock], Optional[FileLock]]:
+        if self.path is None:
+            return None, None
+        return (
+            FileLock(f"{self.path}.lock", timeout=self.lock_timeout),
+            FileLock(f"{self.path}.login.lock"),
+        )
+
+    def _locked_file(self):
+        return self._file_lock if self._file_lock is not None else nullcontext()
+
+    def _read(self) -> Optional[str]:
+        if self.path is None:
+            return None
+        try:
+            token = self.path.read_text().strip()
+        except FileNotFoundError:
+            return None
+        return token or None
+
+    def _write(self, token: str):
+        if self.path is None:
+            return
+        # Written to a private temporary file then renamed, so readers never see part of it
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
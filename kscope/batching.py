@@ -0,0 +1,247 @@
+"""Helpers for grouping prompts into gateway sized batches"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+import sys
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from .cache import normalize_config
+from .generation import GenerationBatch
+from .metrics import Metrics
+from .utils import GatewayError
+
+# Maximum number of prompts the gateway accepts in a single generate request
+MAX_BATCH_SIZE = 8
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """Lazily splits an iterable into lists of at most `size` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def indexed_chunks(
+    iterable: Iterable[str], size: int
+) -> Iterator[Tuple[List[int], List[str]]]:
+    """Lazily splits prompts into batches, each with the input positions of its prompts"""
+    offset = 0
+    for chunk in chunked(iterable, size):
+        yield list(range(offset, offset + len(chunk))), chunk
+        offset += len(chunk)
+
+
+def chunked_by_length(
+    iterable: Iterable[str],
+    size: int,
+    length_fn: Callable[[str], int] = len,
+    window: Optional[int] = None,
+) -> Iterator[Tuple[List[int], List[str]]]:
+    """Lazily splits prompts into batches of prompts of similar length
+
+    The gateway pads every prompt of a batch to the longest one, so grouping prompts of
+    similar length saves compute. Prompts are read `window` at a time, sorted by
+    `length_fn` within the window and then split into batches of `size`.
+
+    :param length_fn: Estimates the length of a prompt, e.g. its number of tokens. The
+    number of characters is used by default.
+    :param window: (int) Number of prompts sorted together, all of them if None
+    :return: Iterator of (positions in the input, prompts) pairs
+    """
+    if window is not None and window < size:
+        raise ValueError("The window must hold at least one batch")
+    for indices, prompts in indexed_chunks(iterable, window or sys.maxsize):
+        order = sorted(range(len(prompts)), key=lambda i: length_fn(prompts[i]))
+        for start in range(0, len(order), size):
+            batch = order[start : start + size]
+            yield [indices[i] for i in batch], [prompts[i] for i in batch]
+
+
+def context_batches(
+    contexts: List[str], continuations: List[str], size: int
+) -> Iterator[Tuple[List[int], List[str], List[Tuple[int, str]]]]:
+    """Splits (context, continuation) pairs into batches, sending each context once per batch
+
+    Pairs are grouped by context, in the order contexts first appear, and the groups are
+    packed into batches of up to `size` continuations. A context with more continuations
+    than fit in a batch spans several batches.
+
+    :return: Iterator of (positions in the input, distinct contexts, pairs of the index of
+    a context in the batch and a continuation) tuples
+    """
+    groups = {}
+    for index, context in enumerate(contexts):
+        groups.setdefault(context, []).append(index)
+
+    pairs = (
+        (context, index) for context, indices in groups.items() for index in indices
+    )
+    for chunk in chunked(pairs, size):
+        indices, batch_contexts, batch_continuations = [], {}, []
+        for context, index in chunk:
+            position = batch_contexts.setdefault(context, len(batch_contexts))
+            indices.append(index)
+            batch_continuations.append((position, continuations[index]))
+        yield indices, list(batch_contexts), batch_continuations
+
+
+class MicroBatcher:
+    """Merges prompts submitted concurrently with the same generation config into batches
+
+    A batch is sent as soon as it holds `max_batch` prompts, or once its oldest prompt has
+    waited `max_wait` seconds, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[List[str], Dict], GenerationBatch],
+        max_batch: int = MAX_BATCH_SIZE,
+        max_wait: float = 0.005,
+        max_concurrency: int = 4,
+        metrics: Optional[Metrics] = None,
+    ):
+        """Starts the background thread that flushes batches
+
+        :param send: Callable sending a list of prompts with a config, returning a
+        :class:`GenerationBatch`
+        :param max_batch: (int) Maximum number of prompts per request
+        :param max_wait: (float) Maximum time in seconds a prompt waits for others to join
+        :param max_concurrency: (int) Maximum number of batches in flight
+        :param metrics: (Metrics) Records how long prompts wait to be sent
+        """
+        self._send = send
+        self._metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, generation_config: Dict) -> Future:
+        """Queues a prompt, returning a future of its single-prompt :class:`GenerationBatch`"""
+        future = Future()
+        key = normalize_config(generation_config)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed MicroBatcher")
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _PendingBatch(
+                    generation_config, time.monotonic(), self.max_wait
+                )
+                self._condition.notify()
+            batch.prompts.append(prompt)
+            batch.futures.append(future)
+            if len(batch.prompts) >= self.max_batch:
+                self._dispatch(self._pending.pop(key))
+        return future
+
+    def close(self):
+        """Sends every queued prompt and stops the batcher"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _run(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                for key, batch in list(self._pending.items()):
+                    if batch.deadline <= now or self._closed:
+                        self._dispatch(self._pending.pop(key))
+                if self._closed:
+                    return
+                deadlines = [batch.deadline for batch in self._pending.values()]
+                timeout = min(deadlines) - now if deadlines else None
+                self._condition.wait(timeout)
+
+    def _dispatch(self, batch):
+        self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch):
+        if self._metrics is not None:
+            self._metrics.observe(
+                "queue_wait_seconds", time.monotonic() - batch.created, stage="batcher"
+            )
+        try:
+            response = self._send(batch.prompts, batch.generation_config)
+            if len(response) != len(batch.futures):
+                # Any prompt left without a generation would never be answered
+                raise GatewayError(
+                    f"The gateway returned {len(response)} generations for "
+                    f"{len(batch.futures)} prompts"
+                )
+        except BaseException as err:
+            for future in batch.futures:
+                future.set_exception(err)
+            return
+        for future, result in zip(batch.futures, response.split()):
+            future.set_result(result)
+
+
+class SingleFlight:
+    """Lets concurrent callers share the result of identical requests already in flight"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def claim(
+        self, keys: Iterable[Hashable]
+    ) -> Tuple[List[Hashable], Dict[Hashable, Future]]:
+        """Splits keys into those the caller must fetch itself and those already in flight
+
+        The caller is responsible for calling `resolve` or `fail` on every key it owns.
+
+        :return: The keys now owned by the caller, and a future for each other key
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._calls.get(key)
+                if future is None:
+                    self._calls[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+        return owned, waiting
+
+    def resolve(self, results: Dict[Hashable, object]):
+        """Publishes the results of owned keys to every caller waiting on them"""
+        with self._lock:
+            futures = [
+                (self._calls.pop(key), result) for key, result in results.items()
+            ]
+        for future, result in futures:
+            future.set_result(result)
+
+    def fail(self, keys: Iterable[Hashable], err: BaseException):
+        """Propagates the error of a failed request to every caller waiting on its keys"""
+        with self._lock:
+            futures = [self._calls.pop(key) for key in keys if key in self._calls]
+        for future in futures:
+            future.set_exception(err)
+
+
+class _PendingBatch:
+    __slots__ = ("generation_config", "created", "deadline", "prompts", "futures")
+
+    def __init__(self, generation_config: Dict, created: float, max_wait: float):
+        self.generation_config = generation_config
+        self.created = created
+        self.deadline = created + max_wait
+        self.prompts = []
+        self.futures = []
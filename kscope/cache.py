@@ -0,0 +1,195 @@
+"""A persistent, size bounded cache of generation results backed by SQLite"""
+
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Union
+
+from .utils import reset_after_fork
+
+DEFAULT_CACHE_PATH = Path(Path.home() / ".cache" / "kscope" / "generations.sqlite")
+DEFAULT_MAX_SIZE = 1024**3
+
+# Keeps `WHERE key IN (...)` below SQLite's default limit on query parameters
+_QUERY_CHUNK_SIZE = 500
+
+
+def normalize_config(generation_config: Dict) -> str:
+    """Returns a canonical string for a generation config, independent of key order"""
+    return json.dumps(generation_config, sort_keys=True, separators=(",", ":"))
+
+
+def is_deterministic(generation_config: Dict) -> bool:
+    """Whether a generation config always produces the same output for a prompt
+
+    A temperature that is not a number is left for the gateway to reject, and the config
+    treated as sampled.
+    """
+    try:
+        temperature = float(generation_config.get("temperature", 1.0))
+    except (TypeError, ValueError):
+        return False
+    return temperature == 0.0 or generation_config.get("top_k") == 1
+
+
+class GenerationCache:
+    """Caches generations keyed on model name, prompt and generation config
+
+    Entries are evicted least recently used first once the stored results exceed `max_size`
+    bytes. A cache file can be shared between processes, but the size accounting used for
+    eviction is tracked per instance.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path] = DEFAULT_CACHE_PATH,
+        max_size: int = DEFAULT_MAX_SIZE,
+        cache_nondeterministic: bool = False,
+    ):
+        """Opens or creates a generation cache
+
+        :param path: (str or Path) Location of the SQLite database
+        :param max_size: (int) Maximum total size of the cached results, in bytes
+        :param cache_nondeterministic: (bool) Also cache generations that use sampling
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.cache_nondeterministic = cache_nondeterministic
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS generations_accessed ON generations (accessed)"
+        )
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM generations"
+        ).fetchone()[0]
+        reset_after_fork(self)
+
+    def __getstate__(self):
+        return {
+            "path": self.path,
+            "max_size": self.max_size,
+            "cache_nondeterministic": self.cache_nondeterministic,
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None
+        )
+
+    def _after_fork(self):
+        # SQLite connections must not be used across a fork
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, generation_config: Dict) -> str:
+        """Returns the cache key of a single prompt"""
+        key = json.dumps([model_name, prompt, normalize_config(generation_config)])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def should_cache(self, generation_config: Dict) -> bool:
+        """Whether results generated with this config may be cached"""
+        return self.cache_nondeterministic or is_deterministic(generation_config)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """Looks up several keys at once, returning the cached results that were found"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _QUERY_CHUNK_SIZE):
+                chunk = keys[i : i + _QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM generations WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+                self._conn.execute(
+                    f"UPDATE generations SET accessed = ? WHERE key IN ({placeholders})",
+                    [time.time(), *chunk],
+                )
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, results: Dict[str, Dict]):
+        """Stores several results, evicting the least recently used ones if needed"""
+        now = time.time()
+        rows = []
+        for key, result in results.items():
+            value = json.dumps(result)
+            rows.append((key, value, len(value), now))
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for row in rows:
+                    previous = self._conn.execute(
+                        "SELECT size FROM generations WHERE key = ?", (row[0],)
+                    ).fetchone()
+                    if previous:
+                        self._size -= previous[0]
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?)", row
+                    )
+                    self._size += row[2]
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._size = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM generations"
+                ).fetchone()[0]
+                raise
+
+    def _evict(self):
+        if self._size <= self.max_size:
+            return
+        cursor = self._conn.execute(
+            "SELECT key, size FROM generations ORDER BY accessed ASC"
+        )
+        evicted = []
+        for key, size in cursor:
+            if self._size <= self.max_size:
+                break
+            evicted.append((key,))
+            self._size -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM generations WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit and miss counters along with the number and size of entries"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM generations").fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries[0],
+                "size": self._size,
+            }
+
+    def clear(self):
+        """Removes every cached result"""
+        with self._lock:
+            self._conn.execute("DELETE FROM generations")
+            self._size = 0
+
+    def close(self):
+        self._conn.close()
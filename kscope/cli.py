@@ -0,0 +1,331 @@
+"""Command line interface of the SDK
+
+``kscope batch`` runs generation over a JSONL file of prompts::
+
+    kscope batch prompts.jsonl generations.jsonl --model llama3-8b --host llm --port 3001
+
+Each input line is either a JSON string, the prompt, or an object with a ``prompt`` and an
+optional ``generation_config`` overriding the ``--config`` of the job. Each output line is
+the input object with the ``line`` number it came from and the generated ``sequence``,
+``tokens`` and ``logprobs``, written as soon as its batch completes.
+
+Progress is checkpointed next to the output file, so a job that is interrupted resumes
+where it left off when run again with the same arguments, without resending finished lines.
+"""
+
+import argparse
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .batching import MAX_BATCH_SIZE
+from .cache import normalize_config
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = ".ckpt"
+
+
+class BatchJob:
+    """Generates text for every line of a JSONL file, resuming from a checkpoint
+
+    Lines are read lazily and grouped into batches of up to `max_batch` prompts sharing the
+    same generation config, with at most `concurrency` batches in flight, so memory use does
+    not depend on the size of the file.
+
+    The checkpoint holds a watermark, below which every line is done, the set of lines done
+    above it, and the size of the output file at that point. Output written after the last
+    checkpoint is truncated on resume and generated again, so every line appears once. If
+    the output file is missing or shorter than checkpointed, the job starts over, and if
+    the input file changed since, it fails rather than mixing the results of both.
+    """
+
+    def __init__(
+        self,
+        model,
+        input_path: str,
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        generation_config: Optional[Dict] = None,
+        max_batch: int = MAX_BATCH_SIZE,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        checkpoint_interval: float = 5.0,
+    ):
+        """Prepares a job, see :meth:`run` to start it
+
+        :param model: (Model) The model to generate with
+        :param input_path: (str) Path of the JSONL file of prompts
+        :param output_path: (str) Path of the JSONL file results are appended to
+        :param checkpoint_path: (str) Path of the checkpoint, next to the output by default
+        :param generation_config: (dict) Default generation config of every line
+        :param max_batch: (int) Maximum number of prompts per request
+        :param concurrency: (int) Maximum number of requests in flight
+        :param max_retries: (int) Number of times a failed batch is retried
+        :param checkpoint_interval: (float) Minimum time in seconds between checkpoints
+        """
+        self.model = model
+        self.input_path = Path(input_path)
+        self.output_path = Path(output_path)
+        self.checkpoint_path = Path(
+            checkpoint_path or str(self.output_path) + CHECKPOINT_SUFFIX
+        )
+        self.generation_config = generation_config or {}
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.checkpoint_interval = checkpoint_interval
+
+        self._watermark = 0
+        self._done = set()
+        self._fingerprint = None
+        self._output = None
+        self._checkpointed_at = 0.0
+
+    def run(self) -> Dict:
+        """Runs the job to completion
+
+        :return: A dict with the number of lines `generated` by this run and `skipped`
+        because a previous run already generated them
+        :raises ValueError: If the input file changed since the checkpoint was saved
+        :raises: The error of a batch that failed after its retries, once the progress
+        made so far is checkpointed
+        """
+        self._fingerprint = self._input_fingerprint()
+        output_bytes = self._load_checkpoint()
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        mode = "r+b" if self.output_path.exists() else "wb"
+        with open(self.output_path, mode) as output:
+            # Drop results written after the last checkpoint, they are generated again
+            output.truncate(output_bytes)
+            output.seek(output_bytes)
+            self._output = output
+            try:
+                return self._run()
+            finally:
+                self._save_checkpoint()
+                self._output = None
+
+    def _run(self) -> Dict:
+        stats = {"generated": 0, "skipped": 0}
+        pending = {}
+        in_flight = {}
+
+        def dispatch(chunk):
+            config, lines = chunk
+            prompts = [record["prompt"] for _, record in lines]
+            future = executor.submit(
+                self.model.generate_many,
+                prompts,
+                config,
+                max_batch=len(prompts),
+                concurrency=1,
+                max_retries=self.max_retries,
+            )
+            in_flight[future] = lines
+
+        def drain(return_when=FIRST_COMPLETED):
+            done, _ = wait(in_flight, return_when=return_when)
+            error = None
+            for future in done:
+                lines = in_flight.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                self._write(lines, future.result())
+                stats["generated"] += len(lines)
+            if error is not None:
+                # Keep the results of the other batches before giving up
+                if in_flight:
+                    drain(return_when=ALL_COMPLETED)
+                raise error
+            self._maybe_save_checkpoint()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending_lines = 0
+            for index, record in self._read_input():
+                if index < self._watermark or index in self._done:
+                    stats["skipped"] += record is not None
+                    continue
+                if record is None:
+                    self._mark_done([index])
+                    continue
+                config = dict(self.generation_config)
+                config.update(record.get("generation_config") or {})
+                config_key = normalize_config(config)
+                chunk = pending.setdefault(config_key, (config, []))
+                chunk[1].append((index, record))
+                pending_lines += 1
+
+                if len(chunk[1]) >= self.max_batch:
+                    pending_lines -= len(chunk[1])
+                    dispatch(pending.pop(config_key))
+                elif pending_lines >= self.max_batch * self.concurrency:
+                    # Many distinct configs, send partial batches to bound memory
+                    for chunk in pending.values():
+                        dispatch(chunk)
+                    pending.clear()
+                    pending_lines = 0
+                while len(in_flight) >= self.concurrency:
+                    drain()
+
+            for chunk in pending.values():
+                dispatch(chunk)
+            while in_flight:
+                drain()
+        return stats
+
+    def _read_input(self) -> Iterator[Tuple[int, Optional[Dict]]]:
+        """Yields (line number, record) pairs, with None as the record of blank lines"""
+        with open(self.input_path, "r", encoding="utf-8") as lines:
+            for index, line in enumerate(lines):
+                if not line.strip():
+                    yield index, None
+                    continue
+                record = json.loads(line)
+                if isinstance(record, str):
+                    record = {"prompt": record}
+                elif not isinstance(record, dict) or "prompt" not in record:
+                    raise ValueError(
+                        f"Line {index} of {self.input_path} has no prompt: {line[:80]}"
+                    )
+                yield index, record
+
+    def _write(self, lines: List[Tuple[int, Dict]], batch):
+        rows = []
+        for (index, record), generation in zip(lines, batch):
+            row = dict(
+                record,
+                line=index,
+                sequence=generation.sequence,
+                tokens=generation.tokens,
+                logprobs=generation.logprobs.tolist(),
+            )
+            rows.append(json.dumps(row) + "\n")
+        self._output.write("".join(rows).encode("utf-8"))
+        self._mark_done(index for index, _ in lines)
+
+    def _mark_done(self, indices: Iterable[int]):
+        self._done.update(indices)
+        while self._watermark in self._done:
+            self._done.remove(self._watermark)
+            self._watermark += 1
+
+    def _maybe_save_checkpoint(self):
+        if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        state = {
+            "input": str(self.input_path),
+            "input_fingerprint": self._fingerprint,
+            "watermark": self._watermark,
+            "done": sorted(self._done),
+            "output_bytes": self._output.tell(),
+        }
+        tmp_path = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp_path, self.checkpoint_path)
+        self._checkpointed_at = time.monotonic()
+
+    def _load_checkpoint(self) -> int:
+        """Restores the progress of a previous run, returning the size of its output"""
+        if not self.checkpoint_path.exists():
+            return 0
+        state = json.loads(self.checkpoint_path.read_text(encoding="utf-8"))
+        fingerprint = state.get("input_fingerprint")
+        if fingerprint is not None and fingerprint != self._fingerprint:
+            raise ValueError(
+                f"{self.input_path} changed since {self.checkpoint_path} was saved, "
+                "delete the checkpoint to start over"
+            )
+        output_bytes = state["output_bytes"]
+        try:
+            output_size = self.output_path.stat().st_size
+        except FileNotFoundError:
+            output_size = None
+        if output_size is None or output_size < output_bytes:
+            logger.warning(
+                "%s is missing or shorter than recorded in %s, starting over",
+                self.output_path,
+                self.checkpoint_path,
+            )
+            return 0
+        self._watermark = state["watermark"]
+        self._done = set(state["done"])
+        logger.info(
+            "Resuming from line %d of %s", self._watermark, self.checkpoint_path
+        )
+        return output_bytes
+
+    def _input_fingerprint(self) -> Dict:
+        stat = self.input_path.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _batch(args):
+    from .kaleidoscope_sdk import Client
+
+    client = Client(
+        args.host, args.port, auth_key=args.auth_key, pool_size=args.concurrency
+    )
+    model = client.load_model(args.model, wait_for_active=True)
+    job = BatchJob(
+        model,
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        generation_config=json.loads(args.config) if args.config else None,
+        max_batch=args.max_batch,
+        concurrency=args.concurrency,
+        max_retries=args.max_retries,
+    )
+    stats = job.run()
+    print(
+        f"Generated {stats['generated']} lines, {stats['skipped']} already done",
+        file=sys.stderr,
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="kscope", description="Kaleidoscope SDK")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser(
+        "batch", help="Generate text for every line of a JSONL file"
+    )
+    batch.add_argument("input", help="JSONL file of prompts")
+    batch.add_argument("output", help="JSONL file the generations are appended to")
+    batch.add_argument("--model", required=True, help="Name of the model")
+    batch.add_argument("--host", required=True, help="Host of the gateway service")
+    batch.add_argument(
+        "--port", required=True, type=int, help="Port of the gateway service"
+    )
+    batch.add_argument(
+        "--auth-key",
+        default=os.environ.get("KSCOPE_AUTH_KEY"),
+        help="Authentication key, defaults to $KSCOPE_AUTH_KEY",
+    )
+    batch.add_argument("--config", help="Default generation config, as JSON")
+    batch.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    batch.add_argument("--concurrency", type=int, default=4)
+    batch.add_argument("--max-retries", type=int, default=3)
+    batch.add_argument(
+        "--checkpoint", help=f"Checkpoint path, defaults to OUTPUT{CHECKPOINT_SUFFIX}"
+    )
+    batch.set_defaults(handler=_batch)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
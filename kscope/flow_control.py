@@ -0,0 +1,151 @@
+"""Client side backpressure: adaptive concurrency limits and rate limiting"""
+
+import threading
+import time
+from typing import Optional
+
+
+class AdaptiveConcurrencyLimiter:
+    """Bounds the number of requests in flight, adapting the bound to the service's health
+
+    The limit follows AIMD: it grows by one request per round trip while requests succeed
+    with a latency close to the best latency observed, and is multiplied by `decrease` when
+    the gateway reports overload (429 or 503) or latency exceeds `latency_tolerance` times
+    the baseline. At most one decrease is applied per round trip, so a burst of rejections
+    from the same congestion episode only halves the limit once.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        latency_tolerance: Optional[float] = 2.0,
+        window: int = 100,
+    ):
+        """Creates a limiter
+
+        :param initial_limit: (int) Number of requests allowed in flight at first
+        :param min_limit: (int) The limit never goes below this number
+        :param max_limit: (int) The limit never goes above this number
+        :param decrease: (float) Factor applied to the limit on overload
+        :param latency_tolerance: (float) Latency, as a multiple of the baseline, above which
+        the service is considered congested. Latency is ignored if None.
+        :param window: (int) Number of requests after which the baseline latency is
+        re-estimated, so that it can follow a slower service
+        """
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError(
+                "Limits must satisfy 1 <= min_limit <= initial_limit <= max_limit"
+            )
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.window = window
+
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._baseline = None
+        self._window_min = None
+        self._samples = 0
+        self._hold_until = 0.0
+
+    @property
+    def limit(self) -> int:
+        """The current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Blocks until a request may be sent
+
+        :param timeout: (float) Maximum time to wait in seconds, waits forever if None
+        :raises TimeoutError: If no slot frees up before the deadline
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._in_flight < int(self._limit), timeout
+            ):
+                raise TimeoutError(f"No request slot available after {timeout} seconds")
+            self._in_flight += 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False):
+        """Records the outcome of a request acquired with :meth:`acquire`
+
+        :param latency: (float) Duration of the request in seconds, None if it failed
+        without a meaningful latency
+        :param overloaded: (bool) Whether the gateway rejected the request as overloaded
+        """
+        with self._condition:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if overloaded or self._congested(latency):
+                if now >= self._hold_until:
+                    self._limit = max(self.min_limit, self._limit * self.decrease)
+                    self._hold_until = now + (latency or self._baseline or 0.0)
+            elif latency is not None:
+                # One more request per round trip, i.e. 1 / limit per completed request
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def _congested(self, latency: Optional[float]) -> bool:
+        if latency is None:
+            return False
+        self._samples += 1
+        if self._window_min is None or latency < self._window_min:
+            self._window_min = latency
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        if self._samples >= self.window:
+            self._baseline, self._window_min, self._samples = self._window_min, None, 0
+        if self.latency_tolerance is None:
+            return False
+        return latency > self.latency_tolerance * self._baseline
+
+    def __repr__(self):
+        return f"AdaptiveConcurrencyLimiter(limit={self.limit}, in_flight={self._in_flight})"
+
+
+class TokenBucket:
+    """Limits the rate of requests to `rate` per second, allowing bursts of `burst` requests"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        """Creates a full bucket
+
+        :param rate: (float) Number of requests allowed per second on average
+        :param burst: (int) Maximum number of requests sent back to back, defaults to one
+        second worth of requests
+        """
+        if rate <= 0:
+            raise ValueError("The rate must be positive")
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 1, timeout: Optional[float] = None):
+        """Blocks until `tokens` requests may be sent
+
+        :raises TimeoutError: If the tokens cannot be available before the deadline
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            # Tokens are taken right away, later callers queue behind the debt
+            self._tokens -= tokens
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if timeout is not None and delay > timeout:
+                self._tokens += tokens
+                raise TimeoutError(f"Rate limit exceeded for {timeout} seconds")
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,232 @@
+"""Compact, column oriented containers for generation results"""
+
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+# Logprobs parsed from JSON keep the precision of Python floats, binary responses carry
+# float32 buffers which are used as is
+LOGPROBS_DTYPE = np.float64
+
+# Per-prompt fields of a generate response that get a dedicated column
+_SEQUENCES = "sequences"
+_TOKENS = "tokens"
+_LOGPROBS = "logprobs"
+
+
+def _flatten_logprobs(per_prompt_logprobs: List[Optional[List[float]]]):
+    lengths = np.zeros(len(per_prompt_logprobs) + 1, dtype=np.int64)
+    for i, values in enumerate(per_prompt_logprobs):
+        lengths[i + 1] = len(values) if values is not None else 0
+    offsets = np.cumsum(lengths)
+    logprobs = np.empty(int(offsets[-1]), dtype=LOGPROBS_DTYPE)
+    for i, values in enumerate(per_prompt_logprobs):
+        if values is not None and len(values):
+            logprobs[offsets[i] : offsets[i + 1]] = values
+    return logprobs, offsets
+
+
+class Generation:
+    """The generation of a single prompt
+
+    :ivar sequence: (str) The generated text
+    :ivar tokens: (List[str]) The generated tokens
+    :ivar logprobs: (np.ndarray) Log probability of each generated token
+    """
+
+    __slots__ = ("sequence", "tokens", "logprobs")
+
+    def __init__(
+        self, sequence: Optional[str], tokens: List[str], logprobs: np.ndarray
+    ):
+        self.sequence = sequence
+        self.tokens = tokens
+        self.logprobs = logprobs
+
+    def __repr__(self):
+        return f"Generation(sequence={self.sequence!r}, tokens={len(self.tokens)})"
+
+
+class GenerationBatch:
+    """The generations of a batch of prompts
+
+    Sequences and tokens are stored per prompt, while the logprobs of every prompt live in a
+    single contiguous array, float64 for JSON responses and float32 for binary ones: the
+    logprobs of prompt `i` are `logprobs[offsets[i]:offsets[i + 1]]`. Indexing the batch returns a :class:`Generation`
+    whose logprobs are a view into that array.
+
+    The `generation` attribute keeps the layout of the raw gateway response, with plain
+    Python lists, for compatibility. It is built on first access.
+    """
+
+    __slots__ = (
+        "sequences",
+        "tokens",
+        "logprobs",
+        "offsets",
+        "_fields",
+        "_columns",
+        "_extras",
+        "_generation",
+    )
+
+    def __init__(
+        self,
+        sequences: List[Optional[str]],
+        tokens: List[List[str]],
+        logprobs: np.ndarray,
+        offsets: np.ndarray,
+        fields: Sequence[str] = (_SEQUENCES, _TOKENS, _LOGPROBS),
+        columns: Optional[Dict[str, List]] = None,
+        extras: Optional[Dict] = None,
+    ):
+        """Creates a batch from its columns, see :meth:`from_response` to parse a response
+
+        :param sequences: (List[str]) Generated text of each prompt
+        :param tokens: (List[List[str]]) Generated tokens of each prompt
+        :param logprobs: (np.ndarray) Flat array with the logprobs of every prompt
+        :param offsets: (np.ndarray) int64 array of length `len(sequences) + 1` delimiting
+        the logprobs of each prompt
+        :param fields: Names of the per-prompt fields present in the gateway response
+        :param columns: Any other per-prompt fields of the gateway response
+        :param extras: Top level fields of the gateway response besides the generation
+        """
+        self.sequences = sequences
+        self.tokens = tokens
+        self.logprobs = logprobs
+        self.offsets = offsets
+        self._fields = tuple(fields)
+        self._columns = columns or {}
+        self._extras = extras or {}
+        self._generation = None
+
+    @classmethod
+    def from_response(cls, response: Dict) -> "GenerationBatch":
+        """Parses a generate response of the gateway service"""
+        generation = response["generation"]
+        column = generation.get(_LOGPROBS)
+        if isinstance(column, dict):
+            # Binary responses already carry the flat layout, used without copying
+            logprobs, offsets = column["values"], column["offsets"]
+            num_prompts = len(offsets) - 1
+        else:
+            num_prompts = max(
+                (len(values) for values in generation.values()), default=0
+            )
+            logprobs, offsets = _flatten_logprobs(column or [None] * num_prompts)
+
+        return cls(
+            sequences=list(generation.get(_SEQUENCES) or [None] * num_prompts),
+            tokens=list(generation.get(_TOKENS) or [[] for _ in range(num_prompts)]),
+            logprobs=logprobs,
+            offsets=offsets,
+            fields=list(generation),
+            columns={
+                key: list(values)
+                for key, values in generation.items()
+                if key not in (_SEQUENCES, _TOKENS, _LOGPROBS)
+            },
+            extras={
+                key: value for key, value in response.items() if key != "generation"
+            },
+        )
+
+    @classmethod
+    def concat(cls, batches: Sequence["GenerationBatch"]) -> "GenerationBatch":
+        """Concatenates several batches, in order, into a single batch
+
+        Top level response fields are taken from the first batch. Concatenating no batch
+        gives an empty one.
+        """
+        if not batches:
+            return cls(
+                [], [], np.empty(0, dtype=LOGPROBS_DTYPE), np.zeros(1, dtype=np.int64)
+            )
+        first = batches[0]
+        if len(batches) == 1:
+            return first
+
+        lengths = [np.diff(batch.offsets) for batch in batches]
+        offsets = np.zeros(sum(len(batch) for batch in batches) + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(lengths), out=offsets[1:])
+
+        return cls(
+            sequences=[seq for batch in batches for seq in batch.sequences],
+            tokens=[tokens for batch in batches for tokens in batch.tokens],
+            logprobs=np.concatenate([batch.logprobs for batch in batches]),
+            offsets=offsets,
+            fields=first._fields,
+            columns={
+                key: [value for batch in batches for value in batch._columns[key]]
+                for key in first._columns
+            },
+            extras=first._extras,
+        )
+
+    def split(self) -> List["GenerationBatch"]:
+        """Splits the batch into single-prompt batches whose logprobs are views of this one"""
+        return [self._slice(i) for i in range(len(self))]
+
+    def _slice(self, i: int) -> "GenerationBatch":
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return GenerationBatch(
+            sequences=self.sequences[i : i + 1],
+            tokens=self.tokens[i : i + 1],
+            logprobs=self.logprobs[start:stop],
+            offsets=np.array([0, stop - start], dtype=np.int64),
+            fields=self._fields,
+            columns={key: values[i : i + 1] for key, values in self._columns.items()},
+            extras=self._extras,
+        )
+
+    def to_response(self) -> Dict:
+        """Converts the batch back into the JSON layout of a gateway response"""
+        return dict(self._extras, generation=self._build_generation())
+
+    @property
+    def generation(self) -> Dict:
+        """The generation as returned by the gateway, e.g. `generation['sequences']`"""
+        if self._generation is None:
+            self._generation = self._build_generation()
+        return self._generation
+
+    def _build_generation(self) -> Dict:
+        generation = {}
+        for key in self._fields:
+            if key == _SEQUENCES:
+                generation[key] = list(self.sequences)
+            elif key == _TOKENS:
+                generation[key] = list(self.tokens)
+            elif key == _LOGPROBS:
+                generation[key] = [item.logprobs.tolist() for item in self]
+            else:
+                generation[key] = list(self._columns[key])
+        return generation
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Generation:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("GenerationBatch index out of range")
+        return Generation(
+            self.sequences[i],
+            self.tokens[i],
+            self.logprobs[self.offsets[i] : self.offsets[i + 1]],
+        )
+
+    def __iter__(self) -> Iterator[Generation]:
+        return (self[i] for i in range(len(self)))
+
+    def __getattr__(self, name):
+        try:
+            return object.__getattribute__(self, "_extras")[name]
+        except KeyError:
+            raise AttributeError(
+                f"'GenerationBatch' object has no attribute '{name}'"
+            ) from None
+
+    def __repr__(self):
+        return f"GenerationBatch(prompts={len(self)}, tokens={len(self.logprobs)})"
@@ -0,0 +1,142 @@
+"""Hedged requests: duplicating the slowest requests to cut tail latency"""
+
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait,
+)
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+from .utils import remaining_time
+
+
+class HedgingPolicy:
+    """Sends a second copy of a request that is slower than most, and keeps the first answer
+
+    A request still pending after the `percentile` of recently observed latencies gets a
+    duplicate, and whichever copy answers first is returned. The other copy is cancelled if
+    it has not started yet, or left to finish in the background with its result discarded.
+    Duplicates are only sent while they amount to less than `budget` of all requests, which
+    bounds the extra load put on the gateway.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        min_samples: int = 20,
+        window: int = 1000,
+        max_workers: int = 16,
+    ):
+        """Creates a policy
+
+        :param percentile: (float) Latency percentile, between 0 and 100, after which a
+        request is duplicated
+        :param budget: (float) Maximum fraction of requests that are duplicated
+        :param min_samples: (int) Number of latencies observed before hedging starts
+        :param window: (int) Number of recent latencies the percentile is computed over
+        :param max_workers: (int) Maximum number of requests sent concurrently by the policy
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("The percentile must be between 0 and 100")
+        if not 0 <= budget <= 1:
+            raise ValueError("The budget must be between 0 and 1")
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+
+        self._latencies = deque(maxlen=window)
+        self._delay = None
+        self._stale = 0
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="kscope-hedge"
+        )
+
+    @property
+    def hedge_rate(self) -> float:
+        """Fraction of requests that were duplicated so far"""
+        with self._lock:
+            return self._hedges / self._requests if self._requests else 0.0
+
+    def delay(self) -> Optional[float]:
+        """Time after which a pending request is duplicated, None until enough samples"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            # The percentile is only recomputed every few samples to keep requests cheap
+            if self._delay is None or self._stale >= 16:
+                self._delay = float(np.percentile(self._latencies, self.percentile))
+                self._stale = 0
+            return self._delay
+
+    def run(self, attempt: Callable, timeout: Optional[float] = None):
+        """Calls `attempt`, calling it a second time if the first call is slow
+
+        :param attempt: Callable taking the remaining time in seconds, or None, and sending
+        one copy of the request
+        :param timeout: (float) Maximum time to wait for an answer in seconds
+        :raises TimeoutError: If no copy answers before the deadline
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = self.delay()
+        with self._lock:
+            self._requests += 1
+        if delay is None or (timeout is not None and delay >= timeout):
+            return self._timed(attempt, timeout)
+
+        primary = self._executor.submit(self._timed, attempt, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_budget():
+            return self._result(primary, deadline)
+
+        hedge = self._executor.submit(self._timed, attempt, remaining_time(deadline))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(
+                pending, timeout=remaining_time(deadline), return_when=FIRST_COMPLETED
+            )
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError(f"No answer after {timeout} seconds")
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+        # Both copies failed
+        return future.result()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _timed(self, attempt: Callable, timeout: Optional[float]):
+        start = time.monotonic()
+        result = attempt(timeout)
+        with self._lock:
+            self._latencies.append(time.monotonic() - start)
+            self._stale += 1
+        return result
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def _result(self, future, deadline: Optional[float]):
+        try:
+            return future.result(remaining_time(deadline))
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("No answer before the deadline") from None
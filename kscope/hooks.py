@@ -1,7 +1,5 @@
 from types import SimpleNamespace
 
-import torch
-
 """save data in these hooks
 
 next gen will be web pdb
@@ -15,6 +13,8 @@ class TestForwardHook(SimpleNamespace):
     """
 
     def __call__(self, input, output):
+        import torch
+
         print(input[0].shape, output[0].shape)
         with torch.no_grad():
             self.output = output[0].sum()
@@ -1,18 +1,61 @@
-from collections import namedtuple
+from collections import deque
+from concurrent.futures import (
+    as_completed,
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+    wait,
+)
 from functools import cached_property, partial
-from getpass import getpass
-import json
-import requests
+import os
 from pathlib import Path
 import sys
 import time
-from typing import Callable, Dict, List, Optional, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urljoin
 
-from .hooks import TestForwardHook
-from .utils import get, post, decode_str, encode_obj
+import numpy as np
+import requests
+
+from .activations import ActivationStore
+from .auth import default_token_manager, InteractiveLogin, TokenManager
+from .cache import is_deterministic, normalize_config, GenerationCache
+from .flow_control import AdaptiveConcurrencyLimiter, TokenBucket
+from .batching import (
+    chunked_by_length,
+    context_batches,
+    indexed_chunks,
+    MicroBatcher,
+    SingleFlight,
+    MAX_BATCH_SIZE,
+)
+from .generation import GenerationBatch
+from .hedging import HedgingPolicy
+from .metrics import endpoint_of, Metrics, SIZE_BUCKETS
+from .readiness import ReadinessWaiter
+from .registry import ModelRegistry, DEFAULT_TTL
+from . import wire
+from .utils import (
+    get,
+    post,
+    post_tensors,
+    create_http_session,
+    clamp_timeout,
+    is_transient,
+    remaining_time,
+    reset_after_fork,
+    GatewayError,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_TIMEOUT,
+)
 
 JWT_TOKEN_FILE = Path(Path.home() / ".kaleidoscope.jwt")
+# Base delay in seconds before a failed generation batch is retried
+RETRY_BACKOFF = 0.5
+# Status codes of a gateway that does not provide an optional endpoint
+UNSUPPORTED_STATUS_CODES = (404, 405, 501)
 
 
 class NotSupportedError(Exception):
@@ -26,6 +69,8 @@ class Client:
         gateway_port: int,
         auth_key: Optional[str] = None,
         verbose: bool = False,
+        registry_ttl: float = DEFAULT_TTL,
+        **session_kwargs,
     ):
         """Initializes the Kaleidoscope client which faciliates communication with the gateway service
 
@@ -33,27 +78,32 @@ class Client:
         :param gateway_port: The port of the gateway service
         :param auth_key:  The authentication key for the gateway service
         :param verbose: Print debugging information
+        :param registry_ttl: Time in seconds the models, instances and instance states
+        are cached for
+        :param session_kwargs: Additional transport options forwarded to :class:`GatewaySession`
         """
 
         if auth_key:
-            self._session = GatewaySession(gateway_host, gateway_port, auth_key)
+            self._session = GatewaySession(
+                gateway_host, gateway_port, auth_key, **session_kwargs
+            )
         else:
-            self._session = GatewaySession(gateway_host, gateway_port)
-
-            if JWT_TOKEN_FILE.exists():
-                with open(JWT_TOKEN_FILE, "r") as f:
-                    auth_key = f.read()
-            else:
-                try:
-                    print(
-                        "You must authenticate with your LDAP credentials to use the Kaleidoscope service"
-                    )
-                    auth_key = self.authenticate()
-                except Exception as err:
-                    print(err)
-                    sys.exit(1)
+            # The token file is shared with other processes, which refresh it in turn
+            tokens = default_token_manager(gateway_host, gateway_port, JWT_TOKEN_FILE)
+            self._session = GatewaySession(
+                gateway_host, gateway_port, tokens=tokens, **session_kwargs
+            )
+
+            try:
+                if tokens.get() is None:
+                    self.authenticate()
+            except Exception as err:
+                print(err)
+                sys.exit(1)
 
-            self._session.auth_key = auth_key
+        self._session_kwargs = session_kwargs
+        self._readiness = ReadinessWaiter(self._session)
+        self._registry = ModelRegistry(self._session, ttl=registry_ttl)
 
         self.verbose = verbose
         if self.verbose:
@@ -61,162 +111,1379 @@ class Client:
                 f"Available models: {self.models} \nActive models instances: {self.model_instances}"
             )
 
+    def __getstate__(self):
+        # The session holds the token manager, so copies never prompt for a login
+        return {
+            "session": self._session,
+            "session_kwargs": self._session_kwargs,
+            "registry_ttl": self._registry.ttl,
+            "verbose": self.verbose,
+        }
+
+    def __setstate__(self, state: Dict):
+        self._session = state["session"]
+        self._session_kwargs = state["session_kwargs"]
+        self._readiness = ReadinessWaiter(self._session)
+        self._registry = ModelRegistry(self._session, ttl=state["registry_ttl"])
+        self.verbose = state["verbose"]
+
     def authenticate(self):
         """Authenticates this user with the gateway service via LDAP"""
-        num_tries = 0
-        while num_tries < 3:
-            username = input("Username: ")
-            password = getpass()
-            result = self._session.authenticate(username, password)
-            if result.status_code == 200:
-                print("Login successful.")
-                auth_key = json.loads(result.text)["token"]
-                with open(JWT_TOKEN_FILE, "w") as f:
-                    f.write(auth_key)
-                return auth_key
-            else:
-                print(f"Authentication failed: {json.loads(result.text)['msg']}")
-                num_tries += 1
-
-        raise Exception("Too many failed login attempts.")
+        auth_key = self._login()
+        self._session.tokens.set(auth_key)
+        return auth_key
 
-    @cached_property
+    def _login(self) -> str:
+        session = self._session
+        return InteractiveLogin(
+            session.gateway_host, session.gateway_port, session.timeout
+        )()
+
+    @property
     def models(self):
         """Returns a list of all supported models"""
-        return self._session.get_models()
+        return self._registry.models()
 
     @property
     def model_instances(self):
         """Returns a list of available model instances"""
-        return self._session.get_model_instances()
+        return self._registry.instances()
 
-    def load_model(self, model_name: str, wait_for_active: bool = False):
+    def load_model(
+        self,
+        model_name: str,
+        wait_for_active: bool = False,
+        cache: Optional[GenerationCache] = None,
+        timeout: Optional[float] = None,
+    ):
         """Loads a model from the gateway service
 
         :param model_name: (str) The name of the model to load
         :param wait_for_active: (bool) Whether to wait for the model to become active before returning
+        :param cache: (GenerationCache) Optional cache of generation results
+        :param timeout: (float) Maximum time in seconds to wait for the model to become active
+        :raises ModelLoadError: If the model failed to load
+        :raises TimeoutError: If the model is not active before the timeout
+        """
+
+        model = self._create_model(model_name, cache)
+
+        if wait_for_active:
+            self._readiness.wait(model.id, timeout)
+
+        return model
+
+    def load_models(
+        self,
+        model_names: List[str],
+        cache: Optional[GenerationCache] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator["Model"]:
+        """Launches several models concurrently, yielding each one as soon as it is active
+
+        All the models share a single readiness poller. Iteration stops with an error as soon
+        as any model fails to load.
+
+        :param model_names: (List[str]) The names of the models to load
+        :param cache: (GenerationCache) Optional cache of generation results
+        :param timeout: (float) Maximum time in seconds to wait for all the models
+        :raises ModelLoadError: If a model failed to load
+        :raises TimeoutError: If the models are not all active before the timeout
+        """
+        with ThreadPoolExecutor(max_workers=len(model_names) or 1) as executor:
+            models = list(
+                executor.map(partial(self._create_model, cache=cache), model_names)
+            )
+        ready = {self._readiness.watch(model.id): model for model in models}
+        return self._iter_ready(ready, timeout)
+
+    @staticmethod
+    def _iter_ready(ready, timeout):
+        try:
+            for future in as_completed(ready, timeout=timeout):
+                future.result()
+                yield ready[future]
+        except FutureTimeoutError:
+            raise TimeoutError(f"Models not active after {timeout} seconds") from None
+        finally:
+            for future in ready:
+                future.cancel()
+
+    @property
+    def metrics(self) -> Optional[Metrics]:
+        """The metrics recorded by the client, None unless created with `metrics=True`"""
+        return self._session.metrics
+
+    def stats(self) -> Dict:
+        """Returns a snapshot of the metrics of the client, see :meth:`Metrics.snapshot`
+
+        :raises ValueError: If the client was not created with `metrics=True`
+        """
+        if self._session.metrics is None:
+            raise ValueError(
+                "Metrics are disabled, create the client with metrics=True"
+            )
+        return self._session.metrics.snapshot()
+
+    def load_balanced(
+        self,
+        model_name: str,
+        gateways: Optional[List[Tuple[str, int]]] = None,
+        **pool_kwargs,
+    ):
+        """Returns a handle spreading generation over every active instance of a model
+
+        :param model_name: (str) The name of the model
+        :param gateways: (List[Tuple[str, int]]) Additional (host, port) gateways to search for
+        instances, besides the one of this client
+        :param pool_kwargs: Additional arguments forwarded to :class:`ModelPool`
+        :raises ValueError: If no instance of the model is active
         """
+        from .pool import ModelPool
 
+        sessions = [self._session]
+        session_kwargs = dict(
+            self._session_kwargs, metrics=self._session.metrics or False
+        )
+        for gateway_host, gateway_port in gateways or []:
+            sessions.append(
+                GatewaySession(
+                    gateway_host,
+                    gateway_port,
+                    tokens=self._session.tokens,
+                    **session_kwargs,
+                )
+            )
+        return ModelPool(model_name, sessions, **pool_kwargs)
+
+    def _create_model(
+        self, model_name: str, cache: Optional[GenerationCache] = None
+    ) -> "Model":
         model_instance_response = self._session.create_model_instance(model_name)
+        self._registry.invalidate(model_instance_response["id"])
 
-        model = Model(
+        return Model(
             model_instance_response["id"],
             model_instance_response["name"],
             self._session,
+            cache=cache,
+            registry=self._registry,
         )
 
-        if wait_for_active:
-            active = False
-            while not active:
-                model_state = model.state
-                if model_state == "ACTIVE":
-                    active = True
-                elif model_state == "FAILED":
-                    raise Exception("Model failed to load")
-                time.sleep(2)
-
-        return model
-
 
 class GatewaySession:
     """A session for a model instance"""
 
     def __init__(
-        self, gateway_host: str, gateway_port: int, auth_key: Optional[str] = None
+        self,
+        gateway_host: str,
+        gateway_port: int,
+        auth_key: Optional[str] = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        wire_format: str = wire.JSON,
+        compression: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        metrics: Union[bool, Metrics] = False,
+        tokens: Optional[TokenManager] = None,
     ):
+        """Initializes a session with a pooled, keep-alive HTTP transport
+
+        Requests answered with a `Retry-After` header pause every request of the session for
+        the requested time. A request rejected with a 401 is retried once with a new token,
+        if `tokens` can provide one.
+
+        :param gateway_host: The host of the gateway service
+        :param gateway_port: The port of the gateway service
+        :param auth_key: The authentication key for the gateway service
+        :param pool_size: (int) Maximum number of persistent connections, should be at least
+        the number of threads sharing this session
+        :param max_retries: (int) Number of retries with backoff for idempotent requests
+        :param timeout: (float or tuple) Per-call timeout in seconds, or a (connect, read) tuple
+        :param wire_format: (str) Preferred encoding of generate responses, "json" or "msgpack".
+        The gateway falls back to JSON if it does not support the requested format.
+        :param compression: (str) Compress generate request bodies with "gzip" or "zstd"
+        :param max_concurrency: (int) Adapt the number of generate requests in flight to the
+        load of the gateway, up to this number. See :class:`AdaptiveConcurrencyLimiter`.
+        :param rate_limit: (float) Maximum number of requests per second
+        :param metrics: (bool or Metrics) Record metrics about every gateway call, into the
+        given :class:`Metrics` or a new one if True
+        :param tokens: (TokenManager) Provides and refreshes the authentication key, shared
+        by sessions using the same credentials. Used instead of `auth_key`.
+        """
+        wire.check_wire_options(wire_format, compression)
         self.gateway_host = gateway_host
         self.gateway_port = gateway_port
-        self.auth_key = auth_key
+        self.tokens = tokens if tokens is not None else TokenManager(auth_key)
+        self.timeout = timeout
+        self.wire_format = wire_format
+        self.compression = compression
 
         self.base_addr = f"http://{self.gateway_host}:{self.gateway_port}/"
         self.create_addr = partial(urljoin, self.base_addr)
 
+        self.metrics = metrics if isinstance(metrics, Metrics) else None
+        if metrics is True:
+            self.metrics = Metrics()
+
+        self._http = self._create_http(pool_size=pool_size, max_retries=max_retries)
+        self._http_once = None
+        self._pool_size = pool_size
+        self._max_retries = max_retries
+
+        self.limiter = _create_limiter(max_concurrency)
+        self._rate_limit = TokenBucket(rate_limit) if rate_limit else None
+        self._paused_until = 0.0
+        reset_after_fork(self)
+
+    def close(self):
+        """Closes all pooled connections held by this session"""
+        if self._http is not None:
+            self._http.close()
+        if self._http_once is not None:
+            self._http_once.close()
+
+    def __getstate__(self):
+        # Sessions are pickled as their settings, the copy opens its own connections
+        return {
+            "gateway_host": self.gateway_host,
+            "gateway_port": self.gateway_port,
+            "tokens": self.tokens,
+            "pool_size": self._pool_size,
+            "max_retries": self._max_retries,
+            "timeout": self.timeout,
+            "wire_format": self.wire_format,
+            "compression": self.compression,
+            "max_concurrency": self.limiter.max_limit if self.limiter else None,
+            "rate_limit": self._rate_limit.rate if self._rate_limit else None,
+            "metrics": self.metrics or False,
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def _after_fork(self):
+        # Connections are shared with the parent process, new ones are opened on first use
+        self._http = None
+        self._http_once = None
+        if self.limiter is not None:
+            self.limiter = _create_limiter(self.limiter.max_limit)
+        if self._rate_limit is not None:
+            self._rate_limit = TokenBucket(
+                self._rate_limit.rate, self._rate_limit.burst
+            )
+
+    @property
+    def auth_key(self) -> Optional[str]:
+        """The current authentication key, refreshed shortly before it expires"""
+        return self.tokens.get()
+
+    @auth_key.setter
+    def auth_key(self, auth_key: Optional[str]):
+        self.tokens = TokenManager(auth_key)
+
     def authenticate(self, username: str, password: str):
         url = self.create_addr("authenticate")
-        response = requests.post(url, auth=(username, password))
+        response = self._get_http().post(
+            url, auth=(username, password), timeout=self.timeout
+        )
         return response
 
     def get_models(self):
         url = self.create_addr("models")
-        response = get(url)
+        response = self._request(get, url)
         return response
 
     def get_model_instances(self):
         url = self.create_addr("models/instances")
-        response = get(url)
+        response = self._request(get, url)
         return response
 
     def create_model_instance(self, model_name: str):
         url = self.create_addr("models/instances")
         body = {"name": model_name}
-        response = post(url, body, auth_key=self.auth_key)
+        response = self._request(post, url, body, auth_key=self.auth_key)
 
         return response
 
-    def get_model_instance(self, model_instance_id: str):
+    def get_model_instance(
+        self, model_instance_id: str, timeout: Optional[float] = None
+    ):
         url = self.create_addr(f"models/instances/{model_instance_id}")
 
-        response = get(url, auth_key=self.auth_key)
+        response = self._request(get, url, auth_key=self.auth_key, timeout=timeout)
         return response
 
     def get_model_instance_module_names(self, model_instance_id: str):
         url = self.create_addr(f"models/instances/{model_instance_id}/module_names")
 
-        response = get(url, auth_key=self.auth_key)
+        response = self._request(get, url, auth_key=self.auth_key)
         return response
 
     def generate(
-        self, model_instance_id: str, prompts: List[str], generation_config: Dict
+        self,
+        model_instance_id: str,
+        prompts: List[str],
+        generation_config: Dict,
+        timeout: Optional[float] = None,
     ):
-        """Generates text from the model instance"""
+        """Generates text from the model instance
+
+        With the msgpack wire format, the logprobs of the response are a mapping of flat
+        float32 `values` and int64 `offsets` arrays instead of one list per prompt.
+
+        :param timeout: (float) Maximum time in seconds the call may take, including time
+        spent waiting on the rate and concurrency limits
+        :raises TimeoutError: If the call does not complete in time
+        """
 
         url = self.create_addr(f"models/instances/{model_instance_id}/generate")
         body = {"prompts": prompts, "generation_config": generation_config}
+        if self.metrics is not None:
+            self.metrics.observe(
+                "prompts_per_request", len(prompts), buckets=SIZE_BUCKETS
+            )
+
+        response = self._request(
+            post,
+            url,
+            body,
+            auth_key=self.auth_key,
+            wire_format=self.wire_format,
+            compression=self.compression,
+            limited=True,
+            timeout=timeout,
+        )
+
+        return response
+
+    def score(
+        self,
+        model_instance_id: str,
+        contexts: List[str],
+        continuations: List[Tuple[int, str]],
+        timeout: Optional[float] = None,
+    ):
+        """Computes the log-likelihood of continuations of shared contexts
+
+        Requires a gateway deployment providing the `score` endpoint.
+
+        :param contexts: (List[str]) Distinct contexts, each sent once
+        :param continuations: (List[Tuple[int, str]]) Pairs of the index of a context in
+        `contexts` and a continuation of it
+        :param timeout: (float) Maximum time in seconds the call may take
+        :return: A dict with the log-likelihood of each continuation under "scores"
+        :raises NotSupportedError: If the gateway does not provide the endpoint
+        :raises TimeoutError: If the call does not complete in time
+        """
+
+        url = self.create_addr(f"models/instances/{model_instance_id}/score")
+        body = {
+            "contexts": contexts,
+            "continuations": [list(pair) for pair in continuations],
+        }
+        if self.metrics is not None:
+            self.metrics.observe(
+                "prompts_per_request", len(continuations), buckets=SIZE_BUCKETS
+            )
+
+        response = self._optional_request(
+            "scoring",
+            post,
+            url,
+            body,
+            auth_key=self.auth_key,
+            compression=self.compression,
+            limited=True,
+            timeout=timeout,
+        )
+
+        return response
+
+    def get_activations(
+        self,
+        model_instance_id: str,
+        prompts: List[str],
+        module_names: List[str],
+        path: Optional[Union[str, Path]] = None,
+        timeout: Optional[float] = None,
+    ):
+        """Retrieves the activations of modules of the model instance for a batch of prompts
+
+        The gateway answers with a tensor frame, see :mod:`kscope.serialization`, holding
+        one array per module with the rows of every prompt concatenated, and the number of
+        rows of each prompt under "lengths" in its metadata.
+
+        Requires a gateway deployment providing the `activations` endpoint.
+
+        :param path: (str or Path) File the frame is streamed into, it is read into memory
+        if None
+        :param timeout: (float) Maximum time in seconds the call may take
+        :return: The arrays by module name, and the metadata of the frame
+        :raises NotSupportedError: If the gateway does not provide the endpoint
+        :raises TimeoutError: If the call does not complete in time
+        """
+
+        url = self.create_addr(f"models/instances/{model_instance_id}/activations")
+        body = {"prompts": prompts, "module_names": module_names}
+
+        return self._optional_request(
+            "activation retrieval",
+            post_tensors,
+            url,
+            body,
+            path,
+            auth_key=self.auth_key,
+            compression=self.compression,
+            limited=True,
+            timeout=timeout,
+        )
+
+    def _optional_request(
+        self, feature: str, send: Callable, url: str, *args, **kwargs
+    ):
+        """Sends a request to an endpoint that only some gateway deployments provide
+
+        :raises NotSupportedError: If the gateway does not provide the endpoint
+        """
+        try:
+            return self._request(send, url, *args, **kwargs)
+        except GatewayError as err:
+            if err.status_code not in UNSUPPORTED_STATUS_CODES:
+                raise
+            raise NotSupportedError(
+                f"The gateway at {self.base_addr} does not support {feature}, which "
+                f"requires a deployment providing the {endpoint_of(url)} endpoint"
+            ) from err
 
-        response = post(url, body, auth_key=self.auth_key)
+    def _request(
+        self,
+        send: Callable,
+        url: str,
+        *args,
+        limited: bool = False,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ):
+        """Sends a request through the rate limit and any Retry-After pause
 
+        `limited` requests also wait for a slot of the adaptive concurrency limiter, and
+        their outcome adjusts its limit. With a `timeout`, the whole call including these
+        waits must complete within `timeout` seconds or raises :class:`TimeoutError`.
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        if self._rate_limit is not None:
+            self._rate_limit.acquire(timeout=timeout)
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Gateway asked to retry after {delay:.1f} seconds")
+            time.sleep(delay)
+
+        limiter = self.limiter if limited else None
+        if limiter is not None:
+            limiter.acquire(remaining_time(deadline))
+        if self.metrics is not None:
+            self.metrics.observe(
+                "queue_wait_seconds", time.monotonic() - start, stage="session"
+            )
+        if limiter is None:
+            return self._send(send, url, deadline, *args, **kwargs)
+
+        start = time.monotonic()
+        try:
+            response = self._send(send, url, deadline, *args, **kwargs)
+        except GatewayError as err:
+            limiter.release(overloaded=err.overloaded)
+            raise
+        except requests.Timeout:
+            limiter.release(overloaded=True)
+            raise
+        except BaseException:
+            limiter.release()
+            raise
+        limiter.release(latency=time.monotonic() - start)
         return response
 
+    def _send(
+        self, send: Callable, url: str, deadline: Optional[float], *args, **kwargs
+    ):
+        metrics = self.metrics
+        if metrics is None:
+            return self._call(send, url, deadline, *args, **kwargs)
+
+        endpoint = endpoint_of(url)
+        status = "error"
+        start = time.monotonic()
+        with metrics.span(f"kscope {endpoint}", **{"http.url": url}):
+            try:
+                response = self._call(send, url, deadline, *args, **kwargs)
+                status = "ok"
+                return response
+            except GatewayError as err:
+                status = err.status_code
+                raise
+            except (TimeoutError, requests.Timeout):
+                status = "timeout"
+                raise
+            finally:
+                metrics.observe(
+                    "request_latency_seconds",
+                    time.monotonic() - start,
+                    endpoint=endpoint,
+                )
+                metrics.increment("requests_total", endpoint=endpoint, status=status)
+
+    def _call(
+        self, send: Callable, url: str, deadline: Optional[float], *args, **kwargs
+    ):
+        try:
+            return self._call_once(send, url, deadline, *args, **kwargs)
+        except GatewayError as err:
+            rejected = kwargs.get("auth_key")
+            if err.status_code != 401 or rejected is None:
+                raise
+            # The token expired or was revoked, retry once with a new one
+            auth_key = self.tokens.refresh(rejected=rejected)
+            if auth_key is None:
+                raise
+            kwargs["auth_key"] = auth_key
+            return self._call_once(send, url, deadline, *args, **kwargs)
+
+    def _call_once(
+        self, send: Callable, url: str, deadline: Optional[float], *args, **kwargs
+    ):
+        timeout = clamp_timeout(self.timeout, remaining_time(deadline))
+        try:
+            return send(
+                url, *args, session=self._transport(deadline), timeout=timeout, **kwargs
+            )
+        except GatewayError as err:
+            if err.retry_after:
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + err.retry_after
+                )
+            raise
+        except requests.Timeout as err:
+            if deadline is not None:
+                raise TimeoutError(
+                    f"Request to {url} did not complete in time"
+                ) from err
+            raise
+
+    def _create_http(self, pool_size: int, max_retries: int):
+        http = create_http_session(pool_size=pool_size, max_retries=max_retries)
+        if self.metrics is not None:
+            http.hooks["response"].append(self._record_transfer)
+        return http
+
+    def _record_transfer(self, resp, *args, **kwargs):
+        """Response hook counting the bytes exchanged and the transport level retries"""
+        endpoint = endpoint_of(resp.request.path_url)
+        body = resp.request.body
+        received = resp.headers.get("Content-Length")
+        if received is None and resp.raw is not None and not resp.raw.closed:
+            # Streamed bodies are read later by the caller, and must not be read here
+            received = 0
+        self.metrics.increment(
+            "bytes_sent_total", len(body) if body else 0, endpoint=endpoint
+        )
+        self.metrics.increment(
+            "bytes_received_total",
+            int(received) if received is not None else len(resp.content),
+            endpoint=endpoint,
+        )
+        retries = getattr(resp.raw, "retries", None)
+        if retries is not None and retries.history:
+            self.metrics.increment(
+                "retries_total",
+                len(retries.history),
+                endpoint=endpoint,
+                layer="transport",
+            )
+
+    def _get_http(self):
+        if self._http is None:
+            self._http = self._create_http(
+                pool_size=self._pool_size, max_retries=self._max_retries
+            )
+        return self._http
+
+    def _transport(self, deadline: Optional[float]):
+        if deadline is None:
+            return self._get_http()
+        # Transport retries of a stalled request would outlive the deadline of the call
+        if self._http_once is None:
+            self._http_once = self._create_http(
+                pool_size=self._pool_size, max_retries=0
+            )
+        return self._http_once
+
+
+def _create_limiter(
+    max_concurrency: Optional[int],
+) -> Optional[AdaptiveConcurrencyLimiter]:
+    if max_concurrency is None:
+        return None
+    return AdaptiveConcurrencyLimiter(
+        initial_limit=min(4, max_concurrency), max_limit=max_concurrency
+    )
+
+
+# The model of a worker process of `Model.map_processes`
+_worker_model = None
+
+
+def _init_worker(model: "Model"):
+    global _worker_model
+    _worker_model = model
+
+
+def _call_in_worker(fn: Callable, item):
+    return fn(_worker_model, item)
+
+
+def _deadline(timeout: Optional[float]) -> Optional[float]:
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _result(future, deadline: Optional[float]):
+    """Waits for a future until the deadline, raising the builtin TimeoutError"""
+    try:
+        return future.result(remaining_time(deadline))
+    except FutureTimeoutError:
+        raise TimeoutError("Generation did not complete in time") from None
+
 
 class Model:
     def __init__(
-        self, model_instance_id: str, model_name: str, session: GatewaySession
+        self,
+        model_instance_id: str,
+        model_name: str,
+        session: GatewaySession,
+        cache: Optional[GenerationCache] = None,
+        registry: Optional[ModelRegistry] = None,
     ):
         """Initializes a model instance
 
         :param client: (Client) Kaleidoscope client that this model belongs to
         :param model_name: (str): The name of the model
+        :param cache: (GenerationCache) Optional cache of generation results. Only
+        deterministic generation configs are cached unless the cache is configured otherwise.
+        :param registry: (ModelRegistry) Optional registry the instance state is read from
         """
 
         self.name = model_name
         self.id = model_instance_id
         self._session = session
+        self._registry = registry
+        self.cache = cache
+        self._batcher = None
+        self._hedging = None
+        self._in_flight = SingleFlight()
+        reset_after_fork(self)
+
+    def __getstate__(self):
+        # Models are pickled as their settings, threads and locks are created afresh
+        return dict(self._features(), init=self._init_args())
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state["init"])
+        self._restore_features(state)
+
+    def _init_args(self) -> Dict:
+        return {
+            "model_instance_id": self.id,
+            "model_name": self.name,
+            "session": self._session,
+            "cache": self.cache,
+            "registry": self._registry,
+        }
+
+    def _features(self) -> Dict:
+        """The arguments batching and hedging were enabled with"""
+        features = {}
+        if self._batcher is not None:
+            features["batching"] = {
+                "max_batch": self._batcher.max_batch,
+                "max_wait": self._batcher.max_wait,
+                "max_concurrency": self._batcher.max_concurrency,
+            }
+        if self._hedging is not None:
+            features["hedging"] = {
+                "percentile": self._hedging.percentile,
+                "budget": self._hedging.budget,
+                "min_samples": self._hedging.min_samples,
+            }
+        return features
+
+    def _restore_features(self, features: Dict):
+        if "batching" in features:
+            self.enable_batching(**features["batching"])
+        if "hedging" in features:
+            self.enable_hedging(**features["hedging"])
+
+    def _after_fork(self):
+        # The threads of the batcher and the hedging policy do not survive a fork
+        features = self._features()
+        self._batcher = None
+        self._hedging = None
+        self._in_flight = SingleFlight()
+        self._restore_features(features)
 
     @property
     def state(self):
         """Returns a string describing the state of the model"""
+        if self._registry is not None:
+            return self._registry.state(self.id)
         return self._session.get_model_instance(self.id)["state"]
 
+    def get_state(self, timeout: Optional[float] = None) -> str:
+        """Fetches the current state of the model from the gateway, bypassing any cache
+
+        :param timeout: (float) Maximum time to wait for the gateway in seconds
+        :raises TimeoutError: If the gateway does not answer in time
+        """
+        return self._session.get_model_instance(self.id, timeout=timeout)["state"]
+
     @cached_property
     def module_names(self):
-        raise NotSupportedError("Support for the `module_names` method has been discontinued")
+        raise NotSupportedError(
+            "Support for the `module_names` method has been discontinued"
+        )
 
     def is_active(self):
         """Checks if the model instance is active"""
         return self.state == "ACTIVE"
 
-    def generate(self, prompts: Union[str, List[str]], generation_config: Dict = {}):
+    def enable_batching(
+        self,
+        max_batch: int = MAX_BATCH_SIZE,
+        max_wait: float = 0.005,
+        max_concurrency: int = 4,
+    ):
+        """Merges small `generate` calls made concurrently from many threads into shared requests
+
+        Calls with fewer than `max_batch` prompts are queued for up to `max_wait` seconds,
+        and prompts with the same generation config are sent together. Each caller still
+        receives only its own results.
+
+        :param max_batch: (int) Maximum number of prompts per request
+        :param max_wait: (float) Maximum time in seconds a call waits for others to join
+        :param max_concurrency: (int) Maximum number of merged requests in flight
+        """
+        self.disable_batching()
+        self._batcher = MicroBatcher(
+            self._request_generation,
+            max_batch=max_batch,
+            max_wait=max_wait,
+            max_concurrency=max_concurrency,
+            metrics=self._session.metrics,
+        )
+
+    def disable_batching(self):
+        """Sends any queued prompts and stops merging `generate` calls"""
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+
+    def enable_hedging(
+        self, percentile: float = 95.0, budget: float = 0.05, min_samples: int = 20
+    ):
+        """Duplicates generate requests slower than most, and keeps the first answer
+
+        On a :class:`ModelPool`, the duplicate goes to a different instance when possible.
+        See :class:`HedgingPolicy`.
+
+        :param percentile: (float) Latency percentile after which a request is duplicated
+        :param budget: (float) Maximum fraction of requests that are duplicated
+        :param min_samples: (int) Number of latencies observed before hedging starts
+        """
+        self.disable_hedging()
+        self._hedging = HedgingPolicy(
+            percentile=percentile, budget=budget, min_samples=min_samples
+        )
+
+    def disable_hedging(self):
+        """Stops duplicating slow generate requests"""
+        if self._hedging is not None:
+            self._hedging.close()
+            self._hedging = None
+
+    def generate(
+        self,
+        prompts: Union[str, List[str]],
+        generation_config: Dict = {},
+        timeout: Optional[float] = None,
+    ):
         """Generates text from the model instance
 
         :param prompts: (str or List[str]) Single prompt or list of prompts to generate from.
         Supports upto 8 prompts in a single request.
         :param kwargs: (dict) Additional arguments to pass to the model
+        :param timeout: (float) Maximum time in seconds to wait for the generation
+        :return: (GenerationBatch) The generation of each prompt, in order
+        :raises TimeoutError: If the generation does not complete in time
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+
+        return self._generate(prompts, generation_config, deadline=_deadline(timeout))
+
+    def generate_many(
+        self,
+        prompts: List[str],
+        generation_config: Dict = {},
+        max_batch: int = MAX_BATCH_SIZE,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        timeout: Optional[float] = None,
+        pack_by_length: bool = False,
+        length_fn: Optional[Callable[[str], int]] = None,
+    ):
+        """Generates text for any number of prompts
+
+        The prompts are split into batches of `max_batch` which are sent concurrently.
+        A failed batch is retried on its own, and the results are returned in input order.
+        The session's `pool_size` should be at least `concurrency` to keep connections alive.
+
+        With `pack_by_length`, prompts of similar length are batched together, which saves
+        the gateway from padding short prompts to the length of a long one.
+
+        :param prompts: (List[str]) Prompts to generate from
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :param max_batch: (int) Maximum number of prompts per request
+        :param concurrency: (int) Maximum number of requests in flight
+        :param max_retries: (int) Number of times a failed batch is retried
+        :param timeout: (float) Maximum time in seconds to wait for every generation
+        :param pack_by_length: (bool) Batch prompts by length rather than in input order
+        :param length_fn: Estimates the length of a prompt for packing, e.g. its number of
+        tokens with a tokenizer. Defaults to the number of characters, implies
+        `pack_by_length`.
+        :raises TimeoutError: If the generations do not complete in time
+        """
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        if not prompts:
+            raise ValueError("At least one prompt is required")
+
+        pack = pack_by_length or length_fn is not None
+        if pack:
+            batches = chunked_by_length(prompts, max_batch, length_fn or len)
+        else:
+            batches = indexed_chunks(prompts, max_batch)
+        responses = self._iter_batches(
+            batches,
+            generation_config,
+            concurrency,
+            max_retries,
+            deadline=_deadline(timeout),
+        )
+
+        if pack:
+            results = [None] * len(prompts)
+            for indices, batch in responses:
+                for i, generation in zip(indices, batch.split()):
+                    results[i] = generation
+            return GenerationBatch.concat(results)
+        by_offset = {indices[0]: batch for indices, batch in responses}
+        return GenerationBatch.concat([by_offset[i] for i in sorted(by_offset)])
+
+    def generate_iter(
+        self,
+        prompts: Iterable[str],
+        generation_config: Dict = {},
+        max_batch: int = MAX_BATCH_SIZE,
+        max_in_flight: int = 4,
+        max_retries: int = 3,
+        pack_by_length: bool = False,
+        length_fn: Optional[Callable[[str], int]] = None,
+        pack_window: Optional[int] = None,
+    ) -> Iterator[Tuple[int, object]]:
+        """Lazily generates text for a stream of prompts, yielding results as they complete
+
+        Prompts are consumed from the iterable only as batches are dispatched, and at most
+        `max_in_flight` batches are outstanding at a time, so memory stays bounded
+        regardless of the number of prompts.
+
+        With `pack_by_length`, prompts are read `pack_window` at a time and batched with
+        prompts of similar length from the same window.
+
+        :param prompts: (Iterable[str]) Any iterable or generator of prompts
+        :param generation_config: (dict) Additional arguments to pass to the model
+        :param max_batch: (int) Maximum number of prompts per request
+        :param max_in_flight: (int) Maximum number of requests in flight
+        :param max_retries: (int) Number of times a failed batch is retried
+        :param pack_by_length: (bool) Batch prompts by length rather than in input order
+        :param length_fn: Estimates the length of a prompt for packing, implies
+        `pack_by_length`. Defaults to the number of characters.
+        :param pack_window: (int) Number of prompts sorted by length together, defaults to
+        four times the number of prompts in flight
+        :return: Iterator of (index, generation) pairs in completion order, where index is the
+        position of the prompt in the input and generation a single-prompt :class:`GenerationBatch`
+        """
+        if pack_by_length or length_fn is not None:
+            batches = chunked_by_length(
+                prompts,
+                max_batch,
+                length_fn or len,
+                window=pack_window or 4 * max_batch * max_in_flight,
+            )
+        else:
+            batches = indexed_chunks(prompts, max_batch)
+        for indices, batch in self._iter_batches(
+            batches, generation_config, max_in_flight, max_retries
+        ):
+            for i, generation in zip(indices, batch.split()):
+                yield i, generation
+
+    def score(
+        self,
+        contexts: Union[str, List[str]],
+        continuations: Union[str, List[str]],
+        max_batch: int = MAX_BATCH_SIZE,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        timeout: Optional[float] = None,
+    ) -> np.ndarray:
+        """Computes the log-likelihood of each continuation given its context
+
+        Pairs sharing a context are sent in the same requests, with the context sent once
+        per request, which suits ranking several candidate answers to the same question.
+
+        Scoring needs server support: the gateway must provide the `score` endpoint, as
+        generate only returns the logprobs of generated tokens, not of given ones.
+
+        :param contexts: (str or List[str]) The context of each continuation, or a single
+        context shared by every continuation
+        :param continuations: (str or List[str]) Continuations to score
+        :param max_batch: (int) Maximum number of continuations per request
+        :param concurrency: (int) Maximum number of requests in flight
+        :param max_retries: (int) Number of times a failed batch is retried
+        :param timeout: (float) Maximum time in seconds to wait for every score
+        :return: (np.ndarray) The float64 log-likelihood of each continuation, in input order
+        :raises NotSupportedError: If the gateway does not provide the `score` endpoint
+        :raises TimeoutError: If the scores are not computed in time
+        """
+        if isinstance(continuations, str):
+            continuations = [continuations]
+        if isinstance(contexts, str):
+            contexts = [contexts] * len(continuations)
+        if len(contexts) != len(continuations):
+            raise ValueError(
+                f"Got {len(contexts)} contexts for {len(continuations)} continuations"
+            )
+        if not continuations:
+            raise ValueError("At least one continuation is required")
+
+        deadline = _deadline(timeout)
+        scores = np.empty(len(continuations), dtype=np.float64)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(
+                    self._with_retries,
+                    partial(self._send_scores, batch_contexts, pairs, deadline),
+                    max_retries,
+                    deadline,
+                    endpoint="score",
+                ): indices
+                for indices, batch_contexts, pairs in context_batches(
+                    contexts, continuations, max_batch
+                )
+            }
+            try:
+                for future in as_completed(futures, timeout=remaining_time(deadline)):
+                    scores[futures[future]] = future.result()
+            except FutureTimeoutError:
+                for future in futures:
+                    future.cancel()
+                raise TimeoutError("Scores were not computed in time") from None
+        return scores
+
+    def get_activations(
+        self,
+        prompts: Iterable[str],
+        module_names: List[str],
+        output_dir: Union[str, Path],
+        max_batch: int = MAX_BATCH_SIZE,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        timeout: Optional[float] = None,
+    ) -> ActivationStore:
+        """Retrieves the activations of modules for any number of prompts into a store on disk
+
+        Prompts are consumed lazily and sent in batches of `max_batch`, with at most
+        `concurrency` batches in flight. The activations of each batch are streamed from the
+        gateway straight into a file of `output_dir`, so memory use is bounded by the batch
+        size rather than the number of prompts.
+
+        Retrieving activations needs server support: the gateway must provide the
+        `activations` endpoint, which the standard deployment does not.
+
+        :param prompts: (Iterable[str]) Any iterable or generator of prompts
+        :param module_names: (List[str]) Names of the modules whose activations are retrieved
+        :param output_dir: (str or Path) Directory of the new store, which must not already
+        hold one
+        :param max_batch: (int) Maximum number of prompts per request
+        :param concurrency: (int) Maximum number of requests in flight
+        :param max_retries: (int) Number of times a failed batch is retried
+        :param timeout: (float) Maximum time in seconds to wait for every activation
+        :return: (ActivationStore) The store, where `store[module][i]` is the activation of
+        `module` for the i-th prompt
+        :raises NotSupportedError: If the gateway does not provide the `activations` endpoint
+        :raises TimeoutError: If the activations are not retrieved in time
         """
         if isinstance(prompts, str):
             prompts = [prompts]
-        generation_response = self._session.generate(
-            self.id, prompts, generation_config
+        if isinstance(module_names, str):
+            module_names = [module_names]
+        if not module_names:
+            raise ValueError("At least one module name is required")
+
+        deadline = _deadline(timeout)
+        writer = ActivationStore.create(output_dir, module_names)
+
+        def fetch(indices, batch):
+            path = writer.new_chunk_path()
+            arrays, metadata = self._with_retries(
+                partial(self._send_activations, batch, module_names, path, deadline),
+                max_retries,
+                deadline,
+                endpoint="activations",
+            )
+            writer.add_chunk(path, indices, arrays, metadata)
+
+        in_flight = set()
+
+        def drain():
+            done, pending = wait(
+                in_flight,
+                timeout=remaining_time(deadline),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                for future in pending:
+                    future.cancel()
+                raise TimeoutError("Activations were not retrieved in time")
+            in_flight.difference_update(done)
+            for future in done:
+                future.result()
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for indices, batch in indexed_chunks(prompts, max_batch):
+                    if len(in_flight) >= concurrency:
+                        drain()
+                    in_flight.add(executor.submit(fetch, indices, batch))
+                while in_flight:
+                    drain()
+        finally:
+            # Keep the chunks completed so far readable, even if a batch failed
+            store = writer.close()
+        return store
+
+    def map_processes(
+        self,
+        fn: Callable,
+        items: Iterable,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        mp_context=None,
+    ) -> Iterator:
+        """Calls `fn(model, item)` for every item in a pool of processes, yielding results in order
+
+        Suits pipelines whose preprocessing or postprocessing is CPU bound: each worker
+        process receives its own copy of this model, with its own connections and the same
+        authentication, so `fn` can prepare prompts, call any generation method and process
+        the results without holding the GIL of the caller.
+
+        :param fn: Callable taking the model and an item. It is sent to the workers, so it
+        must be picklable, e.g. a function defined at the top level of a module.
+        :param items: (Iterable) Items, consumed lazily
+        :param workers: (int) Number of processes, the number of CPUs by default
+        :param max_pending: (int) Maximum number of items submitted but not yet yielded,
+        four per worker by default
+        :param mp_context: Multiprocessing context of the workers, e.g.
+        `multiprocessing.get_context("spawn")`
+        :return: Iterator of the results of `fn`, in the order of `items`
+        """
+        workers = workers or os.cpu_count() or 1
+        max_pending = max_pending or 4 * workers
+        pending = deque()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(self,),
+        ) as executor:
+            try:
+                for item in items:
+                    if len(pending) >= max_pending:
+                        yield pending.popleft().result()
+                    pending.append(executor.submit(_call_in_worker, fn, item))
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _iter_batches(
+        self,
+        batches: Iterable[Tuple[List[int], List[str]]],
+        generation_config: Dict,
+        max_in_flight: int,
+        max_retries: int,
+        deadline: Optional[float] = None,
+    ):
+        """Yields (indices, response) for each batch in completion order
+
+        :param batches: Iterable of (positions in the input, prompts) pairs
+        """
+        generate_batch = partial(
+            self._generate,
+            generation_config=generation_config,
+            max_retries=max_retries,
+            deadline=deadline,
+        )
+        in_flight = {}
+
+        def drain():
+            done, _ = wait(
+                in_flight,
+                timeout=remaining_time(deadline),
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                for future in in_flight:
+                    future.cancel()
+                raise TimeoutError("Generations did not complete in time")
+            for future in done:
+                yield in_flight.pop(future), future.result()
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for indices, batch in batches:
+                if len(in_flight) >= max_in_flight:
+                    yield from drain()
+                in_flight[executor.submit(generate_batch, batch)] = indices
+            while in_flight:
+                yield from drain()
+
+    def _generate(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        max_retries: int = 0,
+        deadline: Optional[float] = None,
+    ):
+        """Generates a single batch
+
+        Cached results are served without a request. With a deterministic config, or one
+        the cache stores, duplicate prompts are sent once and prompts already being
+        generated by another thread are waited on rather than resent.
+        """
+        cache = self.cache
+        use_cache = cache is not None and cache.should_cache(generation_config)
+        if not use_cache and not is_deterministic(generation_config):
+            # Sampled generations of the same prompt differ, so none of them are shared
+            return self._generate_with_retries(
+                prompts, generation_config, max_retries, deadline
+            )
+
+        config_key = normalize_config(generation_config)
+        keys = [(prompt, config_key) for prompt in prompts]
+        unique_prompts = dict(zip(keys, prompts))
+
+        results = {}
+        if use_cache:
+            cache_keys = {
+                key: cache.make_key(self.name, prompt, generation_config)
+                for key, prompt in unique_prompts.items()
+            }
+            cached = cache.get_many(cache_keys.values())
+            for key, cache_key in cache_keys.items():
+                if cache_key in cached:
+                    results[key] = GenerationBatch.from_response(cached[cache_key])
+            metrics = self._session.metrics
+            if metrics is not None:
+                metrics.increment("cache_hits_total", len(cached))
+                metrics.increment("cache_misses_total", len(cache_keys) - len(cached))
+
+        owned, waiting = self._in_flight.claim(
+            key for key in unique_prompts if key not in results
+        )
+        if owned:
+            # All prompts this call is responsible for go out together in a single request
+            try:
+                batch = self._generate_with_retries(
+                    [unique_prompts[key] for key in owned],
+                    generation_config,
+                    max_retries,
+                    deadline,
+                )
+                fetched = dict(zip(owned, batch.split()))
+                if use_cache:
+                    cache.put_many(
+                        {cache_keys[key]: fetched[key].to_response() for key in owned}
+                    )
+            except BaseException as err:
+                self._in_flight.fail(owned, err)
+                raise
+            self._in_flight.resolve(fetched)
+            results.update(fetched)
+        for key, future in waiting.items():
+            results[key] = _result(future, deadline)
+
+        return GenerationBatch.concat([results[key] for key in keys])
+
+    def _generate_with_retries(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        max_retries: int,
+        deadline: Optional[float] = None,
+    ):
+        return self._with_retries(
+            partial(self._send, prompts, generation_config, deadline),
+            max_retries,
+            deadline,
+            endpoint="generate",
+        )
+
+    def _with_retries(
+        self,
+        call: Callable,
+        max_retries: int,
+        deadline: Optional[float] = None,
+        endpoint: str = "generate",
+    ):
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except (GatewayError, requests.RequestException) as err:
+                backoff = RETRY_BACKOFF * (2**attempt)
+                if attempt >= max_retries or not is_transient(err):
+                    raise
+                if deadline is not None and time.monotonic() + backoff >= deadline:
+                    raise
+                if self._session.metrics is not None:
+                    self._session.metrics.increment(
+                        "retries_total", endpoint=endpoint, layer="model"
+                    )
+                time.sleep(backoff)
+                attempt += 1
+
+    def _send(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        deadline: Optional[float] = None,
+    ):
+        batcher = self._batcher
+        if batcher is None or len(prompts) >= batcher.max_batch:
+            return self._request_generation(
+                prompts, generation_config, remaining_time(deadline)
+            )
+
+        futures = [batcher.submit(prompt, generation_config) for prompt in prompts]
+        return GenerationBatch.concat([_result(future, deadline) for future in futures])
+
+    def _request_generation(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        timeout: Optional[float] = None,
+    ):
+        """Sends one batch, duplicating the request if it is slow and hedging is enabled"""
+        hedging = self._hedging
+        if hedging is None:
+            return self._attempt_generation(prompts, generation_config, timeout)
+        # Copies of the request share the set of instances they were sent to
+        attempt = partial(
+            self._attempt_generation, prompts, generation_config, exclude=set()
+        )
+        return hedging.run(attempt, timeout)
+
+    def _send_scores(
+        self,
+        contexts: List[str],
+        continuations: List[Tuple[int, str]],
+        deadline: Optional[float] = None,
+    ) -> List[float]:
+        return self._request_scores(contexts, continuations, remaining_time(deadline))
+
+    def _request_scores(
+        self,
+        contexts: List[str],
+        continuations: List[Tuple[int, str]],
+        timeout: Optional[float] = None,
+    ) -> List[float]:
+        """Scores one batch of continuations"""
+        try:
+            response = self._session.score(
+                self.id, contexts, continuations, timeout=timeout
+            )
+        except GatewayError:
+            if self._registry is not None:
+                self._registry.invalidate(self.id)
+            raise
+        scores = response["scores"]
+        if len(scores) != len(continuations):
+            raise ValueError(
+                f"Expected {len(continuations)} scores, the gateway returned {len(scores)}"
+            )
+        return scores
+
+    def _send_activations(
+        self,
+        prompts: List[str],
+        module_names: List[str],
+        path: Path,
+        deadline: Optional[float] = None,
+    ):
+        return self._request_activations(
+            prompts, module_names, path, remaining_time(deadline)
         )
-        Generation = namedtuple("Generation", generation_response.keys())
 
-        return Generation(**generation_response)
+    def _request_activations(
+        self,
+        prompts: List[str],
+        module_names: List[str],
+        path: Path,
+        timeout: Optional[float] = None,
+    ):
+        """Streams the activations of one batch into `path`"""
+        try:
+            return self._session.get_activations(
+                self.id, prompts, module_names, path, timeout=timeout
+            )
+        except GatewayError:
+            if self._registry is not None:
+                self._registry.invalidate(self.id)
+            raise
+
+    def _attempt_generation(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        timeout: Optional[float] = None,
+        exclude: Optional[set] = None,
+    ):
+        """Sends one batch to the gateway
+
+        :param exclude: Instances other copies of this request were sent to, which pools
+        avoid when another instance is available
+        """
+        try:
+            response = self._session.generate(
+                self.id, prompts, generation_config, timeout=timeout
+            )
+        except GatewayError:
+            # The instance may have been stopped or failed, do not trust its cached state
+            if self._registry is not None:
+                self._registry.invalidate(self.id)
+            raise
+        return GenerationBatch.from_response(response)
@@ -0,0 +1,240 @@
+"""Client side instrumentation: counters, latency histograms and tracing spans
+
+Instrumentation is off unless a session is created with ``metrics=True``, in which case
+every gateway call records its latency, status, payload sizes and transport retries. Spans
+are additionally emitted through OpenTelemetry when ``opentelemetry-api`` is installed and
+tracing is requested.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+from typing import Dict, Optional, Sequence, Tuple
+
+from .utils import reset_after_fork
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+# Upper bounds of the buckets of prompts per request
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+# Upper bounds of the payload size buckets, in bytes
+BYTES_BUCKETS = tuple(2**i for i in range(8, 28, 2))
+
+_PREFIX = "kscope_"
+
+
+class Histogram:
+    """A thread safe histogram with fixed buckets, in the style of Prometheus"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Estimates a percentile, between 0 and 100, from the bucket counts
+
+        The estimate is the upper bound of the bucket holding the percentile.
+        """
+        with self._lock:
+            counts, total = list(self._counts), self._count
+        if not total:
+            return None
+        rank = q / 100 * total
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts, total, value_sum = list(self._counts), self._count, self._sum
+        return {
+            "count": total,
+            "sum": value_sum,
+            "mean": value_sum / total if total else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(self.buckets + (float("inf"),), counts)),
+        }
+
+
+class Metrics:
+    """Counters and histograms shared by the sessions of a client
+
+    Metric names are plain strings and labels keyword arguments, e.g.
+    `metrics.increment("requests_total", endpoint="generate", status=200)`.
+    """
+
+    def __init__(self, tracing: bool = False):
+        """Creates an empty set of metrics
+
+        :param tracing: (bool) Also emit an OpenTelemetry span for each gateway call, if
+        ``opentelemetry-api`` is installed
+        """
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._tracer = _get_tracer() if tracing else None
+        reset_after_fork(self)
+
+    def __getstate__(self):
+        # Copies, e.g. in worker processes, record their own metrics from scratch
+        return {"tracing": self._tracer is not None}
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        for histogram in self._histograms.values():
+            histogram._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        **labels,
+    ):
+        key = (name, _label_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+        histogram.observe(value)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        return self._histograms.get((name, _label_key(labels)))
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get((name, _label_key(labels)), 0)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Traces a block as an OpenTelemetry span, does nothing if tracing is off"""
+        if self._tracer is None:
+            yield None
+            return
+        with self._tracer.start_as_current_span(name, attributes=attributes) as span:
+            yield span
+
+    def snapshot(self) -> Dict:
+        """Returns the current value of every metric
+
+        :return: A dict with "counters" and "histograms", each mapping a metric name to a
+        dict keyed by label string, e.g. `{"requests_total": {"endpoint=generate,status=200": 3}}`
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        snapshot = {"counters": {}, "histograms": {}}
+        for (name, labels), value in sorted(counters.items()):
+            snapshot["counters"].setdefault(name, {})[_label_str(labels)] = value
+        for (name, labels), histogram in sorted(histograms.items()):
+            snapshot["histograms"].setdefault(name, {})[
+                _label_str(labels)
+            ] = histogram.snapshot()
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self) -> str:
+        """Formats every metric in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {_PREFIX}{name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{_PREFIX}{name}{_prometheus_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {_PREFIX}{name} histogram")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                data = histogram.snapshot()
+                cumulative = 0
+                for bound, count in data["buckets"].items():
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _prometheus_labels(labels + (("le", le),))
+                    lines.append(f"{_PREFIX}{name}_bucket{bucket_labels} {cumulative}")
+                suffix = _prometheus_labels(labels)
+                lines.append(f"{_PREFIX}{name}_sum{suffix} {data['sum']}")
+                lines.append(f"{_PREFIX}{name}_count{suffix} {data['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def endpoint_of(path: str) -> str:
+    """Names the gateway endpoint of a URL path, e.g. "models/instances/{id}/generate" """
+    parts = path.split("://", 1)[-1].split("/", 1)[-1].strip("/").split("/")
+    if parts[:2] == ["models", "instances"] and len(parts) > 2:
+        parts[2] = "{id}"
+    return "/".join(parts)
+
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _label_str(labels: Tuple) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _prometheus_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _get_tracer():
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_tracer("kscope")
@@ -0,0 +1,308 @@
+"""Load balancing generation across several instances of the same model"""
+
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from .cache import GenerationCache
+from .kaleidoscope_sdk import GatewaySession, Model
+from .readiness import ACTIVE
+from .utils import remaining_time, GatewayError
+
+LEAST_OUTSTANDING = "least_outstanding"
+LATENCY = "latency"
+STRATEGIES = (LEAST_OUTSTANDING, LATENCY)
+
+# Seconds an instance answering 429 without a Retry-After header receives no traffic
+OVERLOAD_BACKOFF = 1.0
+# Weight of the latest sample in the moving average of a replica's latency
+_LATENCY_SMOOTHING = 0.2
+# Transport failures of an instance, after which a call may succeed on another one
+_REPLICA_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def _replica_failed(err: GatewayError) -> bool:
+    """Whether a gateway error comes from the instance rather than from the request
+
+    Server errors and a missing instance are specific to the instance, while other client
+    errors such as 400, 401 or 422 would fail on every instance.
+    """
+    return err.status_code is None or err.status_code >= 500 or err.status_code == 404
+
+
+class _Replica:
+    __slots__ = ("key", "model", "outstanding", "latency", "ejected_until")
+
+    def __init__(self, key, model: Model):
+        self.key = key
+        self.model = model
+        self.outstanding = 0
+        self.latency = None
+        self.ejected_until = 0.0
+
+
+class ModelPool(Model):
+    """A model handle that spreads generation over every ACTIVE instance of a model
+
+    Instances are discovered on one or more gateways. Each batch is routed to the instance
+    with the fewest requests in flight, or the lowest expected latency. An instance that
+    cannot be reached, times out or answers with a server error is ejected for `eject_time`
+    seconds while the batch is retried on another one. An overloaded instance answering 429
+    only receives no traffic for the time it asks for, and client errors such as 400 are
+    raised right away.
+    The instance list is refreshed every `refresh_interval` seconds, which picks up new
+    replicas and drops stopped ones.
+
+    All the generation methods of :class:`Model` are available.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        sessions: List[GatewaySession],
+        strategy: str = LEAST_OUTSTANDING,
+        eject_time: float = 30.0,
+        refresh_interval: float = 30.0,
+        cache: Optional[GenerationCache] = None,
+    ):
+        """Discovers the active instances of a model
+
+        :param model_name: (str) The name of the model
+        :param sessions: (List[GatewaySession]) Sessions of the gateways to search for instances
+        :param strategy: (str) "least_outstanding" or "latency"
+        :param eject_time: (float) Time in seconds an erroring instance receives no traffic
+        :param refresh_interval: (float) Time in seconds between instance discoveries
+        :param cache: (GenerationCache) Optional cache of generation results
+        :raises ValueError: If no instance of the model is active
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy}, use one of {STRATEGIES}")
+        super().__init__(None, model_name, sessions[0], cache=cache)
+        self._sessions = sessions
+        self.strategy = strategy
+        self.eject_time = eject_time
+        self.refresh_interval = refresh_interval
+
+        self._replicas: Dict[tuple, _Replica] = {}
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refreshed_at = 0.0
+
+        self.refresh()
+        if not self._replicas:
+            raise ValueError(f"No active instances of model {model_name}")
+
+    def _init_args(self) -> Dict:
+        # Copies discover the instances again rather than trusting a stale list
+        return {
+            "model_name": self.name,
+            "sessions": self._sessions,
+            "strategy": self.strategy,
+            "eject_time": self.eject_time,
+            "refresh_interval": self.refresh_interval,
+            "cache": self.cache,
+        }
+
+    def _after_fork(self):
+        super()._after_fork()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        for replica in self._replicas.values():
+            replica.outstanding = 0
+
+    @property
+    def state(self):
+        """Returns ACTIVE if at least one instance can receive traffic"""
+        with self._lock:
+            return ACTIVE if self._replicas else "UNAVAILABLE"
+
+    @property
+    def replicas(self) -> List[Model]:
+        """The instances currently in the pool, including ejected ones"""
+        with self._lock:
+            return [replica.model for replica in self._replicas.values()]
+
+    def refresh(self):
+        """Discovers the active instances of the model on every gateway"""
+        found = set()
+        for index, session in enumerate(self._sessions):
+            try:
+                instances = session.get_model_instances()
+            except (GatewayError, requests.RequestException):
+                # Keep the known replicas of a gateway that cannot be reached right now
+                with self._lock:
+                    found.update(key for key in self._replicas if key[0] == index)
+                continue
+            for instance in instances:
+                if (
+                    instance.get("name") == self.name
+                    and instance.get("state") == ACTIVE
+                ):
+                    found.add((index, instance["id"]))
+
+        with self._lock:
+            replicas = {}
+            for key in found:
+                replica = self._replicas.get(key)
+                if replica is None:
+                    session = self._sessions[key[0]]
+                    replica = _Replica(key, Model(key[1], self.name, session))
+                replicas[key] = replica
+            self._replicas = replicas
+            self._refreshed_at = time.monotonic()
+
+    def _attempt_generation(
+        self,
+        prompts: List[str],
+        generation_config: Dict,
+        timeout: Optional[float] = None,
+        exclude: Optional[set] = None,
+    ):
+        return self._on_replica(
+            lambda model, timeout: model._attempt_generation(
+                prompts, generation_config, timeout
+            ),
+            timeout,
+            exclude,
+        )
+
+    def _request_scores(
+        self,
+        contexts: List[str],
+        continuations: List[Tuple[int, str]],
+        timeout: Optional[float] = None,
+    ):
+        return self._on_replica(
+            lambda model, timeout: model._request_scores(
+                contexts, continuations, timeout
+            ),
+            timeout,
+        )
+
+    def _request_activations(
+        self,
+        prompts: List[str],
+        module_names: List[str],
+        path: Path,
+        timeout: Optional[float] = None,
+    ):
+        return self._on_replica(
+            lambda model, timeout: model._request_activations(
+                prompts, module_names, path, timeout
+            ),
+            timeout,
+        )
+
+    def _on_replica(
+        self,
+        call: Callable,
+        timeout: Optional[float] = None,
+        exclude: Optional[set] = None,
+    ):
+        """Calls `call(model, timeout)` on the best replica, failing over to the others
+
+        :param exclude: Replicas other copies of the request were sent to, avoided when
+        another replica is available and extended with the replicas used by this call
+        """
+        self._maybe_refresh()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        tried = set() if exclude is None else exclude
+        while True:
+            replica = self._acquire(tried)
+            tried.add(replica.key)
+            start = time.monotonic()
+            try:
+                result = call(replica.model, remaining_time(deadline))
+            except GatewayError as err:
+                if err.status_code == 429:
+                    # Busy rather than broken, back off for the time it asks for
+                    self._release(
+                        replica, eject_time=err.retry_after or OVERLOAD_BACKOFF
+                    )
+                elif _replica_failed(err):
+                    self._release(replica, eject_time=self.eject_time)
+                else:
+                    self._release(replica)
+                    raise
+                if self._exhausted(tried):
+                    raise
+                continue
+            except _REPLICA_ERRORS:
+                self._release(replica, eject_time=self.eject_time)
+                if self._exhausted(tried):
+                    raise
+                continue
+            except BaseException:
+                self._release(replica)
+                raise
+            self._release(replica, latency=time.monotonic() - start)
+            return result
+
+    def _exhausted(self, tried) -> bool:
+        with self._lock:
+            return tried.issuperset(self._replicas)
+
+    def _acquire(self, tried) -> _Replica:
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                replica
+                for key, replica in self._replicas.items()
+                if key not in tried and replica.ejected_until <= now
+            ]
+            if not candidates:
+                # Every healthy instance failed, give the ejected ones another chance
+                candidates = [
+                    replica
+                    for key, replica in self._replicas.items()
+                    if key not in tried
+                ]
+            if not candidates:
+                # A hedged copy shares the instance of the original if there is no other
+                candidates = list(self._replicas.values())
+            if not candidates:
+                raise ValueError(f"No active instances of model {self.name}")
+            replica = min(candidates, key=self._cost)
+            replica.outstanding += 1
+            return replica
+
+    def _cost(self, replica: _Replica):
+        latency = replica.latency or 0.0
+        if self.strategy == LATENCY:
+            return (latency * (replica.outstanding + 1), replica.outstanding)
+        return (replica.outstanding, latency)
+
+    def _release(self, replica: _Replica, latency=None, eject_time=None):
+        with self._lock:
+            replica.outstanding -= 1
+            if eject_time is not None:
+                replica.ejected_until = max(
+                    replica.ejected_until, time.monotonic() + eject_time
+                )
+            elif latency is not None:
+                if replica.latency is None:
+                    replica.latency = latency
+                else:
+                    replica.latency += _LATENCY_SMOOTHING * (latency - replica.latency)
+
+    def _maybe_refresh(self):
+        with self._lock:
+            due = time.monotonic() - self._refreshed_at >= self.refresh_interval
+            if not due or self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
@@ -0,0 +1,177 @@
+"""Waiting for model instances to become active"""
+
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import logging
+import threading
+from typing import Optional
+
+from .utils import is_transient, reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = "ACTIVE"
+FAILED = "FAILED"
+
+# Delays between polls of the instance states, in seconds
+MIN_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 10.0
+POLL_BACKOFF = 1.5
+
+
+class ModelLoadError(Exception):
+    pass
+
+
+class ReadinessWaiter:
+    """Tracks the state of model instances with a single poller shared by every waiting model
+
+    Each poll fetches the state of all instances in one request. The poll interval starts at
+    `min_interval` and grows by `backoff` up to `max_interval`, resetting whenever a new
+    instance is watched.
+    """
+
+    def __init__(
+        self,
+        session,
+        min_interval: float = MIN_POLL_INTERVAL,
+        max_interval: float = MAX_POLL_INTERVAL,
+        backoff: float = POLL_BACKOFF,
+    ):
+        """Creates a waiter, the poller thread is started on the first watch
+
+        :param session: (GatewaySession) The session used to query instance states
+        :param min_interval: (float) Initial delay between polls, in seconds
+        :param max_interval: (float) Maximum delay between polls, in seconds
+        :param backoff: (float) Factor applied to the delay after each poll
+        """
+        self._session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self._watches = {}
+        self._condition = threading.Condition()
+        self._interval = min_interval
+        self._reset = False
+        self._thread = None
+        reset_after_fork(self)
+
+    def _after_fork(self):
+        # The poller thread and the callers waiting on it belong to the parent process
+        self._watches = {}
+        self._condition = threading.Condition()
+        self._interval = self.min_interval
+        self._thread = None
+
+    def watch(self, model_instance_id: str) -> Future:
+        """Returns a future resolved with the state once the instance is ACTIVE
+
+        The future fails with :class:`ModelLoadError` if the instance reaches FAILED, or with
+        the error of the gateway if the instance cannot be polled, e.g. once it is deleted.
+        Cancelling it stops the instance from being polled on its behalf.
+        """
+        future = Future()
+        with self._condition:
+            self._watches.setdefault(model_instance_id, []).append(future)
+            self._interval = self.min_interval
+            self._reset = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def wait(self, model_instance_id: str, timeout: Optional[float] = None) -> str:
+        """Blocks until the instance is ACTIVE
+
+        :param model_instance_id: (str) The id of the model instance
+        :param timeout: (float) Maximum time to wait in seconds, waits forever if None
+        :raises ModelLoadError: If the instance failed to load
+        :raises GatewayError: If the gateway refuses to return the state of the instance
+        :raises TimeoutError: If the instance is not active before the deadline
+        """
+        future = self.watch(model_instance_id)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(
+                f"Model instance {model_instance_id} not active after {timeout} seconds"
+            ) from None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                for model_instance_id, futures in list(self._watches.items()):
+                    futures[:] = [
+                        future for future in futures if not future.cancelled()
+                    ]
+                    if not futures:
+                        del self._watches[model_instance_id]
+                if not self._watches:
+                    self._thread = None
+                    return
+                watched = list(self._watches)
+
+            states, errors = self._poll(watched)
+
+            with self._condition:
+                for model_instance_id, err in errors.items():
+                    for future in self._watches.pop(model_instance_id, []):
+                        if future.set_running_or_notify_cancel():
+                            future.set_exception(err)
+                for model_instance_id, state in states.items():
+                    if state not in (ACTIVE, FAILED):
+                        continue
+                    for future in self._watches.pop(model_instance_id, []):
+                        if not future.set_running_or_notify_cancel():
+                            continue
+                        if state == ACTIVE:
+                            future.set_result(state)
+                        else:
+                            future.set_exception(
+                                ModelLoadError(
+                                    f"Model instance {model_instance_id} failed to load"
+                                )
+                            )
+                if self._watches:
+                    interval = self._interval
+                    self._interval = min(interval * self.backoff, self.max_interval)
+                    # A new watch resets the interval and wakes the poller up early
+                    self._reset = False
+                    self._condition.wait_for(lambda: self._reset, timeout=interval)
+
+    def _poll(self, watched):
+        """Returns the states of the watched instances, and the errors of those that fail
+
+        Transient errors are only logged, and the instance is polled again later.
+        """
+        states = {}
+        errors = {}
+        try:
+            states = {
+                instance["id"]: instance.get("state")
+                for instance in self._session.get_model_instances()
+            }
+        except Exception as err:
+            if not is_transient(err):
+                return states, dict.fromkeys(watched, err)
+            logger.warning("Failed to list model instance states: %s", err)
+        for model_instance_id in watched:
+            if states.get(model_instance_id) is not None:
+                continue
+            # Instances that are not listed are looked up individually, so that an error
+            # for one of them does not hold back the others
+            try:
+                instance = self._session.get_model_instance(model_instance_id)
+                states[model_instance_id] = instance["state"]
+            except Exception as err:
+                if not is_transient(err):
+                    errors[model_instance_id] = err
+                else:
+                    logger.warning(
+                        "Failed to poll the state of model instance %s: %s",
+                        model_instance_id,
+                        err,
+                    )
+        return states, errors
@@ -0,0 +1,150 @@
+"""A shared, time-to-live cache of the models and instances known to the gateway"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+from .batching import SingleFlight
+from .utils import reset_after_fork
+
+DEFAULT_TTL = 5.0
+
+_MODELS = "models"
+_INSTANCES = "instances"
+
+
+class ModelRegistry:
+    """Caches supported models, model instances and instance states for `ttl` seconds
+
+    Reads are thread safe and concurrent misses of the same entry share one request. Once an
+    entry expires, the stale value keeps being served while a single background refresh is
+    in flight, so readers never wait on the gateway after the first lookup. Listing the
+    instances also refreshes the state of each listed instance.
+    """
+
+    def __init__(
+        self, session, ttl: float = DEFAULT_TTL, refresh_in_background: bool = True
+    ):
+        """Creates an empty registry
+
+        :param session: (GatewaySession) The session used to reach the gateway
+        :param ttl: (float) Time in seconds an entry is considered fresh
+        :param refresh_in_background: (bool) Serve stale entries while they are refreshed,
+        rather than blocking on the gateway
+        """
+        self._session = session
+        self.ttl = ttl
+        self.refresh_in_background = refresh_in_background
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        self._refreshing = set()
+        self._executor = None
+        reset_after_fork(self)
+
+    def __getstate__(self):
+        return {
+            "session": self._session,
+            "ttl": self.ttl,
+            "refresh_in_background": self.refresh_in_background,
+        }
+
+    def __setstate__(self, state: Dict):
+        self.__init__(**state)
+
+    def _after_fork(self):
+        # Cached entries stay valid, the refreshes in flight belong to the parent
+        self._lock = threading.Lock()
+        self._in_flight = SingleFlight()
+        self._refreshing = set()
+        self._executor = None
+
+    def models(self) -> List[str]:
+        """Returns the list of supported models"""
+        return self._get(_MODELS, self._session.get_models)
+
+    def instances(self) -> List[Dict]:
+        """Returns the list of model instances"""
+        return self._get(_INSTANCES, self._fetch_instances)
+
+    def instance(self, model_instance_id: str) -> Dict:
+        """Returns the description of a model instance"""
+        return self._get(
+            (_INSTANCES, model_instance_id),
+            lambda: self._session.get_model_instance(model_instance_id),
+        )
+
+    def state(self, model_instance_id: str) -> str:
+        """Returns the state of a model instance"""
+        return self.instance(model_instance_id)["state"]
+
+    def invalidate(self, model_instance_id: Optional[str] = None):
+        """Drops cached entries so that the next read reaches the gateway
+
+        :param model_instance_id: (str) Only drop entries about this instance, along with the
+        instance list. Drops everything if None.
+        """
+        with self._lock:
+            if model_instance_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((_INSTANCES, model_instance_id), None)
+                self._entries.pop(_INSTANCES, None)
+
+    def _fetch_instances(self):
+        instances = self._session.get_model_instances()
+        now = time.monotonic()
+        with self._lock:
+            for instance in instances:
+                if instance.get("id") and "state" in instance:
+                    self._entries[(_INSTANCES, instance["id"])] = (instance, now)
+        return instances
+
+    def _get(self, key: Hashable, fetch: Callable):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            if time.monotonic() - fetched_at < self.ttl:
+                return value
+            if self.refresh_in_background:
+                self._refresh_in_background(key, fetch)
+                return value
+        return self._fetch(key, fetch)
+
+    def _fetch(self, key: Hashable, fetch: Callable):
+        owned, waiting = self._in_flight.claim([key])
+        if waiting:
+            return waiting[key].result()
+        try:
+            value = fetch()
+        except BaseException as err:
+            with self._lock:
+                self._entries.pop(key, None)
+            self._in_flight.fail(owned, err)
+            raise
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+        self._in_flight.resolve({key: value})
+        return value
+
+    def _refresh_in_background(self, key: Hashable, fetch: Callable):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2)
+        self._executor.submit(self._background_fetch, key, fetch)
+
+    def _background_fetch(self, key: Hashable, fetch: Callable):
+        try:
+            self._fetch(key, fetch)
+        except Exception:
+            # The failed entry has been dropped, the next read fetches it again and raises
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
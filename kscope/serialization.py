@@ -0,0 +1,228 @@
+"""A framed binary format for NumPy arrays, decoded without copying
+
+A frame is made of the magic bytes ``KSTF``, a format version byte, the length of a JSON
+header as a little endian uint32, the header itself, and the raw buffer of each array::
+
+    KSTF | version | header length | header | padding | array 0 | padding | array 1 ...
+
+The header lists the name, dtype, shape and offset of every array, along with arbitrary
+JSON metadata. Buffers start on 64 byte boundaries, so arrays decoded from a frame, or from
+a memory mapped file holding one, are aligned views of the frame rather than copies.
+
+Unlike :func:`kscope.utils.encode_obj`, frames hold plain data only, are not base64
+inflated, and are safe to decode from an untrusted source.
+"""
+
+import io
+import json
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+MAGIC = b"KSTF"
+VERSION = 1
+CONTENT_TYPE = "application/x-kscope-tensors"
+ALIGNMENT = 64
+
+_PREFIX = struct.Struct("<4sBI")
+_CHUNK_SIZE = 1 << 20
+
+
+def encode_tensors(
+    tensors: Dict[str, object], metadata: Optional[Dict] = None
+) -> bytes:
+    """Encodes named arrays into a single frame
+
+    :param tensors: (dict) Arrays by name, NumPy arrays or anything convertible to one
+    such as CPU torch tensors
+    :param metadata: (dict) Additional JSON serializable data stored in the header
+    """
+    buffer = io.BytesIO()
+    write_tensors(buffer, tensors, metadata)
+    return buffer.getvalue()
+
+
+def write_tensors(
+    stream: BinaryIO, tensors: Dict[str, object], metadata: Optional[Dict] = None
+) -> int:
+    """Writes named arrays as a frame to a binary stream, without copying their buffers
+
+    :return: (int) The number of bytes written
+    """
+    arrays = {name: _as_array(value) for name, value in tensors.items()}
+    header, data_offset = _make_header(arrays, metadata or {})
+    stream.write(_PREFIX.pack(MAGIC, VERSION, len(header)))
+    stream.write(header)
+    stream.write(b"\0" * (data_offset - _PREFIX.size - len(header)))
+    position = data_offset
+    for entry in json.loads(header)["tensors"]:
+        array = arrays[entry["name"]]
+        start = data_offset + entry["offset"]
+        stream.write(b"\0" * (start - position))
+        stream.write(memoryview(array.reshape(-1)).cast("B"))
+        position = start + array.nbytes
+    return position
+
+
+def decode_tensors(data) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Decodes a frame into arrays viewing its buffer
+
+    :param data: A bytes-like object holding a whole frame, such as bytes, a bytearray, a
+    memoryview or a memory mapped file. Arrays are read-only when `data` is.
+    :return: The arrays by name, and the metadata of the frame
+    :raises ValueError: If `data` is not a valid frame
+    """
+    view = memoryview(data).cast("B")
+    header, data_offset = _parse_header(view)
+    if len(view) < data_offset + header["nbytes"]:
+        raise ValueError(
+            f"Truncated frame of {len(view)} bytes, expected "
+            f"{data_offset + header['nbytes']}"
+        )
+    return _views(view, header, data_offset), header["metadata"]
+
+
+def read_tensors(
+    stream: BinaryIO,
+    path: Optional[Union[str, Path]] = None,
+    chunk_size: int = _CHUNK_SIZE,
+) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Reads a frame from a binary stream, such as an HTTP response body
+
+    Without `path`, the frame is read into a single buffer the arrays are views of. With a
+    `path`, the frame is copied to that file `chunk_size` bytes at a time and the arrays
+    are read-only memory maps of it, so frames larger than memory can be received.
+
+    :param stream: (BinaryIO) Stream positioned at the start of a frame
+    :param path: (str or Path) File the frame is written to
+    :param chunk_size: (int) Number of bytes copied at a time to `path`
+    :return: The arrays by name, and the metadata of the frame
+    :raises ValueError: If the stream does not hold a valid frame
+    """
+    prefix = _read_exactly(stream, _PREFIX.size)
+    _check_prefix(prefix)
+    header_bytes = _read_exactly(stream, _PREFIX.unpack(prefix)[2])
+    header = json.loads(header_bytes)
+    data_offset = _align(len(prefix) + len(header_bytes))
+    remaining = data_offset - len(prefix) - len(header_bytes) + header["nbytes"]
+
+    if path is None:
+        frame = bytearray(len(prefix) + len(header_bytes) + remaining)
+        frame[: len(prefix)] = prefix
+        frame[len(prefix) : len(prefix) + len(header_bytes)] = header_bytes
+        view = memoryview(frame)
+        position = len(prefix) + len(header_bytes)
+        while position < len(frame):
+            read = stream.readinto(view[position:])
+            if not read:
+                raise ValueError("Truncated frame, the stream ended early")
+            position += read
+        return _views(view, header, data_offset), header["metadata"]
+
+    with open(path, "wb") as output:
+        output.write(prefix)
+        output.write(header_bytes)
+        copied = _copy(stream, output, remaining, chunk_size)
+    if copied < remaining:
+        raise ValueError("Truncated frame, the stream ended early")
+    return load_tensors(path)
+
+
+def load_tensors(path: Union[str, Path]) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Memory maps a file holding a frame, see :func:`read_tensors`
+
+    :return: Read-only arrays backed by the file, and the metadata of the frame
+    """
+    if Path(path).stat().st_size == 0:
+        raise ValueError(f"{path} is empty")
+    return decode_tensors(np.memmap(path, dtype=np.uint8, mode="r"))
+
+
+def _as_array(value) -> np.ndarray:
+    if hasattr(value, "detach"):
+        # torch tensors, which may require grad or live on another device
+        value = value.detach().cpu().numpy()
+    array = np.ascontiguousarray(value)
+    if array.dtype.hasobject:
+        raise TypeError(f"Cannot serialize arrays of dtype {array.dtype}")
+    return array
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _make_header(arrays: Dict[str, np.ndarray], metadata: Dict) -> Tuple[bytes, int]:
+    entries = []
+    offset = 0
+    for name, array in arrays.items():
+        entries.append(
+            {
+                "name": name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+        )
+        offset = _align(offset + array.nbytes)
+    nbytes = (
+        entries[-1]["offset"] + arrays[entries[-1]["name"]].nbytes if entries else 0
+    )
+    header = json.dumps(
+        {"tensors": entries, "nbytes": nbytes, "metadata": metadata}
+    ).encode("utf-8")
+    return header, _align(_PREFIX.size + len(header))
+
+
+def _check_prefix(prefix: bytes):
+    if len(prefix) < _PREFIX.size:
+        raise ValueError("Truncated frame, missing its header")
+    magic, version, _ = _PREFIX.unpack(prefix[: _PREFIX.size])
+    if magic != MAGIC:
+        raise ValueError("Not a tensor frame, the magic bytes do not match")
+    if version != VERSION:
+        raise ValueError(f"Unsupported tensor frame version {version}")
+
+
+def _parse_header(view: memoryview) -> Tuple[Dict, int]:
+    _check_prefix(bytes(view[: _PREFIX.size]))
+    header_length = _PREFIX.unpack(view[: _PREFIX.size])[2]
+    header_end = _PREFIX.size + header_length
+    if len(view) < header_end:
+        raise ValueError("Truncated frame, missing its header")
+    header = json.loads(bytes(view[_PREFIX.size : header_end]))
+    return header, _align(header_end)
+
+
+def _views(view: memoryview, header: Dict, data_offset: int) -> Dict[str, np.ndarray]:
+    arrays = {}
+    for entry in header["tensors"]:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        arrays[entry["name"]] = np.frombuffer(
+            view, dtype=dtype, count=count, offset=data_offset + entry["offset"]
+        ).reshape(entry["shape"])
+    return arrays
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError("Truncated frame, the stream ended early")
+        data += chunk
+    return data
+
+
+def _copy(source: BinaryIO, target: BinaryIO, size: int, chunk_size: int) -> int:
+    copied = 0
+    while copied < size:
+        chunk = source.read(min(chunk_size, size - copied))
+        if not chunk:
+            break
+        target.write(chunk)
+        copied += len(chunk)
+    return copied
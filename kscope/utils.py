@@ -2,65 +2,299 @@
 TODOS:
     1. eventually we need to seperate this out to client and server utils
 """
-import cloudpickle
 import logging
 import json
+import os
 import requests
 import pickle
 import codecs
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+from urllib3.util.retry import Retry
+
+from . import serialization, wire
 
 logger = logging.getLogger(__name__)
 
+# (connect, read) timeouts in seconds applied to every gateway call
+DEFAULT_TIMEOUT = (10, 300)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+# Longest part of a non JSON error body kept in the error message
+MAX_ERROR_TEXT = 200
+# Responses signalling that the gateway is overloaded and the client should back off
+OVERLOAD_STATUS_CODES = (429, 503)
+
+
+def remaining_time(deadline):
+    """Returns the seconds left before a `time.monotonic` deadline, or None if there is none"""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def clamp_timeout(timeout, limit):
+    """Caps a requests timeout, a number or a (connect, read) tuple, to `limit` seconds"""
+    if limit is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        return tuple(min(value, limit) for value in timeout)
+    return limit if timeout is None else min(timeout, limit)
+
+
+def reset_after_fork(obj):
+    """Calls `obj._after_fork()` in the child process whenever the process forks
+
+    Locks, threads and connections inherited from the parent are unusable in a forked
+    child, `_after_fork` replaces them. Objects are tracked through weak references.
+    """
+    _FORK_AWARE.add(obj)
+    return obj
+
+
+def _after_fork_in_child():
+    for obj in list(_FORK_AWARE):
+        obj._after_fork()
+
+
+_FORK_AWARE = weakref.WeakSet()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
 
 def decode_str(obj_in_str):
+    """Decodes an object encoded with :func:`encode_obj`
+
+    Only decode trusted data, arrays are better sent with :mod:`kscope.serialization`.
+    """
     return pickle.loads(codecs.decode(obj_in_str.encode("utf-8"), "base64"))
 
 
 def encode_obj(obj):
+    import cloudpickle
+
     return codecs.encode(cloudpickle.dumps(obj), "base64").decode("utf-8")
 
 
+class GatewayError(ValueError):
+    """A request to the gateway service was not successful"""
+
+    def __init__(self, message, url=None, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.url = url
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def overloaded(self):
+        """Whether the gateway rejected the request because it is overloaded"""
+        return self.status_code in OVERLOAD_STATUS_CODES
+
+
+def is_transient(err):
+    """Whether a failed call may succeed when retried
+
+    Connection errors, timeouts, server errors and an overloaded gateway are transient,
+    while other errors such as a 400 or a malformed response fail again on every attempt.
+    """
+    if isinstance(err, GatewayError):
+        return err.overloaded or (
+            err.status_code is not None and err.status_code >= 500
+        )
+    return isinstance(
+        err,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    )
+
+
+def parse_retry_after(value):
+    """Returns the delay in seconds requested by a Retry-After header, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def error_message(text, reason=None):
+    """Returns the message of an error response
+
+    Proxies and overloaded servers answer with HTML or empty bodies, so the "msg" field of
+    a JSON body is used when there is one, then the start of the body, then the reason.
+    """
+    try:
+        payload = json.loads(text) if text else None
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and payload.get("msg"):
+        return str(payload["msg"])
+    text = (text or "").strip()
+    return text[:MAX_ERROR_TEXT] if text else reason
+
+
+def raise_for_status(url, status_code, msg=None, retry_after=None):
+    if status_code == 422:
+        raise GatewayError(
+            "Request to {} not sucessful, Error Code: {}, your JWT token is invalid or incorrect, \
+            please delete the previous token at ~/.kaleidoscope.jwt and generate a new one".format(
+                url, status_code
+            ),
+            url,
+            status_code,
+            retry_after,
+        )
+    elif status_code == 401:
+        raise GatewayError(
+            "Request to {} not sucessful, Error Code: {}, your JWT token is expired and could not \
+                be refreshed, please delete the previous token at ~/.kaleidoscope.jwt and generate \
+                a new one, or set KSCOPE_USERNAME and KSCOPE_PASSWORD to refresh it automatically".format(
+                url, status_code
+            ),
+            url,
+            status_code,
+            retry_after,
+        )
+    raise GatewayError(
+        "Request to {} not sucessful, Error Code: {}, {}".format(url, status_code, msg),
+        url,
+        status_code,
+        retry_after,
+    )
+
+
 def check_response(resp):
     if not resp.ok:
-        if resp.status_code == 422:
-            raise ValueError(
-                "Request to {} not sucessful, Error Code: {}, your JWT token is invalid or incorrect, \
-                please delete the previous token at ~/.kaleidoscope.jwt and generate a new one".format(
-                    resp.url, resp.status_code
-                )
-            )
-        elif resp.status_code == 401:
-            raise ValueError(
-                "Request to {} not sucessful, Error Code: {}, your JWT token is expired, please \
-                    delete the previous token at ~/.kaleidoscope.jwt and generate a new one".format(
-                    resp.url, resp.status_code
-                )
-            )
-        raise ValueError(
-            "Request to {} not sucessful, Error Code: {}, {}".format(
-                resp.url, resp.status_code, resp.json()["msg"]
-            )
-        )
+        msg = None
+        if resp.status_code not in (401, 422):
+            msg = error_message(resp.text, resp.reason)
+        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+        raise_for_status(resp.url, resp.status_code, msg, retry_after)
     logger.debug("addr %s response code %s", resp.url, resp.status_code)
 
 
-def get(addr, auth_key=None, headers={}):
+def create_http_session(
+    pool_size=DEFAULT_POOL_SIZE,
+    max_retries=DEFAULT_MAX_RETRIES,
+    backoff_factor=DEFAULT_BACKOFF_FACTOR,
+):
+    """Creates a requests session backed by a pool of persistent connections
+
+    Connection failures are retried for every method, but only idempotent
+    requests (GET, HEAD, ...) are retried on gateway errors so that a
+    generation is never submitted twice.
+
+    :param pool_size: (int) Maximum number of connections kept alive per host
+    :param max_retries: (int) Number of retries with exponential backoff
+    :param backoff_factor: (float) Backoff factor between retries, in seconds
+    """
+    retry = Retry(
+        # Without retries, errors such as read timeouts are raised as they are
+        total=max_retries or False,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
+def _build_headers(auth_key=None, headers=None):
+    headers = dict(headers) if headers else {}
     if auth_key:
         headers["Authorization"] = f"Bearer {auth_key}"
+    return headers
 
-    resp = requests.get(addr, headers=headers)
+
+def get(addr, auth_key=None, headers=None, session=None, timeout=DEFAULT_TIMEOUT):
+
+    headers = _build_headers(auth_key, headers)
+
+    resp = (session or requests).get(addr, headers=headers, timeout=timeout)
     check_response(resp)
 
     return resp.json()
 
 
-def post(addr, body, auth_key=None, headers={}):
+def post_tensors(
+    addr,
+    body,
+    path=None,
+    auth_key=None,
+    headers=None,
+    session=None,
+    timeout=DEFAULT_TIMEOUT,
+    compression=None,
+):
+    """Posts a JSON body and reads the tensor frame answered, see :mod:`kscope.serialization`
 
-    if auth_key:
-        headers["Authorization"] = f"Bearer {auth_key}"
+    The response is streamed into `path` if given, so it never has to fit in memory.
+
+    :return: The arrays by name, and the metadata of the frame
+    """
+
+    headers = _build_headers(auth_key, headers)
+    data, content_headers = wire.encode_request(body, compression)
+    headers.update(content_headers)
+    headers["Accept"] = serialization.CONTENT_TYPE
 
-    resp = requests.post(addr, json=body, headers=headers)
+    with (session or requests).post(
+        addr, data=data, headers=headers, timeout=timeout, stream=True
+    ) as resp:
+        check_response(resp)
+        content_type = resp.headers.get("Content-Type", "")
+        if not content_type.startswith(serialization.CONTENT_TYPE):
+            raise GatewayError(
+                f"Expected tensors from {addr}, got {content_type or 'no content type'}",
+                addr,
+                resp.status_code,
+            )
+        resp.raw.decode_content = True
+        try:
+            return serialization.read_tensors(resp.raw, path)
+        except ReadTimeoutError as err:
+            raise requests.Timeout(err) from err
+        except ProtocolError as err:
+            raise requests.ConnectionError(err) from err
+
+
+def post(
+    addr,
+    body,
+    auth_key=None,
+    headers=None,
+    session=None,
+    timeout=DEFAULT_TIMEOUT,
+    wire_format=wire.JSON,
+    compression=None,
+):
+
+    headers = _build_headers(auth_key, headers)
+    data, content_headers = wire.encode_request(body, compression)
+    headers.update(content_headers)
+    headers.update(wire.accept_headers(wire_format))
+
+    resp = (session or requests).post(addr, data=data, headers=headers, timeout=timeout)
     check_response(resp)
 
-    return resp.json()
+    return wire.decode_response(resp)
@@ -0,0 +1,165 @@
+"""Encodings of request and response bodies exchanged with the gateway service
+
+Plain JSON is always supported. Request bodies can additionally be compressed with gzip or
+zstd, and responses can be negotiated as msgpack, in which case logprobs travel as raw
+float32 buffers that are decoded without copying. Response compression is negotiated by the
+HTTP transport, which advertises every encoding it can decode (gzip, and zstd where
+supported by urllib3). msgpack and zstd require the optional
+``msgpack`` and ``zstandard`` dependencies, install them with ``pip install kscope[binary]``.
+"""
+
+import gzip
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from . import serialization
+
+JSON = "json"
+MSGPACK = "msgpack"
+WIRE_FORMATS = (JSON, MSGPACK)
+COMPRESSIONS = ("gzip", "zstd")
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+
+# Marks a msgpack map holding a raw array buffer
+_NDARRAY = "__ndarray__"
+
+
+def check_wire_options(wire_format: str = JSON, compression: Optional[str] = None):
+    """Validates wire options up front, so missing optional dependencies surface early"""
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(
+            f"Unsupported wire format {wire_format}, use one of {WIRE_FORMATS}"
+        )
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unsupported compression {compression}, use one of {COMPRESSIONS}"
+        )
+    if wire_format == MSGPACK:
+        _import_msgpack()
+    if compression == "zstd":
+        _import_zstandard()
+
+
+def accept_headers(wire_format: str = JSON) -> Dict[str, str]:
+    """Headers asking for the preferred response format, with JSON as fallback"""
+    if wire_format == MSGPACK:
+        accept = f"{MSGPACK_CONTENT_TYPE}, {JSON_CONTENT_TYPE};q=0.9"
+    else:
+        accept = JSON_CONTENT_TYPE
+    return {"Accept": accept}
+
+
+def encode_request(body, compression: Optional[str] = None) -> Tuple[bytes, Dict]:
+    """Serializes a request body as JSON, optionally compressed
+
+    :return: The encoded body and the content headers describing it
+    """
+    data = json.dumps(body).encode("utf-8")
+    headers = {"Content-Type": JSON_CONTENT_TYPE}
+    if compression is not None:
+        data = compress(data, compression)
+        headers["Content-Encoding"] = compression
+    return data, headers
+
+
+def decode_response(resp):
+    """Parses a response body according to the format the gateway answered with
+
+    Tensor frames, see :mod:`kscope.serialization`, are decoded into their metadata with
+    the arrays under "tensors".
+    """
+    content_type = resp.headers.get("Content-Type", "")
+    if content_type.startswith(MSGPACK_CONTENT_TYPE):
+        return unpack(resp.content)
+    if content_type.startswith(serialization.CONTENT_TYPE):
+        tensors, metadata = serialization.decode_tensors(resp.content)
+        return dict(metadata, tensors=tensors)
+    return resp.json()
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=5)
+    if compression == "zstd":
+        return _import_zstandard().ZstdCompressor().compress(data)
+    raise ValueError(f"Unsupported compression {compression}")
+
+
+def decompress(data: bytes, compression: Optional[str]) -> bytes:
+    if not compression or compression == "identity":
+        return data
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _import_zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported compression {compression}")
+
+
+def pack_generation_response(response: Dict) -> bytes:
+    """Encodes a generate response as msgpack, the reference encoder for the gateway
+
+    The per-prompt logprobs lists are replaced by a single float32 buffer of every logprob
+    together with int64 offsets delimiting each prompt, the layout of :class:`GenerationBatch`.
+    """
+    generation = dict(response["generation"])
+    if "logprobs" in generation:
+        per_prompt = [values or [] for values in generation["logprobs"]]
+        offsets = np.zeros(len(per_prompt) + 1, dtype=np.int64)
+        np.cumsum([len(values) for values in per_prompt], out=offsets[1:])
+        values = np.fromiter(
+            (logprob for values in per_prompt for logprob in values),
+            dtype=np.float32,
+            count=int(offsets[-1]),
+        )
+        generation["logprobs"] = {
+            "values": _pack_array(values),
+            "offsets": _pack_array(offsets),
+        }
+    return _import_msgpack().packb(dict(response, generation=generation))
+
+
+def unpack(data: bytes):
+    """Decodes a msgpack body, turning raw buffers into read-only arrays without copying"""
+    return _import_msgpack().unpackb(data, object_hook=_unpack_array)
+
+
+def _pack_array(array: np.ndarray) -> Dict:
+    array = np.ascontiguousarray(array)
+    return {
+        _NDARRAY: True,
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "data": array.tobytes(),
+    }
+
+
+def _unpack_array(obj):
+    if obj.get(_NDARRAY):
+        return np.frombuffer(obj["data"], dtype=np.dtype(obj["dtype"])).reshape(
+            obj["shape"]
+        )
+    return obj
+
+
+def _import_msgpack():
+    try:
+        import msgpack
+    except ImportError as err:
+        raise ImportError(
+            "The msgpack wire format requires msgpack, install it with `pip install kscope[binary]`"
+        ) from err
+    return msgpack
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as err:
+        raise ImportError(
+            "zstd compression requires zstandard, install it with `pip install kscope[binary]`"
+        ) from err
+    return zstandard
@@ -47,6 +47,13 @@ setup(
         "typing_extensions==4.12.2",
         "urllib3==2.2.2"
     ],
+    entry_points={"console_scripts": ["kscope=kscope.cli:main"]},
+    extras_require={
+        "arrow": ["pyarrow>=10"],
+        "async": ["aiohttp>=3.8"],
+        "binary": ["msgpack>=1.0", "zstandard>=0.21"],
+        "tracing": ["opentelemetry-api>=1.0"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Science/Research",
@@ -0,0 +1,140 @@
+"""Measures the client side overhead of Model.generate against the in-process mock gateway
+
+Run from the repository root with::
+
+    python -m test.benchmarks.bench_generate
+    python -m test.benchmarks.bench_generate --batch-sizes 1,8 --concurrency 1,16 --tokens 32
+
+Every combination of batch size, concurrency and response size is timed, and throughput
+along with p50/p99 call latency and the number of connections opened is reported. With
+`--latency 0` (the default) the numbers are dominated by the SDK itself, so differences in
+request encoding, response parsing or connection handling show up directly when comparing
+runs. Absolute numbers depend on the machine, so the unit tests only assert relative
+ones: the speedup of concurrent calls and the reuse of pooled connections.
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from kscope import Client
+
+from ..mock_gateway import MockGateway
+
+MODEL_NAME = "llama3-8b"
+
+
+def run_benchmark(
+    batch_size: int,
+    concurrency: int,
+    tokens: int,
+    requests: int = 200,
+    latency: float = 0.0,
+    wire_format: str = "json",
+    warmup: int = 10,
+    pool_size: Optional[int] = None,
+) -> Dict:
+    """Times `requests` generate calls of `batch_size` prompts from `concurrency` threads
+
+    :param pool_size: (int) Connections kept alive by the client, one per thread by
+    default. With fewer, the extra connections are opened and closed for every call.
+    :return: A dict with the parameters, throughput in prompts per second, p50/p99 call
+    latency in milliseconds and the number of connections the gateway accepted
+    """
+    if pool_size is None:
+        pool_size = max(concurrency, 1)
+    with MockGateway(latency=latency, tokens_per_prompt=tokens) as gateway:
+        client = Client(
+            gateway.host,
+            gateway.port,
+            auth_key="benchmark",
+            pool_size=pool_size,
+            wire_format=wire_format,
+        )
+        model = client.load_model(MODEL_NAME)
+        batches = [
+            [f"prompt {i} {j}" for j in range(batch_size)] for i in range(requests)
+        ]
+
+        def timed_generate(prompts: List[str]) -> float:
+            start = time.perf_counter()
+            model.generate(prompts)
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(timed_generate, batches[:warmup]))
+            start = time.perf_counter()
+            latencies = list(executor.map(timed_generate, batches))
+            elapsed = time.perf_counter() - start
+        client._session.close()
+        connections = gateway.connections
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "tokens": tokens,
+        "wire_format": wire_format,
+        "pool_size": pool_size,
+        "requests": requests,
+        "prompts_per_second": requests * batch_size / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "connections": connections,
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 8])
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16])
+    parser.add_argument(
+        "--tokens", type=_int_list, default=[16, 256], help="Tokens per prompt"
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Gateway latency in seconds"
+    )
+    parser.add_argument("--wire-format", choices=["json", "msgpack"], default="json")
+    parser.add_argument(
+        "--json", action="store_true", help="Print one JSON result per line"
+    )
+    args = parser.parse_args(argv)
+
+    if not args.json:
+        print(
+            f"{'batch':>6} {'conc':>5} {'tokens':>7} {'prompts/s':>10} "
+            f"{'p50 ms':>8} {'p99 ms':>8}"
+        )
+    for batch_size, concurrency, tokens in itertools.product(
+        args.batch_sizes, args.concurrency, args.tokens
+    ):
+        result = run_benchmark(
+            batch_size,
+            concurrency,
+            tokens,
+            requests=args.requests,
+            latency=args.latency,
+            wire_format=args.wire_format,
+        )
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{batch_size:>6} {concurrency:>5} {tokens:>7} "
+                f"{result['prompts_per_second']:>10.0f} "
+                f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compares generate_many with and without length-aware packing on mixed-length prompts
+
+Run from the repository root with::
+
+    python -m test.benchmarks.bench_packing
+
+The mock gateway charges every request for its prompts padded to the longest one, like a
+GPU server would, so batches mixing short and long prompts are slower than batches of
+prompts of similar length.
+"""
+
+import argparse
+import random
+import time
+from typing import Dict, List
+
+from kscope import Client
+
+from ..mock_gateway import MockGateway
+
+MODEL_NAME = "llama3-8b"
+
+
+def mixed_length_prompts(num_prompts: int, seed: int = 0) -> List[str]:
+    """Prompts mostly of a few words, with one in eight a few hundred words long"""
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(num_prompts):
+        length = rng.randint(200, 400) if rng.random() < 0.125 else rng.randint(5, 20)
+        prompts.append(" ".join(f"w{i}_{j}" for j in range(length)))
+    return prompts
+
+
+def run_benchmark(
+    num_prompts: int = 256,
+    concurrency: int = 4,
+    latency_per_token: float = 2e-5,
+    pack_by_length: bool = False,
+) -> Dict:
+    """Times generate_many over mixed-length prompts
+
+    :return: A dict with the elapsed time in seconds, throughput in prompts per second and
+    the number of padded tokens the gateway processed
+    """
+    prompts = mixed_length_prompts(num_prompts)
+    with MockGateway(latency_per_token=latency_per_token) as gateway:
+        client = Client(
+            gateway.host, gateway.port, auth_key="benchmark", pool_size=concurrency
+        )
+        model = client.load_model(MODEL_NAME)
+        start = time.perf_counter()
+        model.generate_many(
+            prompts, concurrency=concurrency, pack_by_length=pack_by_length
+        )
+        elapsed = time.perf_counter() - start
+        padded_tokens = sum(
+            len(batch) * max(len(prompt.split()) for prompt in batch)
+            for batch in gateway.generate_calls
+        )
+    return {
+        "pack_by_length": pack_by_length,
+        "elapsed": elapsed,
+        "prompts_per_second": num_prompts / elapsed,
+        "padded_tokens": padded_tokens,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompts", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--latency-per-token",
+        type=float,
+        default=2e-5,
+        help="Gateway compute time per padded token, in seconds",
+    )
+    args = parser.parse_args(argv)
+
+    print(f"{'packing':>8} {'seconds':>8} {'prompts/s':>10} {'padded tokens':>14}")
+    for pack_by_length in (False, True):
+        result = run_benchmark(
+            args.prompts, args.concurrency, args.latency_per_token, pack_by_length
+        )
+        print(
+            f"{'on' if pack_by_length else 'off':>8} {result['elapsed']:>8.2f} "
+            f"{result['prompts_per_second']:>10.0f} {result['padded_tokens']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import pytest
+
+from kscope import Client
+
+from .mock_gateway import MockGateway
+
+
+@pytest.fixture
+def gateway():
+    """A mock gateway service running on a random local port"""
+    with MockGateway() as mock_gateway:
+        yield mock_gateway
+
+
+@pytest.fixture
+def client(gateway):
+    """A client connected to the mock gateway"""
+    return Client(gateway.host, gateway.port, auth_key="test_auth_key")
+
+
+@pytest.fixture
+def model(client):
+    """An active model instance on the mock gateway"""
+    return client.load_model("llama3-8b")
@@ -0,0 +1,470 @@
+"""An in-process mock of the Kaleidoscope gateway service used by the tests"""
+
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from kscope import serialization, wire
+from kscope.auth import token_expiry
+
+MOCK_USERNAME = "user"
+MOCK_PASSWORD = "password"
+MOCK_TOKEN = "mock-token"
+# Longest time in seconds a held request waits to be released
+HOLD_TIMEOUT = 10.0
+
+
+def mock_jwt(expires_at, issued_at=None, subject=MOCK_USERNAME):
+    """An unsigned JWT with the given expiry, in seconds since the epoch"""
+
+    def encode(part):
+        data = json.dumps(part).encode("utf-8")
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+    claims = {"sub": subject, "exp": expires_at, "jti": uuid.uuid4().hex}
+    if issued_at is not None:
+        claims["iat"] = issued_at
+    return f"{encode({'alg': 'none', 'typ': 'JWT'})}.{encode(claims)}."
+
+
+def mock_generation(prompt, generation_config):
+    """Deterministic generation for a prompt, so tests can check result ordering"""
+    tokens = prompt.split()[: generation_config.get("max_tokens", 32)]
+    return {
+        "sequence": prompt.upper(),
+        "tokens": tokens,
+        "logprobs": [-0.5 * (i + 1) for i in range(len(tokens))],
+    }
+
+
+def mock_score(context, continuation):
+    """Deterministic log-likelihood of a continuation, depending on its context"""
+    return -0.5 * len(continuation.split()) - 0.01 * len(context)
+
+
+def mock_activations(prompt, module_name, hidden_size=4):
+    """Deterministic activations of a module, one row per word of the prompt"""
+    rows = max(1, len(prompt.split()))
+    base = len(prompt) + 100 * len(module_name)
+    return (base + np.arange(rows * hidden_size, dtype=np.float32)).reshape(
+        rows, hidden_size
+    )
+
+
+class MockGateway:
+    """Serves the gateway REST API from a background thread on a random local port
+
+    :param models: Names of the models the gateway supports
+    :param latency: Seconds to sleep before answering a generate request
+    :param latency_jitter: Up to this many more seconds are added at random to the latency
+    :param latency_per_prompt: Seconds added to the latency for each prompt of the request
+    :param latency_per_token: Seconds added to the latency for each token of the request once
+    every prompt is padded to the longest one, as a GPU server would
+    :param error_rate: Fraction of requests failing at random with `fail_status`
+    :param tokens_per_prompt: Number of tokens generated per prompt, regardless of the prompt,
+    to control the size of responses. Tokens are taken from the prompt if None.
+    :param seed: Seed of the random latency and errors
+    :param supports_msgpack: Whether generate responses may be negotiated as msgpack
+    :param compress_responses: Whether responses are compressed when the client accepts it
+    :param capacity: Number of generate requests served at once, further ones get a 429
+    :param extensions: Whether the score and activations endpoints, which only some gateway
+    deployments provide, are served. They get an HTML 404 otherwise.
+    :param token_lifetime: Seconds the JWTs issued by `/authenticate` are valid for. Issued
+    tokens are the static MOCK_TOKEN if None. Expired JWTs and revoked tokens get a 401.
+    """
+
+    def __init__(
+        self,
+        models=("llama3-8b", "opt-6.7b"),
+        latency=0.0,
+        supports_msgpack=True,
+        compress_responses=True,
+        capacity=None,
+        latency_jitter=0.0,
+        latency_per_prompt=0.0,
+        latency_per_token=0.0,
+        error_rate=0.0,
+        tokens_per_prompt=None,
+        seed=0,
+        token_lifetime=None,
+        extensions=True,
+    ):
+        self.models = list(models)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.latency_per_prompt = latency_per_prompt
+        self.latency_per_token = latency_per_token
+        self.error_rate = error_rate
+        self.tokens_per_prompt = tokens_per_prompt
+        self.token_lifetime = token_lifetime
+        self.extensions = extensions
+        self.logins = 0
+        self.revoked = set()
+        self._random = random.Random(seed)
+        self.initial_state = "ACTIVE"
+        self.supports_msgpack = supports_msgpack
+        self.compress_responses = compress_responses
+        self.encodings = []
+        self.instances = {}
+        self.requests = []
+        self.generate_calls = []
+        self.score_calls = []
+        self.activation_calls = []
+        self.connections = 0
+        self.fail_next = 0
+        self.fail_status = 503
+        self.retry_after = None
+        self.fail_body = None
+        # Generations left out of the end of every generate response
+        self.drop_generations = 0
+        self.held = 0
+        self._holds = []
+        self.capacity = capacity
+        self.active_generates = 0
+        self.max_active_generates = 0
+        self.rejected = 0
+
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add_instance(self, name, state="ACTIVE"):
+        instance_id = str(uuid.uuid4())
+        with self._lock:
+            self.instances[instance_id] = {
+                "id": instance_id,
+                "name": name,
+                "state": state,
+            }
+        return instance_id
+
+    def set_state(self, instance_id, state):
+        with self._lock:
+            self.instances[instance_id]["state"] = state
+
+    def issue_token(self):
+        with self._lock:
+            self.logins += 1
+        if self.token_lifetime is None:
+            return MOCK_TOKEN
+        now = time.time()
+        return mock_jwt(now + self.token_lifetime, issued_at=now)
+
+    def accepts(self, authorization):
+        """Whether a request with this Authorization header is authorized"""
+        if not authorization or not authorization.startswith("Bearer "):
+            return True
+        token = authorization[len("Bearer ") :]
+        if token in self.revoked:
+            return False
+        expires_at = token_expiry(token)
+        return expires_at is None or expires_at > time.time()
+
+    def hold(self, count=1):
+        """Makes the next `count` requests wait, once recorded, until the returned event is set"""
+        release = threading.Event()
+        with self._lock:
+            self._holds.extend([release] * count)
+        return release
+
+    def take_hold(self):
+        with self._lock:
+            if not self._holds:
+                return None
+            self.held += 1
+            return self._holds.pop(0)
+
+    def take_failure(self):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return self.fail_status
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.fail_status
+        return None
+
+    def begin_generate(self):
+        with self._lock:
+            if self.capacity is not None and self.active_generates >= self.capacity:
+                self.rejected += 1
+                return False
+            self.active_generates += 1
+            self.max_active_generates = max(
+                self.max_active_generates, self.active_generates
+            )
+            return True
+
+    def end_generate(self):
+        with self._lock:
+            self.active_generates -= 1
+
+    def generate(self, prompts, generation_config):
+        with self._lock:
+            jitter = self._random.uniform(0, self.latency_jitter)
+        latency = self.latency + jitter + self.latency_per_prompt * len(prompts)
+        if self.latency_per_token:
+            padded_length = max(len(prompt.split()) for prompt in prompts)
+            latency += self.latency_per_token * padded_length * len(prompts)
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            self.generate_calls.append(list(prompts))
+        if self.tokens_per_prompt is not None:
+            generation_config = dict(
+                generation_config, max_tokens=self.tokens_per_prompt
+            )
+            filler = [f"token{i}" for i in range(self.tokens_per_prompt)]
+            prompts = [
+                " ".join((prompt.split() + filler)[: self.tokens_per_prompt])
+                for prompt in prompts
+            ]
+        rows = [mock_generation(prompt, generation_config) for prompt in prompts]
+        rows = rows[: len(rows) - self.drop_generations]
+        return {
+            "generation": {
+                "sequences": [row["sequence"] for row in rows],
+                "tokens": [row["tokens"] for row in rows],
+                "logprobs": [row["logprobs"] for row in rows],
+            }
+        }
+
+    def score(self, contexts, continuations):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.score_calls.append(
+                {"contexts": list(contexts), "continuations": list(continuations)}
+            )
+        return {
+            "scores": [
+                mock_score(contexts[index], continuation)
+                for index, continuation in continuations
+            ]
+        }
+
+    def activations(self, prompts, module_names):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.activation_calls.append(list(prompts))
+        tensors, lengths = {}, {}
+        for name in module_names:
+            rows = [mock_activations(prompt, name) for prompt in prompts]
+            tensors[name] = np.concatenate(rows)
+            lengths[name] = [len(row) for row in rows]
+        return serialization.encode_tensors(tensors, {"lengths": lengths})
+
+
+def _make_handler(gateway):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, Nagle would delay the body by ~40ms
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with gateway._lock:
+                gateway.connections += 1
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, negotiate=False, headers=None):
+            content_type = wire.JSON_CONTENT_TYPE
+            content_encoding = None
+            accept = self.headers.get("Accept", "")
+            accept_encoding = self.headers.get("Accept-Encoding", "")
+            if (
+                negotiate
+                and gateway.supports_msgpack
+                and wire.MSGPACK_CONTENT_TYPE in accept
+            ):
+                content_type = wire.MSGPACK_CONTENT_TYPE
+                data = wire.pack_generation_response(payload)
+            else:
+                data = json.dumps(payload).encode("utf-8")
+            if negotiate and gateway.compress_responses:
+                for compression in ("zstd", "gzip"):
+                    if compression in accept_encoding:
+                        content_encoding = compression
+                        data = wire.compress(data, compression)
+                        break
+            if negotiate:
+                with gateway._lock:
+                    gateway.encodings.append(
+                        {
+                            "request_encoding": self.headers.get("Content-Encoding"),
+                            "content_type": content_type,
+                            "content_encoding": content_encoding,
+                        }
+                    )
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            if content_encoding:
+                self.send_header("Content-Encoding", content_encoding)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_frame(self, data):
+            self.send_response(200)
+            self.send_header("Content-Type", serialization.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            return wire.decompress(body, self.headers.get("Content-Encoding"))
+
+        def _record(self):
+            with gateway._lock:
+                gateway.requests.append(
+                    (self.command, self.path, self.headers.get("Authorization"))
+                )
+            release = gateway.take_hold()
+            if release is not None:
+                release.wait(HOLD_TIMEOUT)
+                with gateway._lock:
+                    gateway.held -= 1
+            return gateway.accepts(self.headers.get("Authorization"))
+
+        def _unauthorized(self):
+            self._send(401, {"msg": "Token has expired"})
+
+        def _send_failure(self, status):
+            headers = {}
+            if gateway.retry_after is not None:
+                headers["Retry-After"] = str(gateway.retry_after)
+            if gateway.fail_body is None:
+                return self._send(status, {"msg": "Injected failure"}, headers=headers)
+            self._send_html(status, gateway.fail_body, headers)
+
+        def _send_html(self, status, text, headers=None):
+            data = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html")
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _not_found(self):
+            self._send(404, {"msg": f"{self.path} not found"})
+
+        def do_GET(self):
+            if not self._record():
+                return self._unauthorized()
+            failure = gateway.take_failure()
+            if failure:
+                return self._send_failure(failure)
+
+            parts = self.path.strip("/").split("/")
+            if parts == ["models"]:
+                return self._send(200, gateway.models)
+            if parts == ["models", "instances"]:
+                return self._send(200, list(gateway.instances.values()))
+            if len(parts) == 3 and parts[:2] == ["models", "instances"]:
+                instance = gateway.instances.get(parts[2])
+                if instance is None:
+                    return self._not_found()
+                return self._send(200, instance)
+            self._not_found()
+
+        def do_POST(self):
+            authorized = self._record()
+            body = self._read_body()
+            if not authorized:
+                return self._unauthorized()
+            failure = gateway.take_failure()
+            if failure:
+                return self._send_failure(failure)
+
+            parts = self.path.strip("/").split("/")
+            if parts == ["authenticate"]:
+                expected = base64.b64encode(
+                    f"{MOCK_USERNAME}:{MOCK_PASSWORD}".encode("utf-8")
+                ).decode("utf-8")
+                if self.headers.get("Authorization") != f"Basic {expected}":
+                    return self._send(401, {"msg": "Invalid credentials"})
+                return self._send(200, {"token": gateway.issue_token()})
+
+            payload = json.loads(body) if body else {}
+            if not gateway.extensions and parts[-1] in ("score", "activations"):
+                return self._send_html(404, "<h1>Not Found</h1>")
+            if parts == ["models", "instances"]:
+                name = payload.get("name")
+                if name not in gateway.models:
+                    return self._send(400, {"msg": f"Model {name} not supported"})
+                instance_id = gateway.add_instance(name, gateway.initial_state)
+                return self._send(200, gateway.instances[instance_id])
+            if (
+                len(parts) == 4
+                and parts[:2] == ["models", "instances"]
+                and parts[3] == "generate"
+            ):
+                if parts[2] not in gateway.instances:
+                    return self._not_found()
+                if not gateway.begin_generate():
+                    return self._send(
+                        429, {"msg": "Too many requests"}, headers={"Retry-After": "0"}
+                    )
+                try:
+                    response = gateway.generate(
+                        payload["prompts"], payload.get("generation_config", {})
+                    )
+                finally:
+                    gateway.end_generate()
+                return self._send(200, response, negotiate=True)
+            if (
+                len(parts) == 4
+                and parts[:2] == ["models", "instances"]
+                and parts[3] == "score"
+            ):
+                if parts[2] not in gateway.instances:
+                    return self._not_found()
+                response = gateway.score(payload["contexts"], payload["continuations"])
+                return self._send(200, response)
+            if (
+                len(parts) == 4
+                and parts[:2] == ["models", "instances"]
+                and parts[3] == "activations"
+            ):
+                if parts[2] not in gateway.instances:
+                    return self._not_found()
+                frame = gateway.activations(payload["prompts"], payload["module_names"])
+                return self._send_frame(frame)
+            self._not_found()
+
+    return Handler
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from kscope import Client, GatewayError, NotSupportedError
+from kscope.activations import ActivationStore
+
+from ..mock_gateway import mock_activations, MockGateway
+
+MODULES = ["transformer.h.0", "transformer.h.11.mlp"]
+
+
+def _prompts(count):
+    return (f"prompt {'word ' * (i % 5)}{i}" for i in range(count))
+
+
+def test_activations_of_every_prompt(tmp_path, model):
+    """Verify every prompt gets the activations of every module, in input order"""
+    prompts = list(_prompts(21))
+    store = model.get_activations(
+        iter(prompts), MODULES, tmp_path / "acts", max_batch=4, concurrency=3
+    )
+    assert len(store) == len(prompts)
+    assert store.module_names == MODULES
+    for name in MODULES:
+        assert store[name].feature_shape == (4,)
+        assert store[name].dtype == np.float32
+        for i, prompt in enumerate(prompts):
+            np.testing.assert_array_equal(
+                store[name][i], mock_activations(prompt, name)
+            )
+
+
+def test_store_reopens_lazily(tmp_path, gateway, model):
+    """Verify a reopened store only maps the chunks it reads"""
+    path = tmp_path / "acts"
+    model.get_activations(list(_prompts(10)), MODULES, path, max_batch=3)
+    assert len(gateway.activation_calls) == 4
+    assert len(list(path.glob("chunk-*.kst"))) == 4
+
+    store = ActivationStore(path)
+    assert store._loaded == {}
+    row = store.get(MODULES[1], 7)
+    assert not row.flags.writeable
+    assert list(store._loaded) == [store._chunk_of[7]]
+    np.testing.assert_array_equal(
+        row, mock_activations("prompt word word 7", MODULES[1])
+    )
+
+
+def test_refuses_to_overwrite_store(tmp_path, model):
+    """Verify a directory holding a store is not overwritten"""
+    model.get_activations(["a"], MODULES, tmp_path)
+    with pytest.raises(FileExistsError):
+        model.get_activations(["b"], MODULES, tmp_path)
+
+
+def test_failed_batch_leaves_readable_store(tmp_path, gateway, model):
+    """Verify a failed retrieval leaves a store that can still be opened"""
+    gateway.fail_next = 1
+    with pytest.raises(GatewayError):
+        model.get_activations(
+            list(_prompts(4)),
+            MODULES,
+            tmp_path,
+            max_batch=2,
+            concurrency=1,
+            max_retries=0,
+        )
+    assert len(ActivationStore(tmp_path)) == 0
+
+
+def test_pool_activations(tmp_path, gateway, client):
+    """Verify a pool retrieves activations over its replicas"""
+    for _ in range(2):
+        gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b")
+    prompts = list(_prompts(8))
+    store = pool.get_activations(prompts, MODULES[:1], tmp_path, max_batch=2)
+    for i, prompt in enumerate(prompts):
+        np.testing.assert_array_equal(
+            store[MODULES[0]][i], mock_activations(prompt, MODULES[0])
+        )
+
+
+def test_gateway_without_activations_endpoint(tmp_path):
+    """Verify retrieval fails clearly, without retries, on a gateway lacking the endpoint"""
+    with MockGateway(extensions=False) as gateway:
+        client = Client(gateway.host, gateway.port, auth_key="test_auth_key")
+        model = client.load_model("llama3-8b")
+        with pytest.raises(NotSupportedError, match="activations endpoint"):
+            model.get_activations(["a", "b"], MODULES, tmp_path, max_retries=3)
+        assert len(gateway.activation_calls) == 0
+        assert len([path for _, path, _ in gateway.requests if "activ" in path]) == 1
+    assert len(ActivationStore(tmp_path)) == 0
@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from kscope.arrow import generate_column, generate_parquet, generate_table
+
+from ..mock_gateway import mock_generation
+
+
+def _table(count):
+    return pa.table(
+        {
+            "id": list(range(count)),
+            "prompt": [f"prompt {i} text" if i % 5 else None for i in range(count)],
+        }
+    )
+
+
+def _expected(prompt, field):
+    if prompt is None:
+        return None
+    return mock_generation(prompt, {})[field]
+
+
+def _check(table):
+    for row in table.to_pylist():
+        assert row["sequence"] == _expected(row["prompt"], "sequence")
+        assert row["tokens"] == _expected(row["prompt"], "tokens")
+        assert row["logprobs"] == _expected(row["prompt"], "logprobs")
+
+
+def test_generate_table(model):
+    """Verify generated columns are appended to an Arrow table"""
+    table = generate_table(model, _table(12), max_batch=3)
+    assert table.column_names == ["id", "prompt", "sequence", "tokens", "logprobs"]
+    assert table.schema.field("tokens").type == pa.list_(pa.string())
+    assert table.schema.field("logprobs").type == pa.list_(pa.float32())
+    _check(table)
+
+
+def test_generate_data_frame(model):
+    """Verify generated columns are appended to a pandas data frame"""
+    pd = pytest.importorskip("pandas")
+    df = _table(6).to_pandas()
+    df.index = df.index + 100
+    result = generate_table(model, df, prefix="gen_")
+    assert list(result.index) == list(df.index)
+    assert result.loc[101, "gen_sequence"] == "PROMPT 1 TEXT"
+    assert pd.isna(result.loc[100, "gen_sequence"])
+
+
+def test_generate_column(model):
+    """Verify a column of prompts with nulls gets null generations"""
+    columns = generate_column(model, pa.chunked_array([["a b"], [None, "c"]]))
+    assert columns.column("sequence").to_pylist() == ["A B", None, "C"]
+
+
+def test_refuses_to_replace_columns(model):
+    """Verify existing columns are never overwritten"""
+    with pytest.raises(ValueError):
+        generate_table(model, _table(2).append_column("sequence", pa.array(["", ""])))
+
+
+def test_generate_parquet(tmp_path, gateway, model):
+    """Verify a Parquet file is streamed through the model one row group at a time"""
+    source = tmp_path / "prompts.parquet"
+    pq.write_table(_table(23), source, row_group_size=7)
+    destination = tmp_path / "generations.parquet"
+
+    written = generate_parquet(
+        model, source, destination, row_group_size=5, max_batch=2, concurrency=3
+    )
+    assert written == 23
+    output = pq.ParquetFile(destination)
+    assert output.metadata.num_row_groups == 5
+    table = output.read()
+    assert table.column("id").to_pylist() == list(range(23))
+    _check(table)
+    assert sum(len(call) for call in gateway.generate_calls) == 23 - 5
+
+
+def test_generate_parquet_without_rows(tmp_path, model):
+    """Verify an empty input still writes a file with the output schema"""
+    destination = tmp_path / "empty.parquet"
+    assert generate_parquet(model, _table(0), destination) == 0
+    assert pq.read_table(destination).column_names[-1] == "logprobs"
+
+
+def test_generate_parquet_bounds_pending_row_groups(tmp_path, gateway, model):
+    """Verify reading stops while a held request keeps row groups from being written"""
+    release = gateway.hold()
+    timer = threading.Timer(0.3, release.set)
+    released_at_read = []
+
+    def batches():
+        for batch in _table(20).to_batches(max_chunksize=4):
+            released_at_read.append(release.is_set())
+            yield batch
+
+    timer.start()
+    try:
+        written = generate_parquet(
+            model,
+            batches(),
+            tmp_path / "generations.parquet",
+            max_batch=4,
+            concurrency=4,
+            max_pending_row_groups=2,
+        )
+    finally:
+        release.set()
+        timer.cancel()
+    assert written == 20
+    # The third row group is only read once the first one could be written
+    assert released_at_read[:3] == [False, False, True]
+    _check(pq.read_table(tmp_path / "generations.parquet"))
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+
+import pytest
+
+from kscope import AsyncClient, ModelLoadError
+
+pytest.importorskip("aiohttp")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_async_generate(gateway):
+    """Verify generation through the asyncio client"""
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port, "test_auth_key") as client:
+            model = await client.load_model("llama3-8b", wait_for_active=True)
+            return await model.generate(["What is this", "Who is that"])
+
+    response = run(main())
+    assert response.generation["sequences"] == ["WHAT IS THIS", "WHO IS THAT"]
+
+
+def test_async_model_instances(gateway):
+    """Verify instances and states are awaitable"""
+    instance_id = gateway.add_instance("llama3-8b")
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port, "test_auth_key") as client:
+            instances = await client.model_instances
+            models = await client.models
+            return instances, models
+
+    instances, models = run(main())
+    assert [instance["id"] for instance in instances] == [instance_id]
+    assert models == gateway.models
+
+
+def test_async_concurrency_is_bounded(gateway):
+    """Verify many concurrent generations share a bounded connection pool"""
+    gateway.latency = 0.05
+
+    async def main():
+        async with AsyncClient(
+            gateway.host, gateway.port, "test_auth_key", max_concurrency=4
+        ) as client:
+            model = await client.load_model("llama3-8b")
+            prompts = [f"prompt {i}" for i in range(40)]
+            return await asyncio.gather(*(model.generate(p) for p in prompts))
+
+    responses = run(main())
+    assert [r.generation["sequences"][0] for r in responses] == [
+        f"PROMPT {i}" for i in range(40)
+    ]
+    assert gateway.connections <= 4
+
+
+def test_async_errors_raise_value_error(gateway):
+    """Verify gateway errors surface the same way as in the blocking client"""
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port, "test_auth_key") as client:
+            await client.load_model("unknown-model")
+
+    with pytest.raises(ValueError):
+        run(main())
+
+
+def _load_launching(gateway, state=None, timeout=5):
+    gateway.initial_state = "LAUNCHING"
+    if state is not None:
+        threading.Timer(
+            0.2,
+            lambda: [gateway.set_state(i, state) for i in list(gateway.instances)],
+        ).start()
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port, "test_auth_key") as client:
+            client._readiness.min_interval = 0.02
+            model = await client.load_model(
+                "llama3-8b", wait_for_active=True, timeout=timeout
+            )
+            return await model.state
+
+    return run(main())
+
+
+def test_async_wait_for_active(gateway):
+    """Verify load_model waits for a launching instance to become active"""
+    assert _load_launching(gateway, "ACTIVE") == "ACTIVE"
+    polls = [path for method, path, _ in gateway.requests if method == "GET"]
+    # The poll interval backs off rather than hammering the gateway
+    assert 2 <= len(polls) < 15
+
+
+def test_async_failed_model_raises(gateway):
+    """Verify an instance that fails to load raises ModelLoadError"""
+    with pytest.raises(ModelLoadError):
+        _load_launching(gateway, "FAILED")
+
+
+def test_async_wait_times_out(gateway):
+    """Verify waiting for an instance that never becomes active times out"""
+    with pytest.raises(TimeoutError):
+        _load_launching(gateway, timeout=0.1)
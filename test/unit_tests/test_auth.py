@@ -0,0 +1,212 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from filelock import FileLock
+import pytest
+
+from kscope import AsyncClient, Client, GatewayError, GatewaySession
+from kscope.auth import EnvironmentLogin, TokenManager, token_expiry
+
+from ..mock_gateway import mock_jwt, MOCK_PASSWORD, MOCK_USERNAME, MockGateway
+
+
+@pytest.fixture
+def gateway():
+    with MockGateway(token_lifetime=3600) as mock_gateway:
+        yield mock_gateway
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    monkeypatch.setenv("KSCOPE_USERNAME", MOCK_USERNAME)
+    monkeypatch.setenv("KSCOPE_PASSWORD", MOCK_PASSWORD)
+
+
+def _manager(gateway, path, token=None):
+    return TokenManager(
+        token, path=path, login=EnvironmentLogin(gateway.host, gateway.port)
+    )
+
+
+def _refresh_in_process(manager, stale, results):
+    results.put(manager.refresh(rejected=stale))
+
+
+def test_token_expiry():
+    """Verify the expiry is read from the claims of a JWT, and None for other tokens"""
+    assert token_expiry(mock_jwt(1234.5)) == 1234.5
+    assert token_expiry("test_auth_key") is None
+    assert token_expiry("a.not-base64!.c") is None
+
+
+def test_refreshes_token_before_it_expires(tmp_path, gateway, credentials):
+    """Verify a token close to its expiry is replaced by a new login, saved to the file"""
+    path = tmp_path / "token.jwt"
+    now = time.time()
+    # Due for refresh, a tenth of its lifetime is left
+    expiring = mock_jwt(now + 100, issued_at=now - 900)
+    manager = _manager(gateway, path, expiring)
+
+    token = manager.get()
+    assert token != expiring and token_expiry(token) > now + 3000
+    assert path.read_text() == token
+    assert manager.get() == token
+    assert gateway.logins == 1
+
+
+def test_keeps_token_without_login(tmp_path):
+    """Verify a token due for refresh is kept until rejected when there is no login"""
+    now = time.time()
+    expiring = mock_jwt(now + 100, issued_at=now - 900)
+    manager = TokenManager(expiring, path=tmp_path / "token.jwt")
+    assert manager.get() == expiring
+    assert manager.refresh(rejected=expiring) is None
+
+
+def test_retries_rejected_token_once(tmp_path, gateway, credentials):
+    """Verify a request rejected with a 401 is sent again with a new token"""
+    stale = mock_jwt(time.time() + 3600)
+    gateway.revoked.add(stale)
+    session = GatewaySession(
+        gateway.host, gateway.port, tokens=_manager(gateway, tmp_path / "jwt", stale)
+    )
+
+    assert session.create_model_instance("llama3-8b")["name"] == "llama3-8b"
+    assert gateway.logins == 1
+    headers = [auth for _, path, auth in gateway.requests if path != "/authenticate"]
+    assert headers == [f"Bearer {stale}", f"Bearer {session.auth_key}"]
+
+
+def test_rejected_token_without_login(gateway):
+    """Verify the 401 is raised without a retry when no new token can be obtained"""
+    stale = mock_jwt(time.time() - 1)
+    session = GatewaySession(gateway.host, gateway.port, stale)
+    with pytest.raises(GatewayError) as err:
+        session.create_model_instance("llama3-8b")
+    assert err.value.status_code == 401
+    assert len(gateway.requests) == 1
+
+
+def test_processes_share_refreshed_token(tmp_path, gateway, credentials):
+    """Verify processes refreshing the same token file log in only once"""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork is not available")
+    context = multiprocessing.get_context("fork")
+    path = tmp_path / "token.jwt"
+    stale = mock_jwt(time.time() + 3600)
+    path.write_text(stale)
+
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=_refresh_in_process,
+            args=(_manager(gateway, path), stale, results),
+        )
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    tokens = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert gateway.logins == 1
+    assert set(tokens) == {path.read_text()}
+    assert stale not in tokens
+
+
+def test_client_logs_in_from_environment(tmp_path, monkeypatch, gateway, credentials):
+    """Verify the client logs in with the credentials of the environment, without a prompt"""
+    path = tmp_path / "token.jwt"
+    monkeypatch.setattr("kscope.kaleidoscope_sdk.JWT_TOKEN_FILE", path)
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("prompted"))
+
+    client = Client(gateway.host, gateway.port)
+    assert client.models == gateway.models
+    assert path.read_text() == client._session.auth_key
+    assert gateway.logins == 1
+
+
+def test_login_does_not_hold_token_file(tmp_path):
+    """Verify a slow login leaves the token file unlocked, and waiting threads get its token"""
+    path = tmp_path / "token.jwt"
+    stale = mock_jwt(time.time() + 3600)
+    fresh = mock_jwt(time.time() + 3600, subject="fresh")
+    logging_in = threading.Event()
+    release = threading.Event()
+
+    def login():
+        logging_in.set()
+        assert release.wait(10)
+        return fresh
+
+    manager = TokenManager(stale, path=path, login=login)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(manager.refresh(stale)))
+        for _ in range(2)
+    ]
+    threads[0].start()
+    assert logging_in.wait(10)
+    threads[1].start()
+    try:
+        # Other processes can still read and write the token file
+        with FileLock(f"{path}.lock", timeout=0):
+            pass
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
+
+    assert results == [fresh, fresh]
+    assert path.read_text() == fresh
+
+
+def test_async_retries_rejected_token(tmp_path, monkeypatch, gateway, credentials):
+    """Verify the asyncio client shares the token file and retries a 401 with a new token"""
+    pytest.importorskip("aiohttp")
+    path = tmp_path / "token.jwt"
+    monkeypatch.setattr("kscope.async_sdk.JWT_TOKEN_FILE", path)
+    stale = mock_jwt(time.time() + 3600)
+    path.write_text(stale)
+    gateway.revoked.add(stale)
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port) as client:
+            model = await client.load_model("llama3-8b")
+            return client, await model.generate(["hello"])
+
+    client, response = asyncio.run(main())
+    assert response.generation["sequences"] == ["HELLO"]
+    assert gateway.logins == 1
+    assert client._session.auth_key == path.read_text() != stale
+
+
+def test_async_client_logs_in_off_the_event_loop(
+    tmp_path, monkeypatch, gateway, credentials
+):
+    """Verify the asyncio client only logs in on its first request, in another thread"""
+    pytest.importorskip("aiohttp")
+    path = tmp_path / "token.jwt"
+    monkeypatch.setattr("kscope.async_sdk.JWT_TOKEN_FILE", path)
+    login_threads = []
+    login = EnvironmentLogin.__call__
+
+    def recording_login(self):
+        login_threads.append(threading.current_thread())
+        return login(self)
+
+    monkeypatch.setattr(EnvironmentLogin, "__call__", recording_login)
+
+    async def main():
+        async with AsyncClient(gateway.host, gateway.port) as client:
+            assert gateway.logins == 0 and not path.exists()
+            await client.load_model("llama3-8b")
+            return threading.current_thread()
+
+    loop_thread = asyncio.run(main())
+    assert gateway.logins == 1
+    assert login_threads and loop_thread not in login_threads
+    assert path.exists()
@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from kscope import GatewayError
+from kscope.batching import chunked_by_length
+from kscope.kaleidoscope_sdk import RETRY_BACKOFF
+
+GREEDY = {"temperature": 0}
+
+
+def test_generate_many_preserves_order(gateway, model):
+    """Verify prompts are chunked into gateway sized batches and reassembled in order"""
+    prompts = [f"prompt number {i}" for i in range(20)]
+    response = model.generate_many(prompts, max_batch=8, concurrency=3)
+    assert response.generation["sequences"] == [p.upper() for p in prompts]
+    assert sorted(len(batch) for batch in gateway.generate_calls) == [4, 8, 8]
+
+
+def test_generate_many_retries_failed_batches(gateway, model, monkeypatch):
+    """Verify a failed batch is retried on its own"""
+    monkeypatch.setattr("kscope.kaleidoscope_sdk.RETRY_BACKOFF", 0)
+    gateway.fail_next = 1
+    prompts = [f"prompt number {i}" for i in range(16)]
+    response = model.generate_many(prompts, concurrency=1)
+    assert response.generation["sequences"] == [p.upper() for p in prompts]
+    assert len(gateway.generate_calls) == 2
+
+
+def test_generate_many_gives_up_after_max_retries(gateway, model, monkeypatch):
+    """Verify errors surface once the retry budget is exhausted"""
+    monkeypatch.setattr("kscope.kaleidoscope_sdk.RETRY_BACKOFF", 0)
+    gateway.fail_next = 3
+    with pytest.raises(ValueError):
+        model.generate_many(["What is this"], max_retries=2)
+
+
+def test_generate_iter_consumes_prompts_lazily(gateway, model):
+    """Verify prompts are pulled from the iterable only as batches are dispatched"""
+    consumed = []
+
+    def prompt_stream():
+        for i in range(100):
+            consumed.append(i)
+            yield f"prompt number {i}"
+
+    results = model.generate_iter(prompt_stream(), max_batch=8, max_in_flight=2)
+    next(results)
+    assert len(consumed) <= 8 * 3
+    results.close()
+
+
+def test_generate_iter_yields_every_index(gateway, model):
+    """Verify every prompt is yielded once with its own result"""
+    prompts = [f"prompt number {i}" for i in range(30)]
+    results = dict(model.generate_iter(iter(prompts), max_in_flight=3))
+    assert sorted(results) == list(range(30))
+    for index, result in results.items():
+        assert result.generation["sequences"] == [prompts[index].upper()]
+
+
+def test_concurrent_calls_are_micro_batched(gateway, model):
+    """Verify single-prompt calls from many threads share requests"""
+    model.enable_batching(max_batch=8, max_wait=0.05)
+    prompts = [f"prompt number {i}" for i in range(32)]
+    try:
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            responses = list(executor.map(model.generate, prompts))
+    finally:
+        model.disable_batching()
+
+    for prompt, response in zip(prompts, responses):
+        assert response.generation["sequences"] == [prompt.upper()]
+    assert len(gateway.generate_calls) < len(prompts)
+    assert all(len(batch) <= 8 for batch in gateway.generate_calls)
+
+
+def test_micro_batching_fails_on_short_response(gateway, model):
+    """Verify every caller of a batch fails when the gateway leaves out generations"""
+    gateway.drop_generations = 1
+    model.enable_batching(max_batch=4, max_wait=1)
+    prompts = [f"prompt number {i}" for i in range(4)]
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(model.generate, p, {}, 5) for p in prompts]
+            errors = [future.exception(timeout=5) for future in futures]
+    finally:
+        model.disable_batching()
+
+    assert all(isinstance(err, GatewayError) for err in errors)
+    assert [sorted(call) for call in gateway.generate_calls] == [prompts]
+
+
+def test_micro_batching_keeps_configs_apart(gateway, model):
+    """Verify prompts with different generation configs are never merged"""
+    model.enable_batching(max_wait=0.05)
+    configs = [{"max_tokens": 1}, {"max_tokens": 2}] * 4
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(model.generate, ["a b c"] * 8, configs))
+    finally:
+        model.disable_batching()
+
+    for config, response in zip(configs, responses):
+        assert len(response.generation["tokens"][0]) == config["max_tokens"]
+    assert len(gateway.generate_calls) == 2
+
+
+def test_generate_many_does_not_retry_client_errors(gateway, model):
+    """Verify a rejected batch is raised at once rather than retried"""
+    gateway.fail_next = 1
+    gateway.fail_status = 400
+    start = time.monotonic()
+    with pytest.raises(GatewayError) as err:
+        model.generate_many(["a b"], max_retries=3)
+    assert err.value.status_code == 400
+    assert time.monotonic() - start < RETRY_BACKOFF
+    assert gateway.generate_calls == []
+
+
+def test_duplicate_prompts_are_sent_once(gateway, model):
+    """Verify repeated prompts within a greedy batch share one generation"""
+    prompts = ["What is this", "Who is that", "What is this", "What is this"]
+    response = model.generate(prompts, GREEDY)
+    assert response.generation["sequences"] == [p.upper() for p in prompts]
+    assert gateway.generate_calls == [["What is this", "Who is that"]]
+
+
+def test_empty_greedy_batch(gateway, model):
+    """Verify a greedy call without prompts returns an empty batch like a sampled one"""
+    greedy = model.generate([], GREEDY)
+    assert len(greedy) == 0
+    assert greedy.sequences == [] and greedy.logprobs.size == 0
+    assert len(model.generate([])) == 0
+
+
+def test_sampled_duplicates_are_sent(gateway, model):
+    """Verify repeated prompts are each generated when the config samples"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(
+            executor.map(
+                model.generate, ["tell a joke"] * 2, [{"temperature": 1.0}] * 2
+            )
+        )
+    response = model.generate(["tell a joke"] * 8, {"temperature": 1.0})
+    assert len(response) == 8
+    assert gateway.generate_calls == [["tell a joke"]] * 2 + [["tell a joke"] * 8]
+
+
+def test_identical_in_flight_requests_are_shared(gateway, model):
+    """Verify concurrent identical requests wait on the one already in flight"""
+    gateway.latency = 0.2
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses = list(
+            executor.map(model.generate, ["What is this"] * 4, [GREEDY] * 4)
+        )
+    assert all(r.generation == responses[0].generation for r in responses)
+    assert gateway.generate_calls == [["What is this"]]
+
+
+def test_chunked_by_length():
+    """Verify prompts are sorted by length within each window"""
+    prompts = ["aaaa", "a", "aaa", "aa", "aaaaa", "b"]
+    assert list(chunked_by_length(prompts, 2)) == [
+        ([1, 5], ["a", "b"]),
+        ([3, 2], ["aa", "aaa"]),
+        ([0, 4], ["aaaa", "aaaaa"]),
+    ]
+    assert [indices for indices, _ in chunked_by_length(prompts, 2, window=3)] == [
+        [1, 2],
+        [0],
+        [5, 3],
+        [4],
+    ]
+
+
+def test_generate_many_packs_by_length(gateway, model):
+    """Verify packed batches hold prompts of similar length and results keep input order"""
+    prompts = [" ".join(["word"] * (1 + (i * 7) % 16)) + f" {i}" for i in range(32)]
+    response = model.generate_many(prompts, max_batch=8, pack_by_length=True)
+    assert response.generation["sequences"] == [p.upper() for p in prompts]
+    spreads = sorted(
+        max(len(p) for p in batch) - min(len(p) for p in batch)
+        for batch in gateway.generate_calls
+    )
+    assert spreads[-1] < max(len(p) for p in prompts) - min(len(p) for p in prompts)
+
+
+def test_generate_iter_packs_by_length(gateway, model):
+    """Verify streamed packing yields the input index of every prompt"""
+    prompts = (f"{'x' * (i % 5)} prompt {i}" for i in range(20))
+    results = dict(
+        model.generate_iter(prompts, max_batch=4, length_fn=len, pack_window=8)
+    )
+    assert sorted(results) == list(range(20))
+    for i, generation in results.items():
+        assert generation.sequences == [f"{'X' * (i % 5)} PROMPT {i}"]
@@ -0,0 +1,71 @@
+import json
+
+from kscope import Client
+
+from ..benchmarks.bench_generate import main, run_benchmark
+from ..mock_gateway import MockGateway
+
+
+def test_run_benchmark():
+    """Verify a benchmark run reports throughput and latency"""
+    result = run_benchmark(batch_size=2, concurrency=2, tokens=4, requests=5, warmup=1)
+    assert result["prompts_per_second"] > 0
+    assert 0 < result["p50_ms"] <= result["p99_ms"]
+
+
+def test_concurrent_calls_overlap():
+    """Verify concurrent calls overlap on the gateway rather than queuing in the client"""
+    kwargs = dict(batch_size=1, tokens=4, requests=40, latency=0.02, warmup=2)
+    sequential = run_benchmark(concurrency=1, **kwargs)
+    concurrent = run_benchmark(concurrency=8, **kwargs)
+    # 8 times faster in theory, allow for the overhead of a loaded machine
+    speedup = concurrent["prompts_per_second"] / sequential["prompts_per_second"]
+    assert speedup > 2, speedup
+
+
+def test_pooled_connections_are_reused():
+    """Verify pooled connections are kept alive across calls, unlike unpooled ones"""
+    kwargs = dict(batch_size=1, concurrency=4, tokens=4, requests=40, warmup=2)
+    pooled = run_benchmark(**kwargs)
+    unpooled = run_benchmark(pool_size=1, **kwargs)
+    assert pooled["connections"] <= 4
+    assert unpooled["connections"] > 2 * pooled["connections"]
+
+
+def test_benchmark_cli(capsys):
+    """Verify the command line prints one JSON result per combination"""
+    main(
+        [
+            "--batch-sizes",
+            "1",
+            "--concurrency",
+            "1",
+            "--tokens",
+            "8",
+            "--requests",
+            "3",
+            "--json",
+        ]
+    )
+    result = json.loads(capsys.readouterr().out)
+    assert result["batch_size"] == 1
+    assert result["requests"] == 3
+
+
+def test_mock_gateway_knobs():
+    """Verify the response size and error rate of the mock gateway"""
+    with MockGateway(tokens_per_prompt=50, error_rate=0.2, seed=3) as gateway:
+        client = Client(gateway.host, gateway.port, auth_key="test_auth_key")
+        gateway.error_rate = 0
+        model = client.load_model("llama3-8b")
+        gateway.error_rate = 0.2
+
+        batch = model.generate_many(
+            [f"prompt {i}" for i in range(8)], max_batch=2, max_retries=10
+        )
+        assert all(len(tokens) == 50 for tokens in batch.tokens)
+        assert batch[3].tokens[:2] == ["prompt", "3"]
+        assert any(path.endswith("/generate") for _, path, _ in gateway.requests)
+        assert len(gateway.generate_calls) < len(
+            [path for _, path, _ in gateway.requests if path.endswith("/generate")]
+        )
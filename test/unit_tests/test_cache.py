@@ -0,0 +1,71 @@
+import pytest
+
+from kscope.cache import is_deterministic, GenerationCache
+
+GREEDY = {"temperature": 0, "max_tokens": 8}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = GenerationCache(tmp_path / "generations.sqlite")
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def cached_model(client, cache):
+    return client.load_model("llama3-8b", cache=cache)
+
+
+def test_cache_hits_skip_the_network(gateway, cached_model, cache):
+    """Verify repeated prompts are answered from the cache"""
+    first = cached_model.generate(["What is this", "Who is that"], GREEDY)
+    second = cached_model.generate(["What is this", "Who is that"], GREEDY)
+    assert first.generation == second.generation
+    assert len(gateway.generate_calls) == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_partially_cached_batch_sends_one_request(gateway, cached_model):
+    """Verify the uncached prompts of a batch are sent together"""
+    cached_model.generate(["What is this"], GREEDY)
+    response = cached_model.generate(["Who is that", "What is this", "Where"], GREEDY)
+    assert response.generation["sequences"] == ["WHO IS THAT", "WHAT IS THIS", "WHERE"]
+    assert gateway.generate_calls == [["What is this"], ["Who is that", "Where"]]
+
+
+def test_sampling_configs_are_not_cached(gateway, cached_model):
+    """Verify non-deterministic generations always reach the gateway"""
+    config = {"temperature": 0.7}
+    cached_model.generate("What is this", config)
+    cached_model.generate("What is this", config)
+    assert len(gateway.generate_calls) == 2
+
+
+def test_invalid_temperatures_are_not_cached(gateway, cached_model):
+    """Verify a temperature that is not a number is sent as is rather than raising"""
+    assert not is_deterministic({"temperature": None})
+    assert not is_deterministic({"temperature": "greedy", "top_k": 1})
+    assert is_deterministic({"temperature": "0"})
+    for _ in range(2):
+        cached_model.generate("What is this", {"temperature": None})
+    assert len(gateway.generate_calls) == 2
+
+
+def test_config_key_order_does_not_matter(cache):
+    """Verify the cache key does not depend on the order of the config keys"""
+    assert cache.make_key("m", "p", {"a": 1, "temperature": 0}) == cache.make_key(
+        "m", "p", {"temperature": 0, "a": 1}
+    )
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """Verify the cache stays under its size budget by evicting old entries"""
+    cache = GenerationCache(tmp_path / "generations.sqlite", max_size=250)
+    value = {"generation": {"sequences": ["x" * 50]}}
+    cache.put_many({"a": value})
+    cache.put_many({"b": value})
+    cache.get_many(["a"])
+    cache.put_many({"c": value})
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["size"] <= 250
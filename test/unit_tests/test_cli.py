@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+from kscope.cli import BatchJob, main
+
+
+def _write_input(path, num_lines):
+    with open(path, "w") as lines:
+        for i in range(num_lines):
+            if i % 3 == 0:
+                record = {
+                    "prompt": f"prompt {i}",
+                    "generation_config": {"max_tokens": 1},
+                }
+            else:
+                record = f"prompt {i}"
+            lines.write(json.dumps(record) + "\n")
+            if i == 5:
+                lines.write("\n")
+
+
+def _read_output(path):
+    with open(path) as lines:
+        return [json.loads(line) for line in lines]
+
+
+def test_batch_command(tmp_path, gateway):
+    """Verify the batch command writes one generation per line of the input"""
+    input_path, output_path = tmp_path / "prompts.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 20)
+    main(
+        [
+            "batch",
+            str(input_path),
+            str(output_path),
+            "--model",
+            "llama3-8b",
+            "--host",
+            gateway.host,
+            "--port",
+            str(gateway.port),
+            "--auth-key",
+            "test_auth_key",
+            "--concurrency",
+            "2",
+        ]
+    )
+
+    rows = _read_output(output_path)
+    assert len(rows) == 20
+    for row in rows:
+        assert row["sequence"] == row["prompt"].upper()
+        assert len(row["tokens"]) == (1 if "generation_config" in row else 2)
+        assert len(row["logprobs"]) == len(row["tokens"])
+    assert sorted(row["line"] for row in rows) == [i for i in range(21) if i != 6]
+    assert max(len(prompts) for prompts in gateway.generate_calls) == 8
+
+
+def test_resumes_without_resending(tmp_path, gateway, model):
+    """Verify an interrupted job resumes from its checkpoint without resending lines"""
+    input_path, output_path = tmp_path / "prompts.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 40)
+
+    # The gateway starts failing partway through the first run
+    calls = []
+    generate_many = model.generate_many
+
+    def flaky_generate_many(prompts, *args, **kwargs):
+        calls.append(prompts)
+        if len(calls) > 3:
+            raise ValueError("Gateway went away")
+        return generate_many(prompts, *args, **kwargs)
+
+    model.generate_many = flaky_generate_many
+    job = BatchJob(model, input_path, output_path, concurrency=1, max_retries=0)
+    with pytest.raises(ValueError):
+        job.run()
+    first_run = _read_output(output_path)
+    assert 0 < len(first_run) < 40
+
+    # Output written after the checkpoint is discarded on resume
+    with open(output_path, "a") as output:
+        output.write('{"line": 1000}\n')
+
+    del model.generate_many
+    sent = sum(len(prompts) for prompts in gateway.generate_calls)
+    stats = BatchJob(model, input_path, output_path, concurrency=2).run()
+    assert stats["skipped"] == len(first_run)
+    assert stats["generated"] == 40 - len(first_run)
+    resent = sum(len(prompts) for prompts in gateway.generate_calls) - sent
+    assert resent == 40 - len(first_run)
+
+    rows = _read_output(output_path)
+    assert len(rows) == 40
+    assert len({row["line"] for row in rows}) == 40
+
+
+def _interrupted_job(tmp_path, model):
+    input_path, output_path = tmp_path / "prompts.jsonl", tmp_path / "out.jsonl"
+    _write_input(input_path, 20)
+    BatchJob(model, input_path, output_path, concurrency=1).run()
+    assert len(_read_output(output_path)) == 20
+    return input_path, output_path
+
+
+def test_restarts_without_output(tmp_path, gateway, model):
+    """Verify a checkpoint whose output file is gone is ignored rather than padded"""
+    input_path, output_path = _interrupted_job(tmp_path, model)
+    output_path.unlink()
+
+    stats = BatchJob(model, input_path, output_path).run()
+    assert stats == {"generated": 20, "skipped": 0}
+    assert len(_read_output(output_path)) == 20
+    assert b"\0" not in output_path.read_bytes()
+
+
+def test_restarts_with_truncated_output(tmp_path, gateway, model):
+    """Verify a checkpoint beyond the end of the output file restarts the job"""
+    input_path, output_path = _interrupted_job(tmp_path, model)
+    with open(output_path, "r+b") as output:
+        output.truncate(10)
+
+    stats = BatchJob(model, input_path, output_path).run()
+    assert stats["generated"] == 20
+    assert len(_read_output(output_path)) == 20
+
+
+def test_changed_input_fails(tmp_path, gateway, model):
+    """Verify resuming after the input file changed fails rather than mixing results"""
+    input_path, output_path = _interrupted_job(tmp_path, model)
+    with open(input_path, "a") as lines:
+        lines.write(json.dumps("one more prompt") + "\n")
+
+    with pytest.raises(ValueError, match="changed"):
+        BatchJob(model, input_path, output_path).run()
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from kscope import Client, GatewayError
+from kscope.flow_control import AdaptiveConcurrencyLimiter, TokenBucket
+from kscope.utils import error_message, MAX_ERROR_TEXT
+
+
+def test_limiter_is_aimd():
+    """Verify the limit grows by one when saturated and halves on overload"""
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=8)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(latency=0.01)
+    assert limiter.limit == 4
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(latency=0.01)
+    assert limiter.limit == 8
+
+    # A burst of rejections from the same episode only decreases the limit once
+    for _ in range(3):
+        limiter.acquire()
+    for _ in range(3):
+        limiter.release(overloaded=True)
+    assert limiter.limit == 4
+
+    with pytest.raises(TimeoutError):
+        for _ in range(5):
+            limiter.acquire(timeout=0.01)
+
+
+def test_limiter_backs_off_on_latency():
+    """Verify the limit halves when latency exceeds the tolerated ratio of the baseline"""
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, latency_tolerance=2.0)
+    limiter.acquire()
+    limiter.release(latency=0.01)
+    limiter.acquire()
+    limiter.release(latency=0.1)
+    assert limiter.limit == 4
+
+
+def test_token_bucket():
+    """Verify the bucket spaces acquisitions by its rate, and times out when asked to"""
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+    with pytest.raises(TimeoutError):
+        bucket.acquire(tokens=10, timeout=0.01)
+
+
+def test_retry_after_pauses_session(gateway, client):
+    """Verify a Retry-After header pauses every request of the session"""
+    gateway.fail_next = 1
+    gateway.fail_status = 429
+    gateway.retry_after = 0.3
+    with pytest.raises(GatewayError) as err:
+        client.load_model("llama3-8b")
+    assert err.value.status_code == 429
+    assert err.value.overloaded
+    assert err.value.retry_after == pytest.approx(0.3)
+
+    start = time.monotonic()
+    client.models
+    assert time.monotonic() - start >= 0.25
+
+
+def test_error_without_json_body(gateway):
+    """Verify an HTML 503 still pauses the session and backs off the limiter"""
+    client = Client(
+        gateway.host, gateway.port, auth_key="test_auth_key", max_concurrency=16
+    )
+    model = client.load_model("llama3-8b")
+    gateway.fail_next = 1
+    gateway.fail_status = 503
+    gateway.retry_after = 0.2
+    gateway.fail_body = "<html><body><h1>503 Service Unavailable</h1></body></html>"
+
+    with pytest.raises(GatewayError) as err:
+        model.generate("a b")
+    assert err.value.status_code == 503
+    assert err.value.retry_after == pytest.approx(0.2)
+    assert "503 Service Unavailable" in str(err.value)
+    assert client._session._paused_until > 0
+    assert client._session.limiter.limit < 4
+
+
+def test_error_message_falls_back_to_reason():
+    """Verify error messages come from the JSON body, the raw body, then the reason"""
+    assert error_message('{"msg": "Model not supported"}') == "Model not supported"
+    assert error_message("", "Service Unavailable") == "Service Unavailable"
+    assert len(error_message("x" * 1000)) == MAX_ERROR_TEXT
+
+
+def test_adapts_to_gateway_capacity(gateway):
+    """Verify the limiter settles near the capacity of the gateway"""
+    gateway.capacity = 2
+    gateway.latency = 0.02
+    client = Client(
+        gateway.host, gateway.port, auth_key="test_auth_key", max_concurrency=16
+    )
+    model = client.load_model("llama3-8b")
+
+    prompts = [f"prompt {i}" for i in range(24)]
+    batch = model.generate_many(prompts, max_batch=1, concurrency=8, max_retries=6)
+    assert batch.sequences == [prompt.upper() for prompt in prompts]
+    assert gateway.max_active_generates <= 2
+    assert client._session.limiter.limit <= 4
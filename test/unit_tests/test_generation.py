@@ -0,0 +1,59 @@
+import numpy as np
+
+from kscope.generation import GenerationBatch
+
+RESPONSE = {
+    "id": "instance",
+    "generation": {
+        "sequences": ["a b", "c", ""],
+        "tokens": [["a", "b"], ["c"], []],
+        "logprobs": [[-0.5, -1.0], [-0.25], []],
+    },
+}
+
+
+def test_logprobs_are_contiguous_float64():
+    """Verify JSON logprobs are stored in one float64 array, delimited by offsets"""
+    batch = GenerationBatch.from_response(RESPONSE)
+    assert batch.logprobs.dtype == np.float64
+    assert batch.logprobs.tolist() == [-0.5, -1.0, -0.25]
+    assert batch.offsets.tolist() == [0, 2, 3, 3]
+
+
+def test_per_prompt_access():
+    """Verify indexing a batch gives the generation of one prompt, sharing the logprobs"""
+    batch = GenerationBatch.from_response(RESPONSE)
+    assert len(batch) == 3
+    assert batch[1].sequence == "c"
+    assert batch[0].tokens == ["a", "b"]
+    assert np.shares_memory(batch[0].logprobs, batch.logprobs)
+    assert batch[-1].logprobs.size == 0
+
+
+def test_legacy_generation_access():
+    """Verify the response layout is still available through `.generation`"""
+    batch = GenerationBatch.from_response(RESPONSE)
+    assert batch.generation == RESPONSE["generation"]
+    assert isinstance(batch.generation["logprobs"][0][0], float)
+    # Values are not rounded, unlike in a float32 array
+    exact = GenerationBatch.from_response({"generation": {"logprobs": [[-0.1]]}})
+    assert exact.generation["logprobs"] == [[-0.1]]
+    assert batch.id == "instance"
+    assert batch.to_response() == RESPONSE
+
+
+def test_split_and_concat_round_trip():
+    """Verify splitting a batch and concatenating the parts gives it back"""
+    batch = GenerationBatch.from_response(RESPONSE)
+    parts = batch.split()
+    assert [len(part) for part in parts] == [1, 1, 1]
+    merged = GenerationBatch.concat(parts)
+    assert merged.generation == batch.generation
+    assert merged.offsets.tolist() == batch.offsets.tolist()
+
+
+def test_unknown_fields_are_preserved():
+    """Verify fields of the response without a dedicated column are kept"""
+    response = {"generation": {"text": ["x", "y"], "logprobs": [[-1.0], [-2.0]]}}
+    batch = GenerationBatch.from_response(response)
+    assert batch.split()[1].generation == {"text": ["y"], "logprobs": [[-2.0]]}
@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from kscope.hedging import HedgingPolicy
+
+
+def _generate_paths(gateway):
+    return [path for _, path, _ in gateway.requests if path.endswith("/generate")]
+
+
+def _warm_up(model, count=10):
+    """Records latencies for the hedging policy without sending any duplicate"""
+    budget = model._hedging.budget
+    model._hedging.budget = 0
+    for i in range(count):
+        model.generate([f"warm up {i}"])
+    model._hedging.budget = budget
+
+
+def test_generate_deadline(gateway, model):
+    """Verify a generate call stuck on the gateway times out, and later calls succeed"""
+    release = gateway.hold()
+    try:
+        with pytest.raises(TimeoutError):
+            model.generate(["slow"], timeout=0.2)
+    finally:
+        release.set()
+
+    assert model.generate(["fast"], timeout=5).sequences == ["FAST"]
+
+
+def test_generate_many_deadline(gateway, model):
+    """Verify the deadline of generate_many covers every batch"""
+    release = gateway.hold()
+    try:
+        with pytest.raises(TimeoutError):
+            model.generate_many(
+                ["a", "b", "c"], max_batch=1, max_retries=0, timeout=0.2
+            )
+    finally:
+        release.set()
+
+
+def test_state_deadline(gateway, model):
+    """Verify a state lookup stuck on the gateway times out"""
+    assert model.get_state(timeout=5) == "ACTIVE"
+    release = gateway.hold()
+    try:
+        with pytest.raises(TimeoutError):
+            model.get_state(timeout=0.2)
+    finally:
+        release.set()
+
+
+def test_policy_respects_budget():
+    """Verify duplicates stay within the budget of the policy"""
+    policy = HedgingPolicy(percentile=25, budget=0.1, min_samples=5)
+    calls = []
+
+    def attempt(timeout):
+        calls.append(timeout)
+        time.sleep(0.05 if len(calls) % 2 else 0.001)
+
+    for _ in range(40):
+        policy.run(attempt)
+    assert policy.delay() is not None
+    assert 0 < policy.hedge_rate <= 0.1
+    assert len(calls) <= 44
+    policy.close()
+
+
+def test_hedges_slow_request(gateway, model):
+    """Verify a request stuck on the gateway is answered by its duplicate"""
+    model.enable_hedging(percentile=50, budget=0.5, min_samples=5)
+    _warm_up(model)
+
+    release = gateway.hold()
+    try:
+        assert model.generate(["stalled"]).sequences == ["STALLED"]
+        # The first copy was still held when the duplicate answered
+        assert gateway.held == 1
+    finally:
+        release.set()
+    assert model._hedging.hedge_rate > 0
+    model.disable_hedging()
+
+
+def test_pool_hedges_to_another_instance(gateway, client):
+    """Verify the duplicate of a stuck request goes to a different instance"""
+    gateway.add_instance("llama3-8b")
+    gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b")
+    pool.enable_hedging(percentile=50, budget=0.5, min_samples=5)
+    _warm_up(pool)
+
+    sent = len(_generate_paths(gateway))
+    release = gateway.hold()
+    try:
+        assert pool.generate(["stalled"]).sequences == ["STALLED"]
+        assert gateway.held == 1
+    finally:
+        release.set()
+    first, second = _generate_paths(gateway)[sent:]
+    assert first != second
+    pool.disable_hedging()
@@ -0,0 +1,94 @@
+import pytest
+
+from kscope import Client, GenerationCache
+from kscope.metrics import endpoint_of, Histogram, Metrics
+
+
+@pytest.fixture
+def metrics_client(gateway):
+    return Client(gateway.host, gateway.port, auth_key="test_auth_key", metrics=True)
+
+
+def test_histogram_percentiles():
+    """Verify percentiles are estimated from the bucket boundaries"""
+    histogram = Histogram(buckets=(1, 2, 5))
+    for value in (0.5, 0.5, 1.5, 4, 10):
+        histogram.observe(value)
+    assert histogram.percentile(40) == 1
+    assert histogram.percentile(60) == 2
+    assert histogram.percentile(100) == float("inf")
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5
+    assert snapshot["sum"] == pytest.approx(16.5)
+
+
+def test_endpoint_names():
+    """Verify instance ids are replaced by a placeholder in endpoint names"""
+    assert endpoint_of("http://host:1/models") == "models"
+    assert (
+        endpoint_of("/models/instances/abc/generate")
+        == "models/instances/{id}/generate"
+    )
+
+
+def test_prometheus_format():
+    """Verify metrics are exported in the Prometheus text format"""
+    metrics = Metrics()
+    metrics.increment("requests_total", endpoint="models", status="ok")
+    metrics.observe("request_latency_seconds", 0.003, endpoint="models")
+    text = metrics.to_prometheus()
+    assert "# TYPE kscope_requests_total counter" in text
+    assert 'kscope_requests_total{endpoint="models",status="ok"} 1' in text
+    assert (
+        'kscope_request_latency_seconds_bucket{endpoint="models",le="0.005"} 1' in text
+    )
+    assert (
+        'kscope_request_latency_seconds_bucket{endpoint="models",le="+Inf"} 1' in text
+    )
+    assert 'kscope_request_latency_seconds_count{endpoint="models"} 1' in text
+
+
+def test_client_stats(tmp_path, gateway, metrics_client):
+    """Verify requests, cache hits and batch sizes are recorded for the client"""
+    cache = GenerationCache(tmp_path / "generations.sqlite")
+    model = metrics_client.load_model("llama3-8b", cache=cache)
+    config = {"temperature": 0}
+    model.generate(["a", "b"], config)
+    model.generate(["a", "b", "c"], config)
+
+    stats = metrics_client.stats()
+    generate = "models/instances/{id}/generate"
+    counters = stats["counters"]
+    assert counters["requests_total"][f"endpoint={generate},status=ok"] == 2
+    assert counters["bytes_sent_total"][f"endpoint={generate}"] > 0
+    assert counters["bytes_received_total"][f"endpoint={generate}"] > 0
+    assert counters["cache_hits_total"][""] == 2
+    assert counters["cache_misses_total"][""] == 3
+
+    histograms = stats["histograms"]
+    assert histograms["prompts_per_request"][""]["sum"] == 3
+    assert histograms["request_latency_seconds"][f"endpoint={generate}"]["count"] == 2
+    assert histograms["queue_wait_seconds"]["stage=session"]["count"] >= 2
+
+
+def test_transport_retries_and_errors(gateway, metrics_client):
+    """Verify transport retries and failed requests are counted"""
+    gateway.fail_next = 1
+    metrics_client.models
+    counters = metrics_client.stats()["counters"]
+    assert counters["retries_total"]["endpoint=models,layer=transport"] == 1
+
+    gateway.fail_next = 1
+    gateway.fail_status = 429
+    with pytest.raises(ValueError):
+        metrics_client.load_model("llama3-8b")
+    counters = metrics_client.stats()["counters"]
+    assert counters["requests_total"]["endpoint=models/instances,status=429"] == 1
+
+
+def test_disabled_by_default(client):
+    """Verify no metrics are recorded unless enabled"""
+    assert client._session.metrics is None
+    assert not client._session._http.hooks["response"]
+    with pytest.raises(ValueError):
+        client.stats()
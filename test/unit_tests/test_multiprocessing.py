@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import pickle
+
+import pytest
+
+from kscope import Client, GenerationCache, Metrics
+
+MODEL_NAME = "llama3-8b"
+
+
+def _generate(model, item):
+    prompt = f"prompt {item}"
+    sequence = model.generate(prompt).sequences[0]
+    return item, os.getpid(), sequence
+
+
+def test_session_and_client_pickle_as_settings(gateway, monkeypatch):
+    """Verify a pickled client keeps its settings but gets fresh state and connections"""
+    client = Client(
+        gateway.host,
+        gateway.port,
+        auth_key="test_auth_key",
+        max_concurrency=8,
+        rate_limit=100,
+        metrics=True,
+    )
+    client.metrics.increment("requests_total")
+    # A copy must never fall back to the token file or the interactive login
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("prompted"))
+
+    copy = pickle.loads(pickle.dumps(client))
+    session = copy._session
+    assert session.auth_key == "test_auth_key"
+    assert session.limiter.max_limit == 8
+    assert session._rate_limit.rate == 100
+    assert isinstance(session.metrics, Metrics)
+    assert session.metrics.counter("requests_total") == 0
+    assert session._http is not client._session._http
+    assert MODEL_NAME in copy.models
+
+
+def test_model_keeps_features_when_pickled(tmp_path, client):
+    """Verify batching, hedging and caching survive pickling a model"""
+    cache = GenerationCache(tmp_path / "cache.sqlite")
+    model = client.load_model(MODEL_NAME, cache=cache)
+    model.enable_batching(max_batch=4, max_wait=0.01)
+    model.enable_hedging(percentile=90)
+
+    copy = pickle.loads(pickle.dumps(model))
+    assert copy.id == model.id
+    assert copy._batcher.max_batch == 4 and copy._batcher.max_wait == 0.01
+    assert copy._hedging.percentile == 90
+    assert copy.cache.path == cache.path and copy.cache is not cache
+    assert copy.generate("a b").sequences == ["A B"]
+    model.disable_batching()
+    copy.disable_batching()
+
+
+def test_pool_pickles(gateway, client):
+    """Verify a pickled pool keeps its replicas"""
+    gateway.add_instance(MODEL_NAME)
+    gateway.add_instance(MODEL_NAME)
+    pool = client.load_balanced(MODEL_NAME)
+    copy = pickle.loads(pickle.dumps(pool))
+    assert {replica.id for replica in copy.replicas} == {
+        replica.id for replica in pool.replicas
+    }
+
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_map_processes(start_method, model):
+    """Verify map_processes runs every item in worker processes, in input order"""
+    if start_method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"{start_method} is not available")
+    # Use the transport in the parent first, so that forked children inherit its connections
+    model.generate("warm up")
+
+    results = list(
+        model.map_processes(
+            _generate,
+            range(12),
+            workers=2,
+            max_pending=3,
+            mp_context=multiprocessing.get_context(start_method),
+        )
+    )
+    assert [item for item, _, _ in results] == list(range(12))
+    assert [sequence for _, _, sequence in results] == [
+        f"PROMPT {i}" for i in range(12)
+    ]
+    assert os.getpid() not in {pid for _, pid, _ in results}
+
+
+def test_fork_resets_transport(model):
+    """Verify a forked child opens its own connections and leaves those of the parent"""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("fork is not available")
+    session = model._session
+    model.generate("warm up")
+    parent_http = session._http
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = session._http is None and model.generate("x").sequences == ["X"]
+            ok = ok and session._http is not parent_http
+            os.write(write, b"1" if ok else b"0")
+        finally:
+            os._exit(0)
+    # Without the write end in the parent, a child that died reads as empty, not a hang
+    os.close(write)
+    os.waitpid(pid, 0)
+    with os.fdopen(read, "rb") as result:
+        assert result.read(1) == b"1"
+    assert session._http is parent_http
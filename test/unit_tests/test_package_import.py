@@ -1,5 +1,42 @@
+import json
+import pkgutil
+import subprocess
+import sys
+
 import kscope
 
+# Seconds a cold `import kscope` followed by loading the client may take
+IMPORT_TIME_BUDGET = 1.0
+HEAVY_MODULES = ["torch", "cloudpickle", "aiohttp"]
+
 
 def test_import_kscope():
     assert kscope.__version__ is not None
+
+
+def test_every_submodule_is_exposed():
+    """Verify each module of the package can be reached lazily as an attribute"""
+    modules = {module.name for module in pkgutil.iter_modules(kscope.__path__)}
+    assert modules == kscope._SUBMODULES
+    assert kscope.wire.JSON == "json"
+
+
+def test_cold_import_is_fast_and_torch_free():
+    """Verify a fresh interpreter imports the client quickly without heavy dependencies"""
+    script = f"""
+import json, sys, time
+start = time.perf_counter()
+import kscope
+kscope.Client, kscope.Model, kscope.GatewaySession
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed": elapsed,
+    "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+}}))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, check=True, text=True
+    ).stdout
+    result = json.loads(output)
+    assert result["loaded"] == []
+    assert result["elapsed"] < IMPORT_TIME_BUDGET
@@ -0,0 +1,121 @@
+from collections import Counter
+import time
+
+import pytest
+
+from kscope import GatewayError, ModelPool
+
+from ..mock_gateway import MockGateway
+
+
+def _generate_counts(gateway):
+    return Counter(
+        path.split("/")[3]
+        for method, path, _ in gateway.requests
+        if path.endswith("/generate")
+    )
+
+
+def test_spreads_batches_over_instances(gateway, client):
+    """Verify batches are spread over every active instance of the model"""
+    ids = {gateway.add_instance("llama3-8b") for _ in range(3)}
+    gateway.add_instance("opt-6.7b")
+    pool = client.load_balanced("llama3-8b")
+    assert isinstance(pool, ModelPool)
+    assert {replica.id for replica in pool.replicas} == ids
+
+    prompts = [f"prompt {i}" for i in range(12)]
+    batch = pool.generate_many(prompts, max_batch=2, concurrency=3)
+    assert batch.sequences == [prompt.upper() for prompt in prompts]
+    assert set(_generate_counts(gateway)) == ids
+
+
+def test_ejects_failing_instance(gateway, client):
+    """Verify an instance that disappeared is ejected, then retried once the ejection expires"""
+    ids = [gateway.add_instance("llama3-8b") for _ in range(2)]
+    pool = client.load_balanced("llama3-8b", eject_time=0.2)
+    del gateway.instances[ids[0]]
+
+    for i in range(4):
+        assert pool.generate([f"prompt {i}"]).sequences == [f"PROMPT {i}"]
+    counts = _generate_counts(gateway)
+    assert counts[ids[0]] == 1
+    assert counts[ids[1]] == 4
+
+    # The instance gets traffic again once the ejection expires
+    gateway.instances[ids[0]] = {"id": ids[0], "name": "llama3-8b", "state": "ACTIVE"}
+    time.sleep(0.25)
+    pool.generate(["again"])
+    assert _generate_counts(gateway)[ids[0]] == 2
+
+
+def test_client_error_is_not_failed_over(gateway, client):
+    """Verify a 400 is raised at once, without ejecting any instance"""
+    for _ in range(3):
+        gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b")
+    gateway.fail_next = 1
+    gateway.fail_status = 400
+    with pytest.raises(GatewayError) as err:
+        pool.generate(["prompt"])
+    assert err.value.status_code == 400
+    assert sum(_generate_counts(gateway).values()) == 1
+    assert all(replica.ejected_until == 0.0 for replica in pool._replicas.values())
+
+
+def test_overloaded_instance_backs_off(gateway, client):
+    """Verify a 429 moves the batch to another instance for the Retry-After time only"""
+    for _ in range(3):
+        gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b", eject_time=60)
+    gateway.fail_next = 1
+    gateway.fail_status = 429
+    gateway.retry_after = 0.05
+    assert pool.generate(["prompt"]).sequences == ["PROMPT"]
+    assert sum(_generate_counts(gateway).values()) == 2
+    busy = [r for r in pool._replicas.values() if r.ejected_until > 0]
+    assert len(busy) == 1 and busy[0].ejected_until < time.monotonic() + 1
+
+
+def test_server_error_fails_over(gateway, client):
+    """Verify a 5xx ejects the instance and the batch succeeds on another one"""
+    for _ in range(2):
+        gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b", eject_time=60)
+    gateway.fail_next = 1
+    gateway.fail_status = 500
+    assert pool.generate(["prompt"]).sequences == ["PROMPT"]
+    ejected = [r for r in pool._replicas.values() if r.ejected_until > 0]
+    assert len(ejected) == 1 and ejected[0].ejected_until > time.monotonic() + 30
+
+
+def test_refresh_picks_up_new_instances(gateway, client):
+    """Verify a refresh adds new instances and drops failed ones"""
+    first = gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b")
+    second = gateway.add_instance("llama3-8b")
+    gateway.set_state(first, "FAILED")
+    pool.refresh()
+    assert [replica.id for replica in pool.replicas] == [second]
+
+
+def test_multiple_gateways(gateway, client):
+    """Verify instances behind several gateways all receive traffic"""
+    with MockGateway() as other:
+        gateway.add_instance("llama3-8b")
+        other.add_instance("llama3-8b")
+        pool = client.load_balanced("llama3-8b", gateways=[(other.host, other.port)])
+        assert len(pool.replicas) == 2
+
+        pool.generate_many([f"prompt {i}" for i in range(8)], max_batch=1)
+        assert sum(_generate_counts(gateway).values()) > 0
+        assert sum(_generate_counts(other).values()) > 0
+
+
+def test_requires_active_instance(gateway, client):
+    """Verify a pool needs an active instance and a known strategy"""
+    gateway.add_instance("llama3-8b", state="LOADING")
+    with pytest.raises(ValueError):
+        client.load_balanced("llama3-8b")
+    with pytest.raises(ValueError):
+        client.load_balanced("llama3-8b", strategy="random")
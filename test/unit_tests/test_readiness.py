@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from kscope import GatewayError, ModelLoadError
+from kscope.readiness import ReadinessWaiter
+
+
+@pytest.fixture
+def launching_client(gateway, client):
+    gateway.initial_state = "LAUNCHING"
+    client._readiness = ReadinessWaiter(client._session, min_interval=0.02)
+    return client
+
+
+def activate_later(gateway, state="ACTIVE", delay=0.2):
+    def activate():
+        for instance_id in list(gateway.instances):
+            gateway.set_state(instance_id, state)
+
+    timer = threading.Timer(delay, activate)
+    timer.start()
+    return timer
+
+
+def state_polls(gateway):
+    return [path for method, path, _ in gateway.requests if method == "GET"]
+
+
+def test_wait_for_active(gateway, launching_client):
+    """Verify load_model waits for a launching instance to become active"""
+    activate_later(gateway)
+    model = launching_client.load_model("llama3-8b", wait_for_active=True, timeout=5)
+    assert model.state == "ACTIVE"
+
+
+def test_failed_model_raises(gateway, launching_client):
+    """Verify an instance that fails to load raises ModelLoadError"""
+    activate_later(gateway, state="FAILED")
+    with pytest.raises(ModelLoadError):
+        launching_client.load_model("llama3-8b", wait_for_active=True, timeout=5)
+
+
+def test_wait_times_out(gateway, launching_client):
+    """Verify waiting for an instance that never becomes active times out"""
+    with pytest.raises(TimeoutError):
+        launching_client.load_model("llama3-8b", wait_for_active=True, timeout=0.1)
+
+
+def test_load_models_shares_one_poller(gateway, launching_client):
+    """Verify several launches are polled together with one request per poll"""
+    activate_later(gateway)
+    models = list(
+        launching_client.load_models(["llama3-8b", "opt-6.7b", "llama3-8b"], timeout=5)
+    )
+    assert sorted(model.name for model in models) == [
+        "llama3-8b",
+        "llama3-8b",
+        "opt-6.7b",
+    ]
+    assert set(state_polls(gateway)) == {"/models/instances"}
+
+
+def test_load_models_fails_fast(gateway, launching_client):
+    """Verify load_models raises as soon as one instance fails"""
+    models = launching_client.load_models(["llama3-8b", "opt-6.7b"], timeout=5)
+    failed = next(iter(gateway.instances))
+    gateway.set_state(failed, "FAILED")
+    with pytest.raises(ModelLoadError):
+        list(models)
+
+
+def test_deleted_instance_raises(gateway, launching_client):
+    """Verify waiting for an instance the gateway no longer knows raises its error"""
+    model = launching_client.load_model("llama3-8b")
+    del gateway.instances[model.id]
+    with pytest.raises(GatewayError) as err:
+        launching_client._readiness.wait(model.id, timeout=5)
+    assert err.value.status_code == 404
+
+
+def test_deleted_instance_does_not_hold_back_others(gateway, launching_client):
+    """Verify an instance that cannot be polled does not stall the other watches"""
+    deleted = launching_client.load_model("llama3-8b")
+    launching = launching_client.load_model("opt-6.7b")
+    del gateway.instances[deleted.id]
+    waiting = launching_client._readiness.watch(launching.id)
+    failing = launching_client._readiness.watch(deleted.id)
+    activate_later(gateway)
+
+    assert waiting.result(5) == "ACTIVE"
+    assert isinstance(failing.exception(5), GatewayError)
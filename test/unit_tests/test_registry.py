@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+
+from kscope import Client
+from kscope.utils import GatewayError
+
+
+def gets(gateway, path):
+    return sum(1 for method, p, _ in gateway.requests if method == "GET" and p == path)
+
+
+@pytest.fixture
+def ttl_client(gateway):
+    return Client(
+        gateway.host, gateway.port, auth_key="test_auth_key", registry_ttl=0.2
+    )
+
+
+def test_reads_are_cached(gateway, ttl_client):
+    """Verify models, instances and states are fetched once within the ttl"""
+    model = ttl_client.load_model("llama3-8b")
+    for _ in range(10):
+        assert model.state == "ACTIVE"
+        assert len(ttl_client.model_instances) == 1
+        assert ttl_client.models == gateway.models
+    assert gets(gateway, f"/models/instances/{model.id}") == 1
+    assert gets(gateway, "/models/instances") == 1
+    assert gets(gateway, "/models") == 1
+
+
+def test_listing_instances_caches_their_states(gateway, ttl_client):
+    """Verify listing instances caches the state of each one"""
+    instance_id = gateway.add_instance("llama3-8b", state="LAUNCHING")
+    ttl_client.model_instances
+    assert ttl_client._registry.state(instance_id) == "LAUNCHING"
+    assert gets(gateway, f"/models/instances/{instance_id}") == 0
+
+
+def test_stale_entries_are_refreshed_in_background(gateway, ttl_client):
+    """Verify a stale state is served while a refresh runs in the background"""
+    model = ttl_client.load_model("llama3-8b")
+    assert model.state == "ACTIVE"
+    gateway.set_state(model.id, "FAILED")
+    time.sleep(0.25)
+    assert model.state == "ACTIVE"
+    deadline = time.monotonic() + 2
+    while model.state != "FAILED" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert model.state == "FAILED"
+
+
+def test_concurrent_misses_share_a_request(gateway, ttl_client):
+    """Verify concurrent misses of the same entry send a single request"""
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda _: ttl_client.models, range(64)))
+    assert gets(gateway, "/models") == 1
+
+
+def test_generate_errors_invalidate_the_instance(gateway, ttl_client):
+    """Verify an instance the gateway no longer knows is dropped from the registry"""
+    model = ttl_client.load_model("llama3-8b")
+    assert model.state == "ACTIVE"
+    del gateway.instances[model.id]
+    with pytest.raises(GatewayError) as err:
+        model.generate("What is this")
+    assert err.value.status_code == 404
+    with pytest.raises(GatewayError):
+        model.state
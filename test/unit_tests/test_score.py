@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from kscope import Client, NotSupportedError
+from kscope.batching import context_batches
+
+from ..mock_gateway import mock_score, MockGateway
+
+
+def test_context_batches_send_each_context_once():
+    """Verify pairs are grouped by context and each context is sent once per batch"""
+    contexts = ["a", "b", "a", "c", "a", "b"]
+    continuations = [f"x{i}" for i in range(6)]
+    batches = list(context_batches(contexts, continuations, 4))
+    assert batches == [
+        ([0, 2, 4, 1], ["a", "b"], [(0, "x0"), (0, "x2"), (0, "x4"), (1, "x1")]),
+        ([5, 3], ["b", "c"], [(0, "x5"), (1, "x3")]),
+    ]
+
+
+def test_scores_in_input_order(model):
+    """Verify scores are float64 and returned in input order"""
+    contexts = ["The capital of France is", "2 + 2 =", "The capital of France is"]
+    continuations = [" Paris", " four or so", " the city of Lyon"]
+    scores = model.score(contexts, continuations)
+    assert scores.dtype == np.float64
+    expected = [mock_score(c, x) for c, x in zip(contexts, continuations)]
+    np.testing.assert_allclose(scores, expected)
+
+
+def test_shared_context_is_sent_once_per_batch(gateway, model):
+    """Verify a context shared by every candidate is sent once per request"""
+    context = "Question: which answer is right? Answer:"
+    candidates = [f" candidate {'word ' * i}" for i in range(10)]
+    scores = model.score(context, candidates)
+
+    np.testing.assert_allclose(scores, [mock_score(context, x) for x in candidates])
+    assert [len(call["continuations"]) for call in gateway.score_calls] in (
+        [8, 2],
+        [2, 8],
+    )
+    for call in gateway.score_calls:
+        assert call["contexts"] == [context]
+
+
+def test_retries_failed_batch(monkeypatch, gateway, model):
+    """Verify a failed batch is retried"""
+    monkeypatch.setattr("kscope.kaleidoscope_sdk.RETRY_BACKOFF", 0)
+    gateway.fail_next = 1
+    scores = model.score(["a", "b"], ["x", "y z"], max_retries=1)
+    np.testing.assert_allclose(scores, [mock_score("a", "x"), mock_score("b", "y z")])
+
+
+def test_mismatched_lengths(model):
+    """Verify contexts and continuations must pair up"""
+    with pytest.raises(ValueError):
+        model.score(["a", "b"], ["x"])
+
+
+def test_pool_scores_over_replicas(gateway, client):
+    """Verify a pool spreads scoring over its replicas"""
+    for _ in range(2):
+        gateway.add_instance("llama3-8b")
+    pool = client.load_balanced("llama3-8b")
+    contexts = [f"context {i % 3}" for i in range(20)]
+    continuations = [f"continuation {i}" for i in range(20)]
+    scores = pool.score(contexts, continuations, max_batch=4)
+    np.testing.assert_allclose(
+        scores, [mock_score(c, x) for c, x in zip(contexts, continuations)]
+    )
+
+
+def test_gateway_without_score_endpoint():
+    """Verify scoring fails clearly, without retries, on a gateway lacking the endpoint"""
+    with MockGateway(extensions=False) as gateway:
+        client = Client(gateway.host, gateway.port, auth_key="test_auth_key")
+        model = client.load_model("llama3-8b")
+        with pytest.raises(NotSupportedError, match="score endpoint"):
+            model.score("a", ["x", "y"], max_retries=3)
+        assert len([path for _, path, _ in gateway.requests if "score" in path]) == 1
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+import pytest
+
+from kscope import wire
+from kscope.serialization import (
+    ALIGNMENT,
+    CONTENT_TYPE,
+    decode_tensors,
+    encode_tensors,
+    load_tensors,
+    read_tensors,
+)
+
+
+@pytest.fixture
+def tensors():
+    return {
+        "hidden": np.arange(24, dtype=np.float32).reshape(2, 3, 4),
+        "ids": np.array([3, 1, 4], dtype=np.int64),
+        "empty": np.zeros((0, 5), dtype=np.float16),
+        "mask": np.array([[True, False]]),
+    }
+
+
+def _assert_equal(arrays, expected):
+    assert list(arrays) == list(expected)
+    for name, array in expected.items():
+        assert arrays[name].dtype == array.dtype
+        np.testing.assert_array_equal(arrays[name], array)
+
+
+def test_round_trip(tensors):
+    """Verify arrays of any dtype and shape, and the metadata, survive a round trip"""
+    arrays, metadata = decode_tensors(encode_tensors(tensors, {"layer": "h.0"}))
+    _assert_equal(arrays, tensors)
+    assert metadata == {"layer": "h.0"}
+
+
+def test_decoded_arrays_are_aligned_views(tensors):
+    """Verify decoded arrays are aligned views into the frame, not copies"""
+    frame = np.frombuffer(bytearray(encode_tensors(tensors)), dtype=np.uint8)
+    arrays, _ = decode_tensors(frame)
+    for array in arrays.values():
+        assert np.shares_memory(array, frame) or array.size == 0
+        assert (array.ctypes.data - frame.ctypes.data) % ALIGNMENT == 0
+
+
+def test_non_contiguous_and_torch_inputs():
+    """Verify non-contiguous arrays and torch tensors are encoded"""
+    torch = pytest.importorskip("torch")
+    transposed = np.arange(6, dtype=np.float64).reshape(2, 3).T
+    tensor = torch.ones(2, 2, requires_grad=True)
+    arrays, _ = decode_tensors(encode_tensors({"t": transposed, "torch": tensor}))
+    np.testing.assert_array_equal(arrays["t"], transposed)
+    np.testing.assert_array_equal(arrays["torch"], np.ones((2, 2), dtype=np.float32))
+
+
+def test_read_from_stream(tensors):
+    """Verify a frame is decoded from a stream into writeable arrays"""
+    arrays, _ = read_tensors(io.BytesIO(encode_tensors(tensors)))
+    _assert_equal(arrays, tensors)
+    assert arrays["hidden"].flags.writeable
+
+
+def test_stream_into_memory_mapped_file(tmp_path, tensors):
+    """Verify a frame streamed into a file is decoded as memory-mapped arrays"""
+    path = tmp_path / "activations.kst"
+    arrays, metadata = read_tensors(
+        io.BytesIO(encode_tensors(tensors, {"n": 1})), path, chunk_size=7
+    )
+    _assert_equal(arrays, tensors)
+    assert metadata == {"n": 1}
+    assert not arrays["hidden"].flags.owndata
+    assert not arrays["hidden"].flags.writeable
+    _assert_equal(load_tensors(path)[0], tensors)
+
+
+def test_invalid_frames(tensors):
+    """Verify malformed frames raise a ValueError naming the problem"""
+    frame = encode_tensors(tensors)
+    with pytest.raises(ValueError, match="magic"):
+        decode_tensors(b"PK\x03\x04" + frame[4:])
+    with pytest.raises(ValueError, match="Truncated"):
+        decode_tensors(frame[:-8])
+    with pytest.raises(ValueError, match="Truncated"):
+        read_tensors(io.BytesIO(frame[:-8]))
+    with pytest.raises(TypeError):
+        encode_tensors({"objects": np.array([{}, []], dtype=object)})
+
+
+def test_decode_response():
+    """Verify a binary gateway response is decoded into arrays and metadata"""
+
+    class Response:
+        headers = {"Content-Type": CONTENT_TYPE}
+        content = encode_tensors({"x": np.ones(3)}, {"id": "abc"})
+
+    response = wire.decode_response(Response())
+    assert response["id"] == "abc"
+    np.testing.assert_array_equal(response["tensors"]["x"], np.ones(3))
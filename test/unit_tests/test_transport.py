@@ -0,0 +1,54 @@
+import pytest
+import requests
+
+import kscope
+from kscope import GatewaySession
+
+
+@pytest.fixture
+def session(gateway):
+    session = GatewaySession(gateway.host, gateway.port, "test_auth_key")
+    yield session
+    session.close()
+
+
+def test_connections_are_reused(gateway, session):
+    """Verify consecutive calls share a single keep-alive connection"""
+    instance_id = gateway.add_instance("llama3-8b")
+    for _ in range(5):
+        session.get_model_instance(instance_id)
+        session.generate(instance_id, ["What is this"], {})
+    assert gateway.connections == 1
+
+
+def test_auth_header_not_shared_between_calls(gateway):
+    """Verify the Authorization header of one call does not leak into the next"""
+    url = f"http://{gateway.host}:{gateway.port}/models"
+    kscope.utils.get(url, auth_key="secret")
+    kscope.utils.get(url)
+    assert [auth for _, _, auth in gateway.requests] == ["Bearer secret", None]
+
+
+def test_idempotent_requests_are_retried(gateway, session):
+    """Verify a GET is retried after a transient gateway error"""
+    gateway.fail_next = 1
+    assert session.get_models() == gateway.models
+    assert len(gateway.requests) == 2
+
+
+def test_generate_is_not_retried(gateway, session):
+    """Verify a failed generation is never resubmitted"""
+    instance_id = gateway.add_instance("llama3-8b")
+    gateway.fail_next = 1
+    with pytest.raises(ValueError):
+        session.generate(instance_id, ["What is this"], {})
+    assert len(gateway.requests) == 1
+
+
+def test_timeout(gateway):
+    """Verify a stalled call fails once the session timeout elapses"""
+    gateway.latency = 1.0
+    instance_id = gateway.add_instance("llama3-8b")
+    session = GatewaySession(gateway.host, gateway.port, "test_auth_key", timeout=0.2)
+    with pytest.raises(requests.Timeout):
+        session.generate(instance_id, ["What is this"], {})
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from kscope import GatewaySession
+from kscope.generation import GenerationBatch
+
+from ..mock_gateway import mock_generation
+
+PROMPTS = ["What is this thing", "Who is that"]
+
+
+def make_model(client, gateway, **session_kwargs):
+    session = GatewaySession(
+        gateway.host, gateway.port, "test_auth_key", **session_kwargs
+    )
+    model = client.load_model("llama3-8b")
+    model._session = session
+    return model
+
+
+def expected_logprobs():
+    return [mock_generation(prompt, {})["logprobs"] for prompt in PROMPTS]
+
+
+def test_json_is_the_default(gateway, client):
+    """Verify generation requests use JSON unless another wire format is chosen"""
+    model = make_model(client, gateway)
+    response = model.generate(PROMPTS)
+    assert response.generation["logprobs"] == expected_logprobs()
+    assert gateway.encodings[0]["content_type"] == "application/json"
+
+
+def test_msgpack_logprobs_decode_to_arrays(gateway, client):
+    """Verify binary responses decode into the flat logprobs layout"""
+    pytest.importorskip("msgpack")
+    model = make_model(client, gateway, wire_format="msgpack")
+    response = model.generate(PROMPTS)
+    assert gateway.encodings[0]["content_type"] == "application/x-msgpack"
+    assert response.generation["sequences"] == [p.upper() for p in PROMPTS]
+    assert response.logprobs.dtype == np.float32
+    assert response.generation["logprobs"] == expected_logprobs()
+
+
+def test_msgpack_falls_back_to_json(gateway, client):
+    """Verify a gateway without msgpack support is answered in JSON"""
+    pytest.importorskip("msgpack")
+    gateway.supports_msgpack = False
+    model = make_model(client, gateway, wire_format="msgpack")
+    response = model.generate(PROMPTS)
+    assert gateway.encodings[0]["content_type"] == "application/json"
+    assert response.generation["logprobs"] == expected_logprobs()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_requests(gateway, client, compression):
+    """Verify compressed requests and responses round trip"""
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    model = make_model(client, gateway, compression=compression)
+    response = model.generate(PROMPTS)
+    assert gateway.encodings[0]["request_encoding"] == compression
+    assert gateway.encodings[0]["content_encoding"] is not None
+    assert response.generation["sequences"] == [p.upper() for p in PROMPTS]
+
+
+def test_binary_batch_shares_the_decoded_buffer():
+    """Verify a binary response is used without copying its logprobs"""
+    pytest.importorskip("msgpack")
+    from kscope import wire
+
+    raw = {"generation": {"sequences": ["a"], "logprobs": [[-1.0, -2.0]]}}
+    decoded = wire.unpack(wire.pack_generation_response(raw))
+    batch = GenerationBatch.from_response(decoded)
+    assert batch.logprobs is decoded["generation"]["logprobs"]["values"]
+    assert batch.generation == raw["generation"]